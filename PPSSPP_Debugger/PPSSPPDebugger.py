@@ -7,7 +7,7 @@ import websockets
 import requests
 import json
 import ipaddress
-from typing import Union, Optional, Set, Dict, Tuple, Any
+from typing import Union, Optional, Set, Dict, Tuple, Any, AsyncIterator
 
 
 class PPSSPP_bitness(enum.Enum):
@@ -225,6 +225,20 @@ class PPSSPP_Debugger:
                 response = json.loads(await ws.recv())
             return response
 
+    async def receive_events(self, receive_events: Set[str], error_event: str, timeout: Optional[float] = None) \
+            -> AsyncIterator[Optional[dict]]:
+        # Unlike block_until_any, the connection stays open between the events, so none of them is lost
+        # None is yielded when no event has come for timeout seconds
+        async with websockets.connect(self.connection_URI) as ws:
+            while True:
+                try:
+                    response = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if response["event"] in receive_events or response["event"] == error_event:
+                    yield response
+
     async def send_request_receive_answer(self, request: str, receive_event: str, error_event: str) -> dict:
         async with websockets.connect(self.connection_URI) as ws:
             await ws.send(request)
@@ -481,7 +495,8 @@ class PPSSPP_Debugger:
         request = str(args)
         return await self.send_request_receive_answer(request, event, const_error_event)
 
-    async def gpu_buffer_clut(self, type: str, alpha: Optional[bool] = None, stackWidth: Optional[int] = None):  # unfinished
+    async def gpu_buffer_clut(self, type: str, alpha: Optional[bool] = None,
+                              stackWidth: Optional[int] = None):  # unfinished
         event = "gpu.buffer.clut"
         args = API_args(event)
         args.add(type=type)
@@ -3,11 +3,17 @@ import time
 
 import PPSSPPDebugger
 import asyncio
-from typing import Callable, List, Dict, Union, Tuple, Any, NamedTuple, Set, Optional
+from typing import Callable, List, Dict, Union, Tuple, Any, NamedTuple, Set, Optional, Iterator
 import FrozenKeysDict
+from string_decoding import decode_string, decode_terminated_string, find_terminator
+from pickle_cache import load_cache, save_cache, load_json_cache, save_json_cache
 # import copy
 import struct
-from collections import Counter
+import sys
+import bisect
+from array import array
+import mmap
+from collections import Counter, OrderedDict
 from pathlib import Path
 import hashlib
 import parse
@@ -22,6 +28,11 @@ const_overlay_code_start = 0x08ABB200
 const_ol_azito_bin_size = 1091840
 const_ol_mission_bin_size = 893312
 const_ol_title_bin_size = 144384
+const_instruction_set_cache_magic = "PAC instruction set"
+const_instruction_set_cache_version = 2
+# where the compiled instruction sets go by default, not next to the text file (its directory may be read-only)
+const_cache_directory = Path(os.environ.get("LOCALAPPDATA") or Path.home() / ".cache") / "PataponDebugger"
+const_uint32_typecode = "I" if array("I").itemsize == 4 else "L"
 
 
 def load_file_by_path(path: str) -> bytes:
@@ -30,51 +41,45 @@ def load_file_by_path(path: str) -> bytes:
         return source.read()
 
 
+class Empty_mapped_file(bytes):
+    # Stands in for the mmap object of an empty file (mmap can't map 0 bytes), it can be closed and used in "with"
+    def __enter__(self) -> "Empty_mapped_file":
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+def map_file_by_path(path: str) -> Union[mmap.mmap, Empty_mapped_file]:
+    # Maps the file with given path into memory in read-only mode and returns the mmap object
+    # (NOTE: the file is not read until its pages are accessed; close the mmap when you are done!)
+    with open(path, "rb") as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            return Empty_mapped_file()
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
 def read_string_from_bytes(data: bytes, offset: int, length: int = -1) -> str:
-    # If length is -1, reads bytes one by one in utf-8 encoding until the zero byte is read
+    # If length is -1, decodes the utf-8 bytes up to the zero byte (see string_decoding)
     # (NOTE: the zero byte is not included in the resulting string!)
     # If length is not -1, calls bytes.decode("utf-8")
     # (NOTE: in this case the zero byte is not trimmed if it ends up in the range!)
-    res = ""
     if length == -1:
-        address = offset
-        one_byte = data[address:address + 1]
-        val = int.from_bytes(one_byte, "big")
-        char = one_byte.decode("utf-8")
-        while val != 0:
-            res += char
-            address += 1
-            one_byte = data[address:address + 1]
-            val = int.from_bytes(one_byte, "big")
-            char = one_byte.decode("utf-8")
-    else:
-        raw = data[offset:offset + length]
-        res = raw.decode("utf-8")
-    return res
+        return decode_string(data, offset, "utf-8")
+    return data[offset:offset + length].decode("utf-8")
 
 
 def read_shift_jis_from_bytes(data: bytes, offset: int, length: int = -1) -> str:
-    # If length is -1, reads groups of 2 bytes in shift-jis encoding until the zero byte is read
+    # If length is -1, decodes the shift-jis bytes up to the zero byte (see string_decoding)
     # (NOTE: the zero byte is not included in the resulting string!)
     # If length is not -1, calls bytes.decode("shift-jis")
     # (NOTE: in this case the zero byte is not trimmed if it ends up in the range!)
-    res = ""
     if length == -1:
-        address = offset
-        two_bytes = data[address:address + 2]
-        val = int.from_bytes(two_bytes, "big")
-        char = two_bytes.decode("shift-jis")
-        while val != 0:
-            res += char
-            address += 2
-            two_bytes = data[address:address + 2]
-            val = int.from_bytes(two_bytes, "big")
-            char = two_bytes.decode("shift-jis")
-    else:
-        raw = data[offset:offset + length]
-        res = raw.decode("shift-jis")
-    return res
-    pass
+        return decode_string(data, offset, "shift-jis")
+    return data[offset:offset + length].decode("shift-jis")
 
 
 def read_wstring_from_bytes(data: bytes, offset: int, length: int = -1) -> str:
@@ -84,27 +89,13 @@ def read_wstring_from_bytes(data: bytes, offset: int, length: int = -1) -> str:
     :param length: [optional] length of the range measured in characters
     :return: wide string in the utf-16 encoding
     """
-    # If length is -1, reads groups of 2 bytes in utf - 16 encoding until the zero byte is read
-    # (NOTE: the zero byte is not included in the resulting string!)
+    # If length is -1, decodes the utf-16 characters up to the zero character (see string_decoding)
+    # (NOTE: the zero character is not included in the resulting string!)
     # If length is not -1, calls bytes.decode("utf-16")
-    # (NOTE: in this case the zero byte is not trimmed if it ends up in the range!)
-    res = ""
+    # (NOTE: in this case the zero character is not trimmed if it ends up in the range!)
     if length == -1:
-        address = offset
-        two_bytes = data[address:address + 2]
-        val = int.from_bytes(two_bytes, "big")
-        char = two_bytes.decode("utf-16")
-        while val != 0:
-            res += char
-            address += 2
-            two_bytes = data[address:address + 2]
-            val = int.from_bytes(two_bytes, "big")
-            char = two_bytes.decode("utf-16")
-    else:
-        raw = data[offset:offset + 2 * length]
-        res = raw.decode("utf-16")
-    return res
-    pass
+        return decode_string(data, offset, "utf-16-le", 2)
+    return data[offset:offset + 2 * length].decode("utf-16")
 
 
 def read_int_from_bytes(data: bytes, offset: int, byteorder: str) -> int:
@@ -126,16 +117,16 @@ def read_float_from_bytes(data: bytes, offset: int) -> float:
 
 
 def is_PAC_msg_table(data: bytes) -> bool:
-    if len(data) % 4 != 0:
+    # 00 00 00 00 01 00 00 00 02 00 00 00...
+    size = len(data)
+    if size % 4 != 0:
         return False
-    i = 0
-    offset = 0
-    while offset < len(data):
-        if i != read_int_from_bytes(data, offset, "little"):
-            return False
-        i += 1
-        offset += 4
-    return True
+    if size == 0:
+        return True
+    # Most blobs fail on the first or the last int, so we don't compare them as a whole
+    if data[0:4] != b"\x00\x00\x00\x00" or read_int_from_bytes(data, size - 4, "little") != size // 4 - 1:
+        return False
+    return unpack_uint32_array(data) == array(const_uint32_typecode, range(size // 4))
 
 
 def binary_search(array: List, val: int) -> int:
@@ -279,34 +270,76 @@ def analyze_instruction_set(file_path: str):
 
 
 def read_PAC_string_argument(data: bytes, offset: int) -> Tuple[str, int]:
-    original_offset = offset
-    while data[offset] != 0:
-        offset += 1
-    length = offset - original_offset + 1
-    return read_shift_jis_from_bytes(data, original_offset, length), length
+    # (the zero byte is included in both the string and the length)
+    return decode_terminated_string(data, offset, "shift-jis")
 
 
 def is_PAC_instruction(data: bytes, offset: int) -> bool:
     return data[offset] == 0x25 and data[offset + 3] <= 0x23
 
 
+# 0 and powers of 2 up to 0x40
+const_left_out_arg_types = bytes([0x0, 0x1, 0x2, 0x4, 0x8, 0x10, 0x20, 0x40])
+
+
 def is_left_out_PAC_args(data: bytes) -> bool:
     # if len(data) % 4 != 0:
     if len(data) % 8 != 0:
         return False
     # NB! So far this function returns false negative for args that only take up 4 bytes
-    potential_args = [data[4 * i: 4 * i + 4] for i in range(0, len(data) // 4, 2)]
-    for arg in potential_args:
-        val = int.from_bytes(arg, "little")
-        if val > 64 or val & (val - 1) != 0:  # val is not a power of 2
-            return False
-    return True
+    # Every other int is an arg type (0 or a power of 2 that is not bigger than 64), so the lowest bytes of these
+    # ints must be in const_left_out_arg_types and the other bytes must be zeroes.
+    # We check the first arg type alone since it fails most of the time
+    if not data:
+        return True
+    if data[1:4] != b"\x00\x00\x00" or data[0] not in const_left_out_arg_types:
+        return False
+    if data[0::8].translate(None, const_left_out_arg_types):
+        return False
+    return not (data[1::8] + data[2::8] + data[3::8]).strip(b"\x00")
 
 
 def unpack_int_from_bytes(int_bytes: bytes) -> int:
     return int.from_bytes(int_bytes, "little")
 
 
+def unpack_uint32_array(data: bytes) -> array:
+    # little-endian uint32 values from data (the bytes after the last whole int are ignored)
+    values = array(const_uint32_typecode)
+    values.frombytes(data[0:len(data) // 4 * 4])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pack_uint32_array(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(const_uint32_typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def splice_offsets_dict(data: Dict[int, Any], start: int, end: int, replacement: Dict[int, Any]):
+    """
+    Replaces all items of data with keys in the range [start; end) with the items of replacement \n
+    Both dictionaries must be ordered by their keys (file offsets); the order is preserved
+    :param data: the dictionary to modify
+    :param start: the first key of the range
+    :param end: the key after the range
+    :param replacement: items with keys in the range [start; end)
+    """
+    keys = list(data)
+    lo = bisect.bisect_left(keys, start)
+    hi = bisect.bisect_left(keys, end)
+    if lo == hi and not replacement:
+        return
+    tail = [(key, data[key]) for key in keys[hi:]]
+    for key in keys[lo:]:
+        del data[key]
+    data.update(replacement)
+    data.update(tail)
+
+
 class Memory_entity:
     def __init__(self):
         self.memory_location: int = 0
@@ -355,45 +388,221 @@ class MSG_file(Patapon_file):
         self.computed: bool = False
         self.packed: bool = True
         self.strings: List[str] = []
+        self.offsets: array = array(const_uint32_typecode)  # message index -> offset of its string
+        # message index -> decoded string, the least recently used ones are dropped when cache_size is exceeded
+        self.decoded: OrderedDict = OrderedDict()
+        self.cache_size: Optional[int] = None  # None for no limit
 
     def initialize_by_raw_data(self, raw):
         Memory_entity.initialize_by_raw_data(self, raw)
         self.msg_count = int.from_bytes(self.raw_data[0:4], "little")
         self.magic = int.from_bytes(self.raw_data[4:8], "little")
+        self.offsets = unpack_uint32_array(self.raw_data[8:8 + 4 * self.msg_count])
+        self.decoded.clear()
+
+    def set_cache_size(self, cache_size: Optional[int]):
+        self.cache_size = cache_size
+        if cache_size is not None:
+            while len(self.decoded) > cache_size:
+                self.decoded.popitem(last=False)
+
+    def decode_item(self, index: int) -> str:
+        return read_wstring_from_bytes(self.raw_data, self.offsets[index])
 
     def compute_items(self, packed: bool = False):
         self.packed = packed
         if packed:
-            first = unpack_int_from_bytes(self.raw_data[8:12])
-            for i in range(self.msg_count - 1):
-                # first is precomputed
-                second = unpack_int_from_bytes(self.raw_data[12 + 4 * i:16 + 4 * i])
-                self.strings.append(
-                    read_wstring_from_bytes(self.raw_data, first, (second - first) // 2).replace("\x00", "")
-                )
-                first = second
-            # now first = the last offset
-            self.strings.append(
-                read_wstring_from_bytes(self.raw_data, first, self.size - first).replace("\x00", "")
-            )
+            # every string takes the bytes up to the next one
+            for i in range(self.msg_count):
+                end = self.offsets[i + 1] if i + 1 < self.msg_count else self.size
+                self.strings.append(self.raw_data[self.offsets[i]:end].decode("utf-16-le").replace("\x00", ""))
             return
+        # the strings are what __getitem__ decodes, so they replace the decoded ones
         for i in range(self.msg_count):
-            self.strings.append(
-                read_wstring_from_bytes(self.raw_data, unpack_int_from_bytes(self.raw_data[8 + 4 * i:12 + 4 * i]))
-            )
+            res = self.decoded.get(i)
+            self.strings.append(self.decode_item(i) if res is None else res)
+        self.decoded.clear()
+        self.computed = True
+
+    def __len__(self) -> int:
+        return self.msg_count
 
     def __getitem__(self, index: int) -> str:
         # given that we don't compute strings array when loading
         if self.raw_data == b"":
             raise RuntimeError("MSG file is not initialized")
-        if index >= self.msg_count:
+        if not 0 <= index < self.msg_count:
             raise IndexError(f"{index} is not a correct index")
         if self.computed:
             return self.strings[index]
-        offset_bytes = self.raw_data[8 + 4 * index: 12 + 4 * index]
-        offset = int.from_bytes(offset_bytes, "little")
-        return read_wstring_from_bytes(self.raw_data, offset)
-        pass
+        res = self.decoded.get(index)
+        if res is not None:
+            self.decoded.move_to_end(index)
+            return res
+        res = self.decoded[index] = self.decode_item(index)
+        if self.cache_size is not None and len(self.decoded) > self.cache_size:
+            self.decoded.popitem(last=False)
+        return res
+
+
+class Tracked_MSG_file(MSG_file):
+    """
+    MSG file that follows its copy in the emulator memory (the game swaps the text when the language changes or a
+    DLC map is loaded). The file is split into pages: poll() finds the pages whose bytes have changed and only the
+    strings that have bytes in them are compared and decoded again. A poll costs one read of the file and one
+    comparison per page, or (if the caller knows the written ranges, e.g. from a memory breakpoint log) one read per
+    written page; the strings of the untouched pages cost nothing. \n
+    The subscribers are called with the file and the indexes of the changed strings
+    """
+    def __init__(self, read: Callable[[int, int], bytes], address: int, size: int, page_size: int = 0x1000):
+        """
+        :param read: function that reads (address, size) from the emulator memory (e.g. PataponDebugger.dump_memory)
+        """
+        MSG_file.__init__(self)
+        self.read = read
+        self.memory_location = address
+        self.size_in_memory = size
+        self.page_size = page_size
+        self.computed = True
+        self.string_ends = array(const_uint32_typecode)  # message index -> offset after its terminator
+        self.page_strings: Dict[int, Set[int]] = {}  # page -> indexes of the strings with bytes in it
+        self.subscribers: List[Callable[["Tracked_MSG_file", List[int]], None]] = []
+        self.update(self.read(address, size))
+
+    def string_end(self, index: int) -> int:
+        offset = self.offsets[index]
+        end = find_terminator(self.raw_data, offset, 2)
+        return self.size if end == -1 else end + 2
+
+    def string_pages(self, offset: int, end: int) -> range:
+        return range(offset // self.page_size, (max(end, offset + 1) - 1) // self.page_size + 1)
+
+    def index_pages(self):
+        self.string_ends = array(const_uint32_typecode, (self.string_end(index) for index in range(len(self.offsets))))
+        self.page_strings = {}
+        for index, (offset, end) in enumerate(zip(self.offsets, self.string_ends)):
+            for page in self.string_pages(offset, end):
+                self.page_strings.setdefault(page, set()).add(index)
+
+    def decode_string(self, index: int) -> str:
+        try:
+            return self.decode_item(index)
+        except UnicodeDecodeError:
+            # the game may be writing the string right now, it will be decoded again when it changes
+            offset = self.offsets[index]
+            end = find_terminator(self.raw_data, offset, 2)
+            return self.raw_data[offset:self.size if end == -1 else end].decode("utf-16-le", "replace")
+
+    def update(self, raw: bytes, dirty_pages: Optional[List[int]] = None) -> List[int]:
+        """
+        :param dirty_pages: the only pages that may differ from the current data (None if unknown)
+        :return: indexes of the strings that were changed, added or removed
+        """
+        old_raw = self.raw_data
+        old_offsets = self.offsets
+        old_ends = self.string_ends
+        old_count = len(self.strings)
+        header_size = 8 + 4 * old_count
+        if dirty_pages is not None and old_count and len(raw) == len(old_raw) and \
+                raw[:header_size] == old_raw[:header_size]:
+            # the strings stay where they were
+            self.initialize_by_raw_data(raw)
+            candidates = set()
+            for page in dirty_pages:
+                candidates.update(self.page_strings.get(page, ()))
+            changed = []
+            for index in sorted(candidates):
+                offset = self.offsets[index]
+                end = self.string_end(index)
+                if raw[offset:end] == old_raw[offset:old_ends[index]]:
+                    continue
+                self.strings[index] = self.decode_string(index)
+                changed.append(index)
+                if end != old_ends[index]:
+                    for page in self.string_pages(offset, old_ends[index]):
+                        self.page_strings[page].discard(index)
+                    for page in self.string_pages(offset, end):
+                        self.page_strings.setdefault(page, set()).add(index)
+                    self.string_ends[index] = end
+            return changed
+
+        # the layout has changed, every string is compared
+        self.initialize_by_raw_data(raw)
+        self.index_pages()
+        count = len(self.offsets)
+        changed = []
+        for index in range(count):
+            if index >= old_count:
+                self.strings.append(self.decode_string(index))
+                changed.append(index)
+            elif raw[self.offsets[index]:self.string_ends[index]] != \
+                    old_raw[old_offsets[index]:old_ends[index]]:
+                self.strings[index] = self.decode_string(index)
+                changed.append(index)
+        del self.strings[count:]
+        changed += range(count, old_count)
+        return changed
+
+    def poll(self, ranges: Optional[List[Tuple[int, int]]] = None) -> List[int]:
+        """
+        Reads the file from the memory, decodes the changed strings and notifies the subscribers
+        :param ranges: (address, size) of the memory known to be written since the last poll, only their pages are
+        read (None reads the whole file)
+        :return: indexes of the changed strings
+        """
+        page_size = self.page_size
+        if ranges is None:
+            raw = self.read(self.memory_location, self.size_in_memory)
+            if raw == self.raw_data:
+                return []
+            dirty_pages = None
+            if len(raw) == len(self.raw_data):
+                dirty_pages = [page for page in range((len(raw) + page_size - 1) // page_size)
+                               if raw[page * page_size:(page + 1) * page_size] !=
+                               self.raw_data[page * page_size:(page + 1) * page_size]]
+        else:
+            pages = set()
+            for address, size in ranges:
+                start = max(address - self.memory_location, 0)
+                end = min(address + size - self.memory_location, self.size)
+                if start < end:
+                    pages.update(range(start // page_size, (end - 1) // page_size + 1))
+            patched = bytearray(self.raw_data)
+            dirty_pages = []
+            for page in sorted(pages):
+                start = page * page_size
+                data = self.read(self.memory_location + start, min(page_size, self.size - start))
+                if data != patched[start:start + len(data)]:
+                    patched[start:start + len(data)] = data
+                    dirty_pages.append(page)
+            if not dirty_pages:
+                return []
+            raw = bytes(patched)
+        changed = self.update(raw, dirty_pages)
+        if changed:
+            for subscriber in list(self.subscribers):
+                subscriber(self, changed)
+        return changed
+
+    def relocate(self, address: int, size: int) -> List[int]:
+        # the game has loaded the file at another address
+        self.memory_location = address
+        self.size_in_memory = size
+        return self.poll()
+
+    def subscribe(self, subscriber: Callable[["Tracked_MSG_file", List[int]], None]):
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: Callable[["Tracked_MSG_file", List[int]], None]):
+        self.subscribers.remove(subscriber)
+
+    def watch(self, interval: float, stop: Callable[[], bool]):
+        """
+        Polls the file every interval seconds until stop() returns True
+        """
+        while not stop():
+            self.poll()
+            time.sleep(interval)
 
 
 # address;A;B;C;D;raw_size(hex);function_name;extended_name;function_desc;param_amount;
@@ -431,10 +640,79 @@ class PAC_instruction_template:
         # how can we freeze this list?
         pass
 
+    def to_compiled(self) -> list:
+        # JSON types only, so that loading a compiled instruction set can't run code
+        return [self.signature, self.function_address, self.name, self.description,
+                [[param.type, param.name] for param in self.PAC_params]]
+
+    @classmethod
+    def from_compiled(cls, data: list) -> "PAC_instruction_template":
+        template = cls.__new__(cls)
+        template.signature, template.function_address, template.name, template.description, params = data
+        template.PAC_params = [PAC_instruction_param(*param) for param in params]
+        return template
+
+
+class Compiled_instruction_set(NamedTuple):
+    templates: List[PAC_instruction_template]
+    function_offsets: List[int]  # sorted function addresses (see PataponDebugger.Eboot_PAC_function_offsets)
+    inxJmp_signature: int
+
+
+def compile_instruction_set(templates: List[PAC_instruction_template]) -> Compiled_instruction_set:
+    inxJmp_signature = 0x0
+    for template in templates:
+        if template.name == "cmd_inxJmp":
+            inxJmp_signature = template.signature
+    return Compiled_instruction_set(templates, sorted(template.function_address for template in templates),
+                                    inxJmp_signature)
+
+
+def default_compiled_instruction_set_path(source_digest: bytes) -> Path:
+    # named after the text, so different instruction sets don't replace each other's compiled file
+    return const_cache_directory / f"instruction_set_{source_digest.hex()}.json"
+
+
+def load_compiled_instruction_set(path, source_digest: bytes) -> Optional[Compiled_instruction_set]:
+    """
+    :param path: compiled instruction set path
+    :param source_digest: md5 digest of the instruction set text file
+    :return: the instruction set or None if the file is missing, broken, outdated or was compiled from another text
+    """
+    compiled = load_json_cache(path, [const_instruction_set_cache_magic, const_instruction_set_cache_version,
+                                      source_digest.hex()])
+    if compiled is None:
+        return None
+    try:
+        return Compiled_instruction_set([PAC_instruction_template.from_compiled(data)
+                                         for data in compiled["templates"]],
+                                        compiled["function_offsets"], compiled["inxJmp_signature"])
+    except Exception:
+        return None
+
+
+def save_compiled_instruction_set(path, source_digest: bytes, compiled: Compiled_instruction_set):
+    # The pac_corpus workers read the instruction set at the same time, the file is replaced in one go so none of
+    # them sees it half-written
+    try:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        save_json_cache(path, [const_instruction_set_cache_magic, const_instruction_set_cache_version,
+                               source_digest.hex()],
+                        {"templates": [template.to_compiled() for template in compiled.templates],
+                         "function_offsets": compiled.function_offsets,
+                         "inxJmp_signature": compiled.inxJmp_signature})
+    except OSError as e:
+        # Not fatal, the instruction set will be parsed again next time
+        print(f"Cannot save the compiled instruction set to {path}:", e)
+
 
 class PAC_instruction(Memory_entity):
 
-    def __init__(self, raw: bytes, offset: int, template: PAC_instruction_template):
+    def __init__(self, raw: bytes, offset: int, template: PAC_instruction_template,
+                 read_string: Callable[[bytes, int], Tuple[str, int]] = read_PAC_string_argument):
+        """
+        :param read_string: decodes the string args, see read_PAC_string_argument
+        """
         Memory_entity.__init__(self)
 
         self.function_address = template.function_address
@@ -539,7 +817,7 @@ class PAC_instruction(Memory_entity):
                 params_dict[param] = val
                 offset += 4
             elif param.type == "string":
-                val, length = read_PAC_string_argument(raw, offset)
+                val, length = read_string(raw, offset)
 
                 # This is a test
                 val = val.replace("\x00", "")
@@ -809,14 +1087,13 @@ class Switch_case_table(Memory_entity):
     def __init__(self):
         Memory_entity.__init__(self)
         # self.number_of_branches = 0
-        self.branches: List[int] = []
+        self.branches: array = array(const_uint32_typecode)
 
     def initialize_by_raw_data(self, raw: bytes):
         self.raw_data = raw
         self.size = len(raw)
         # self.number_of_branches = self.size // 4
-        branches = [raw[4 * i: 4 * i + 4] for i in range(self.size // 4)]
-        self.branches = list(map(unpack_int_from_bytes, branches))
+        self.branches = unpack_uint32_array(raw)
         pass
 
     def __str__(self):
@@ -920,8 +1197,8 @@ class ContiguousCodeBlock:
         :return: True on success
         """
         # valid_start = contains_bsearch(self.instructions_offsets, to)
-        if not contains_bsearch(self.instructions_offsets, to):
-            # This means the same as "if to not in self.instructions_offsets"
+        if to not in self.instructions:
+            # self.instructions has the same keys as self.instructions_offsets, but the lookup is O(1)
 
             # We only accept this when the offset is pointing to the part that goes before the block
             if to < self.instructions_offsets[0]:
@@ -972,6 +1249,10 @@ class ContiguousCodeBlock:
         return next(iter(self.entry_points.values()))
 
 
+PAC_entity = Union[Memory_entity, Padding_bytes, Switch_case_table, PAC_message_table,
+                   Left_out_PAC_arguments, Unknown_PAC_instruction, PAC_instruction]
+
+
 class PAC_file(Patapon_file):
     def __init__(self):
         Patapon_file.__init__(self)
@@ -1031,6 +1312,89 @@ class PAC_file(Patapon_file):
             return {}
         return self.instructions[signature]  # can we not search for it again?
 
+    def forget_entities(self) -> int:
+        """
+        Removes all entities from the file except for the last one (PAC_parser.stream uses this)\n
+        The counters are not reset
+        :return: the number of entities left (0 or 1)
+        """
+        if not self.entities_offsets:
+            return 0
+        last_offset = self.entities_offsets[-1]
+        last_entity = self.entities[last_offset]
+
+        self.cut_instructions.clear()
+        self.raw_entities.clear()
+        self.padding_bytes.clear()
+        self.switch_case_tables.clear()
+        self.left_out_PAC_arguments.clear()
+        self.msg_tables.clear()
+        self.instructions.clear()
+        self.unknown_instructions.clear()
+        self.ordered_instructions.clear()
+        self.entities.clear()
+
+        self.entities_offsets = [last_offset]
+        self.entities[last_offset] = last_entity
+        if type(last_entity) is PAC_instruction:
+            self.ordered_instructions[last_offset] = last_entity
+        return 1
+
+    def patch(self, offset: int, data: bytes) -> Tuple[int, int]:
+        """
+        Overwrites the raw data bytes starting from offset (the size of the file does not change)\n
+        :param offset: file offset
+        :param data: new bytes
+        :return: the modified range as an (offset, size) pair, ready to be passed to PAC_parser.reparse
+        """
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError(f"Cannot patch {len(data)} bytes at offset 0x{offset:X}: file size is {self.size} bytes")
+        self.raw_data = self.raw_data[:offset] + data + self.raw_data[offset + len(data):]
+        return offset, len(data)
+
+    def replace_entities(self, start: int, end: int, replacement: "PAC_file"):
+        """
+        Replaces every entity located in the range [start; end) with the entities of replacement\n
+        :param start: offset of the first replaced entity
+        :param end: offset of the first entity that is kept (or the file size)
+        :param replacement: PAC file that contains the entities of the range (and nothing else)
+        :return: Does not return anything
+        """
+        lo = bisect.bisect_left(self.entities_offsets, start)
+        hi = bisect.bisect_left(self.entities_offsets, end)
+        old_signatures: Set[int] = set()
+        old_unknown_signatures: Set[int] = set()
+        for offset in self.entities_offsets[lo:hi]:
+            entity = self.entities[offset]
+            if type(entity) is PAC_instruction:
+                old_signatures.add(entity.signature)
+            elif type(entity) is Unknown_PAC_instruction:
+                old_unknown_signatures.add(entity.signature)
+                self.unknown_instructions_count -= 1
+        self.unknown_instructions_count += replacement.unknown_instructions_count
+        self.entities_offsets[lo:hi] = replacement.entities_offsets
+
+        splice_offsets_dict(self.entities, start, end, replacement.entities)
+        splice_offsets_dict(self.ordered_instructions, start, end, replacement.ordered_instructions)
+        splice_offsets_dict(self.cut_instructions, start, end, replacement.cut_instructions)
+        splice_offsets_dict(self.raw_entities, start, end, replacement.raw_entities)
+        splice_offsets_dict(self.padding_bytes, start, end, replacement.padding_bytes)
+        splice_offsets_dict(self.switch_case_tables, start, end, replacement.switch_case_tables)
+        splice_offsets_dict(self.left_out_PAC_arguments, start, end, replacement.left_out_PAC_arguments)
+        splice_offsets_dict(self.msg_tables, start, end, replacement.msg_tables)
+        self.cut_instructions_count = len(self.cut_instructions)
+
+        for signatures, by_signature, new_by_signature in (
+            (old_signatures, self.instructions, replacement.instructions),
+            (old_unknown_signatures, self.unknown_instructions, replacement.unknown_instructions)
+        ):
+            for signature in signatures | new_by_signature.keys():
+                if signature not in by_signature:
+                    by_signature[signature] = {}
+                splice_offsets_dict(by_signature[signature], start, end, new_by_signature.get(signature, {}))
+                if not by_signature[signature]:
+                    del by_signature[signature]
+
 
 class CPU_breakpoint:
     def __init__(self):
@@ -1089,6 +1453,70 @@ def defaultMayBeInstruction(signature: int) -> bool:
     return signature % 256 != 0
 
 
+# Entities the parsing can be restarted from (see PAC_parser.reparse)
+resync_entity_types = (PAC_instruction, Unknown_PAC_instruction)
+
+
+class PAC_parser_phase:
+    """
+    Number of calls, total time and a histogram of durations (bucket k counts calls that took [2^(k-1); 2^k) ns)
+    """
+    def __init__(self):
+        self.calls: int = 0
+        self.total_ns: int = 0
+        self.histogram: List[int] = [0] * 64
+
+    def add(self, duration_ns: int):
+        self.calls += 1
+        self.total_ns += duration_ns
+        self.histogram[min(duration_ns.bit_length(), 63)] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "seconds": self.total_ns / 1e9,
+            "histogram": {f"<{2 ** bucket}ns": count for bucket, count in enumerate(self.histogram) if count}
+        }
+
+
+class PAC_parser_profile:
+    """
+    Counters collected by PAC_parser when the profiling is enabled (see PAC_parser.enable_profiling). \n
+    Phases: "scan" (findNextInstruction), "decode" (processInstruction), "raw data" (processRawData, i.e.
+    MSG table and left out args classification), "unknown" (processUnknownInstruction) and "shift-jis"
+    (string arguments decoding). Phases are nested: "decode" includes "shift-jis", "scan" and so on
+    """
+    def __init__(self):
+        self.bytes_scanned: int = 0
+        self.candidates_checked: int = 0
+        self.candidates_rejected: int = 0
+        self.phases: Dict[str, PAC_parser_phase] = {}
+        self.signatures: Dict[int, PAC_parser_phase] = {}
+
+    def phase(self, name: str) -> PAC_parser_phase:
+        if name not in self.phases:
+            self.phases[name] = PAC_parser_phase()
+        return self.phases[name]
+
+    def signature_phase(self, signature: int) -> PAC_parser_phase:
+        if signature not in self.signatures:
+            self.signatures[signature] = PAC_parser_phase()
+        return self.signatures[signature]
+
+    def to_dict(self) -> dict:
+        return {
+            "bytes scanned": self.bytes_scanned,
+            "candidates checked": self.candidates_checked,
+            "candidates rejected": self.candidates_rejected,
+            "phases": {name: phase.to_dict() for name, phase in self.phases.items()},
+            "signatures": {f"{signature:08X}": phase.to_dict() for signature, phase in self.signatures.items()}
+        }
+
+    def save_json(self, path: Path):
+        with open(path, "w", encoding="utf-8") as output:
+            json.dump(self.to_dict(), output, indent=4)
+
+
 class PAC_parser:
     def __init__(self):
         self.templates: Dict[int, PAC_instruction_template] = {}
@@ -1104,6 +1532,9 @@ class PAC_parser:
         self.last_offset = 0
         self.last_was_instruction = False
         self.cur_signature = 0x0
+        self.profile: Optional[PAC_parser_profile] = None
+        # passed to every PAC_instruction this parser creates
+        self.read_string_argument: Callable[[bytes, int], Tuple[str, int]] = read_PAC_string_argument
 
     def mayBeInstruction(self, signature: int):
         return self.instruction_heuristic(signature)
@@ -1111,29 +1542,115 @@ class PAC_parser:
     def setTemplates(self, PAC_instruction_templates: Dict[int, PAC_instruction_template]):
         self.templates = PAC_instruction_templates
 
+    def enable_profiling(self) -> PAC_parser_profile:
+        """
+        Replaces the parsing methods of this parser object with timed wrappers. \n
+        Nothing is measured (and nothing is slowed down) while the profiling is disabled
+        :return: the profile that will be filled during parsing
+        """
+        if self.profile is not None:
+            return self.profile
+        profile = PAC_parser_profile()
+        self.profile = profile
+        parser_class = type(self)
+        heuristic = self.instruction_heuristic
+        read_string = self.read_string_argument
+
+        def timed(name: str, method: Callable[[PAC_parser], Any]) -> Callable[[], Any]:
+            phase = profile.phase(name)
+
+            def wrapper():
+                start = time.perf_counter_ns()
+                res = method(self)
+                phase.add(time.perf_counter_ns() - start)
+                return res
+            return wrapper
+
+        def scan() -> bool:
+            start_offset = self.cur_offset
+            start = time.perf_counter_ns()
+            res = parser_class.findNextInstruction(self)
+            profile.phase("scan").add(time.perf_counter_ns() - start)
+            profile.bytes_scanned += self.cur_offset - start_offset
+            return res
+
+        def decode():
+            signature = self.cur_signature
+            start = time.perf_counter_ns()
+            parser_class.processInstruction(self)
+            duration = time.perf_counter_ns() - start
+            profile.phase("decode").add(duration)
+            profile.signature_phase(signature).add(duration)
+
+        def counted_heuristic(signature: int) -> bool:
+            profile.candidates_checked += 1
+            if heuristic(signature):
+                return True
+            profile.candidates_rejected += 1
+            return False
+
+        def timed_read_string(data: bytes, offset: int) -> Tuple[str, int]:
+            start = time.perf_counter_ns()
+            res = read_string(data, offset)
+            profile.phase("shift-jis").add(time.perf_counter_ns() - start)
+            return res
+
+        self.findNextInstruction = scan
+        self.processInstruction = decode
+        self.processRawData = timed("raw data", parser_class.processRawData)
+        self.processUnknownInstruction = timed("unknown", parser_class.processUnknownInstruction)
+        self.instruction_heuristic = counted_heuristic
+        self.original_instruction_heuristic = heuristic
+        self.read_string_argument = timed_read_string
+        self.original_read_string_argument = read_string
+        return profile
+
+    def disable_profiling(self) -> Optional[PAC_parser_profile]:
+        """
+        Restores the original parsing methods
+        :return: the collected profile (None if the profiling was not enabled)
+        """
+        profile = self.profile
+        if profile is None:
+            return None
+        for name in ("findNextInstruction", "processInstruction", "processRawData", "processUnknownInstruction"):
+            delattr(self, name)
+        self.instruction_heuristic = self.original_instruction_heuristic
+        del self.original_instruction_heuristic
+        self.read_string_argument = self.original_read_string_argument
+        del self.original_read_string_argument
+        self.profile = None
+        return profile
+
+    def readSignature(self) -> int:
+        # Slicing works the same way for bytes, mmap and Cached_memory_view objects
+        return struct.unpack(">i", self.file.raw_data[self.cur_offset:self.cur_offset + 4])[0]
+
     def findNextInstruction(self) -> bool:
         """
         Tries to advance cur_offset to the next instruction or unknown instruction\n
         :return: True on success (if the file suffix contains instructions or unknown instructions)
         """
-        percent = 0x25
+        percent = b"\x25"
         while True:
             # TO DO: implement alignment settings for better parsing
             # TO DO: maybe request that self.cur_offset < self.file.size - 4 and play with it to omit checking?
-            while self.cur_offset < self.file.size and self.file.raw_data[self.cur_offset] != percent:
-                self.cur_offset += 1
+            # (bytes, mmap and Cached_memory_view objects have the find method)
+            self.cur_offset = self.file.raw_data.find(percent, self.cur_offset)
+            if self.cur_offset == -1:
+                self.cur_offset = self.file.size
             # Now let's make a check...
             if self.cur_offset + 3 < self.file.size:
                 # We have enough bytes
                 if self.find_unknown_instructions:
                     # Here we use some sort of heuristic
-                    if self.mayBeInstruction(struct.unpack_from(">i", self.file.raw_data, self.cur_offset)[0]):
+                    if self.mayBeInstruction(self.readSignature()):
                         return True
                     else:
                         self.cur_offset += 1
                 else:
                     # Here we test if the signature is known
-                    if struct.unpack_from(">i", self.file.raw_data, self.cur_offset)[0] in self.templates:
+                    if self.readSignature() in self.templates:
                         return True
                     else:
                         self.cur_offset += 1
@@ -1185,7 +1702,7 @@ class PAC_parser:
         # self.cur_signature must be set before calling this
         self.file.entities_offsets.append(self.cur_offset)
         template = self.templates[self.cur_signature]
-        instruction = PAC_instruction(self.file.raw_data, self.cur_offset, template)
+        instruction = PAC_instruction(self.file.raw_data, self.cur_offset, template, self.read_string_argument)
 
         if self.cur_signature not in self.file.instructions:
             self.file.instructions[self.cur_signature] = {}
@@ -1260,28 +1777,111 @@ class PAC_parser:
         self.file.switch_case_tables[self.last_offset] = table
         self.last_offset = self.cur_offset
 
+    def parseStep(self):
+        """
+        Parses the next instruction or unknown instruction together with the raw data that precedes it \n
+        (or the whole file suffix if there are no instructions left)
+        :return: Does not return anything
+        """
+        self.processStep(self.findNextInstruction())
+
+    def processStep(self, res: bool):
+        """
+        The part of parseStep that follows findNextInstruction
+        :param res: what findNextInstruction has returned
+        """
+        if res:
+            self.processRawData()
+            # now self.last_offset == self.cur_offset
+            signature = self.readSignature()
+            self.cur_signature = signature
+
+            # self.find_unknown_instructions == False => the else clause is never executed
+            if signature in self.templates:
+                self.processInstruction()
+            else:
+                self.processUnknownInstruction()
+        else:
+            # No more instructions => self.file.raw_data[self.last_offset:] is a raw entity
+            self.cur_offset = self.file.size
+            self.processRawData()
+
     def parse(self):
-        if self.file.raw_data == b"":
+        if self.file.size == 0:
             raise RuntimeError("PAC file raw data is empty!")
 
         while self.cur_offset < self.file.size:
+            self.parseStep()
+        pass
+
+    def stream(self) -> Iterator[Tuple[int, PAC_entity]]:
+        """
+        Parses the file step by step and yields (offset, entity) pairs as soon as the entities are found. \n
+        The yielded entities are not kept in self.file (except for the last one, which the parser may still need),
+        so the memory usage does not depend on the file size. Use an mmap object as the raw data of the file
+        (see map_file_by_path) to avoid reading big files as a whole
+        """
+        if self.file.size == 0:
+            raise RuntimeError("PAC file raw data is empty!")
+
+        kept = 0
+        while self.cur_offset < self.file.size:
+            self.parseStep()
+            for offset in self.file.entities_offsets[kept:]:
+                yield offset, self.file.entities[offset]
+            kept = self.file.forget_entities()
+
+    def reparse(self, file: PAC_file, modified_ranges: List[Tuple[int, int]]):
+        """
+        Updates an already parsed PAC file after some of its bytes have been patched in file.raw_data. \n
+        The parsing restarts at the instruction that precedes the first modified entity and stops as soon as
+        the parser reaches an instruction of the old parse that lies after every modified range
+        (from there on the old entities are still valid). The new entities are spliced into the file.
+        :param file: parsed PAC file (its raw data must already contain the patched bytes)
+        :param modified_ranges: list of (offset, size) pairs
+        :return: Does not return anything
+        """
+        if not file.entities_offsets:
+            raise RuntimeError("PAC file has not been parsed yet!")
+        modified_ranges = [(offset, size) for offset, size in modified_ranges if size > 0]
+        if not modified_ranges:
+            return
+        first_modified = min(offset for offset, size in modified_ranges)
+        modified_end = max(offset + size for offset, size in modified_ranges)
+        if first_modified < 0 or modified_end > file.size:
+            raise ValueError(f"Modified range [0x{first_modified:X}; 0x{modified_end:X}) is out of file bounds!")
+
+        # The entity before the modified one may end where it does only because of the modified bytes,
+        # so we go back to the nearest instruction: the parsing state there is fully determined by its offset
+        index = binary_search(file.entities_offsets, first_modified) - 1
+        while index >= 0 and type(file.entities[file.entities_offsets[index]]) not in resync_entity_types:
+            index -= 1
+        start = file.entities_offsets[index] if index >= 0 else 0
+
+        new_entities = PAC_file()
+        new_entities.initialize_by_raw_data(file.raw_data)
+        self.reset(new_entities)
+        self.cur_offset = start
+        self.last_offset = start
+
+        end = file.size
+        while self.cur_offset < file.size:
+            # here self.cur_offset == self.last_offset
+            if self.cur_offset >= modified_end and type(file.entities.get(self.cur_offset)) in resync_entity_types:
+                # The old parse had an instruction here, and everything after it is unchanged
+                end = self.cur_offset
+                break
             res = self.findNextInstruction()
-            if res:
+            if res and self.cur_offset >= modified_end and \
+                    type(file.entities.get(self.cur_offset)) in resync_entity_types:
+                # raw data lies between the last new instruction and the old one found here
                 self.processRawData()
-                # now self.last_offset == self.cur_offset
-                signature = struct.unpack_from(">i", self.file.raw_data, self.cur_offset)[0]
-                self.cur_signature = signature
+                end = self.cur_offset
+                break
+            self.processStep(res)
 
-                # self.find_unknown_instructions == False => the else clause is never executed
-                if signature in self.templates:
-                    self.processInstruction()
-                else:
-                    self.processUnknownInstruction()
-            else:
-                # No more instructions => self.file.raw_data[self.last_offset:] is a raw entity
-                self.cur_offset = self.file.size
-                self.processRawData()
-        pass
+        file.replace_entities(start, end, new_entities)
+        self.reset(file)
 
     def reset(self, file: PAC_file):
         self.file = file
@@ -1291,6 +1891,29 @@ class PAC_parser:
         self.cur_signature = 0x0
 
 
+def find_first_difference(data_1: bytes, data_2: bytes) -> int:
+    """
+    Compares the ranges with memcmp and narrows down the first differing one
+    :return: -1 if the data is identical, else the first difference offset (the shorter length if one is a prefix)
+    """
+    size = min(len(data_1), len(data_2))
+    if data_1[0:size] == data_2[0:size]:
+        return -1 if len(data_1) == len(data_2) else size
+    lo = 0
+    hi = size
+    # the first difference is in [lo; hi)
+    while hi - lo > 64:
+        mid = (lo + hi) // 2
+        if data_1[lo:mid] == data_2[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    for offset in range(lo, hi):
+        if data_1[offset] != data_2[offset]:
+            return offset
+    return hi
+
+
 def get_first_difference(path_1: Path, path_2: Path) -> Tuple[int, Tuple[int, int]]:
     """
     If the first value is -1, the files are identical; else the value is the first difference offset
@@ -1301,16 +1924,14 @@ def get_first_difference(path_1: Path, path_2: Path) -> Tuple[int, Tuple[int, in
     :param path_2: second file path
     :return: a tuple of an int and another tuple of two ints
     """
-    source_1 = path_1.open(mode="rb").read()
-    source_2 = path_2.open(mode="rb").read()
-    # diff = difflib.Differ()
-    # res = diff.compare(source_1, source_2)
-    data = zip(source_1, source_2)
-    for i, (a, b) in enumerate(data):
-        if a != b:
-            # found first difference
-            return i, (a, b)
-    return -1, (0, 0)
+    # (NOTE: if one file is a prefix of the other one, they are considered identical)
+    # (see pac_diff for all differences)
+    with map_file_by_path(str(path_1)) as source_1, map_file_by_path(str(path_2)) as source_2:
+        size = min(len(source_1), len(source_2))
+        i = find_first_difference(source_1[0:size], source_2[0:size])
+        if i == -1:
+            return -1, (0, 0)
+        return i, (source_1[i], source_2[i])
 
 
 class MemoryAccess(NamedTuple):
@@ -1408,6 +2029,83 @@ def create_pattern_file(path: Path, writes: bool, access_stats: MemoryAccessesSt
             output.write(base_line)
 
 
+class Cached_memory_view:
+    """
+    Read-only view of an emulator memory range that is fetched page by page when it is accessed. \n
+    It supports len(), indexing, slicing and find(), so it can be used as raw data of a PAC_file:
+    only the pages the parser touches are read, and every page is read once
+    """
+    def __init__(self, read: Callable[[int, int], bytes], address: int, size: int, page_size: int = 0x1000):
+        """
+        :param read: function that reads (address, size) from the emulator memory (e.g. PataponDebugger.dump_memory)
+        :param address: PSP address of the range
+        :param size: size of the range
+        :param page_size: number of bytes fetched at once
+        """
+        self.read = read
+        self.address = address
+        self.size = size
+        self.page_size = page_size
+        self.pages: Dict[int, bytes] = {}
+        self.fetched_bytes: int = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get_page(self, index: int) -> bytes:
+        page = self.pages.get(index)
+        if page is None:
+            start = index * self.page_size
+            page = self.read(self.address + start, min(self.page_size, self.size - start))
+            self.pages[index] = page
+            self.fetched_bytes += len(page)
+        return page
+
+    def read_range(self, start: int, end: int) -> bytes:
+        if start >= end:
+            return b""
+        first_page = start // self.page_size
+        last_page = (end - 1) // self.page_size
+        base = first_page * self.page_size
+        if first_page == last_page:
+            return self.get_page(first_page)[start - base:end - base]
+        data = b"".join(self.get_page(index) for index in range(first_page, last_page + 1))
+        return data[start - base:end - base]
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[int, bytes]:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self.read_range(min(start, stop), max(start, stop) + 1)[::step]  # never used by the parser
+            return self.read_range(start, stop)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("Cached_memory_view index out of range")
+        return self.get_page(key // self.page_size)[key % self.page_size]
+
+    def find(self, sub: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        if end is None or end > self.size:
+            end = self.size
+        position = max(start, 0)
+        while position < end:
+            page_end = (position // self.page_size + 1) * self.page_size
+            # the chunk overlaps with the next page so that sub can cross the page border
+            chunk = self.read_range(position, min(page_end + len(sub) - 1, end))
+            found = chunk.find(sub)
+            if found != -1:
+                return position + found
+            position = page_end
+        return -1
+
+    def hexdigest(self, algorithm: str = "md5") -> str:
+        # Hashes the whole range; the pages that have already been fetched are not read again
+        hashed = hashlib.new(algorithm)
+        for index in range((self.size + self.page_size - 1) // self.page_size):
+            hashed.update(self.get_page(index))
+        return hashed.hexdigest()
+
+
 class PataponDebugger:
     def __init__(self):
         self.debugger = PPSSPPDebugger.PPSSPP_Debugger()
@@ -1452,12 +2150,31 @@ class PataponDebugger:
 
         self.size_to_PAC: Dict[int, Tuple[bool, str]] = {}
         self.hash_to_PAC: Dict[str, str] = {}
+        # pac_identification.PAC_identification_index, replaces size_to_PAC and hash_to_PAC if set
+        self.PAC_identification_index = None
+        # pac_tracker.Resident_PAC_tracker, the files it knows are not identified again (see track_resident_PACs)
+        self.resident_PACs = None
 
-    def read_instruction_set(self, file_path: str):
+    def read_instruction_set(self, file_path: str, compiled_path: Optional[str] = None):
+        """
+        Reads the instruction set text file. The parsed templates, the sorted function addresses and the cmd_inxJmp
+        signature are saved to the compiled instruction set file (a JSON file in const_cache_directory named after
+        the text digest by default) and are loaded from there next time unless the text file changes
+        :param file_path: instruction set text file path
+        :param compiled_path: [optional] compiled instruction set path
+        """
         # the user expects this operation to change the set
         self.PAC_instruction_templates.clear()
-        with open(file_path, encoding="utf-8") as source:
-            for line in source:
+        with open(file_path, "rb") as source:
+            raw = source.read()
+        digest = hashlib.md5(raw).digest()
+        if compiled_path is None:
+            compiled_path = default_compiled_instruction_set_path(digest)
+
+        compiled = load_compiled_instruction_set(compiled_path, digest)
+        if compiled is None:
+            templates = []
+            for line in raw.decode("utf-8").splitlines():
                 words = line.strip().split(";")
                 # A;B;C;D;raw_size(hex);function_name;extended_name;function_desc;param_amount;address;
                 # param_1_type;param_1_name;param_2_type;param_2_name...
@@ -1466,30 +2183,55 @@ class PataponDebugger:
 
                 # instruction = PAC_instruction(instr_info, args_info)
 
-                template = PAC_instruction_template(instr_info, args_info)
-                self.PAC_instruction_templates[template.signature] = template
-                self.PAC_signature_to_name[template.signature] = template.name
-
-                address = int(instr_info[-1], 16)
-                if True or address < const_overlay_base_address:
-                    PAC_function = ELF_function()
-                    PAC_function.name = instr_info[5]
-                    PAC_function.memory_location = address
-                    if address in self.Eboot_PAC_functions.keys():
-                        print(f"{address:#x} has already been mentioned in the instruction file!")
-                    self.Eboot_PAC_functions[address] = PAC_function
-                    # self.ordered_PAC_functions.append(PAC_function)
-                    self.Eboot_PAC_function_offsets.append(address)
-
-                # self.PAC_instructions[instruction.signature] = instruction
-                # self.PAC_name_to_signature[instruction.name] = instruction.signature
-                pass
+                templates.append(PAC_instruction_template(instr_info, args_info))
+            compiled = compile_instruction_set(templates)
+            save_compiled_instruction_set(compiled_path, digest, compiled)
+
+        if compiled.inxJmp_signature:
+            self.inxJmp_signature = compiled.inxJmp_signature
+        for template in compiled.templates:
+            self.PAC_instruction_templates[template.signature] = template
+            self.PAC_signature_to_name[template.signature] = template.name
+
+            address = template.function_address
+            if True or address < const_overlay_base_address:
+                PAC_function = ELF_function()
+                PAC_function.name = template.name
+                PAC_function.memory_location = address
+                if address in self.Eboot_PAC_functions.keys():
+                    print(f"{address:#x} has already been mentioned in the instruction file!")
+                self.Eboot_PAC_functions[address] = PAC_function
+                # self.ordered_PAC_functions.append(PAC_function)
+
+            # self.PAC_instructions[instruction.signature] = instruction
+            # self.PAC_name_to_signature[instruction.name] = instruction.signature
         # self.ordered_PAC_functions.sort(key=lambda x: x.memory_location)
+        # the compiled offsets are sorted already, only the ones of a previous set (if any) are merged here
+        self.Eboot_PAC_function_offsets += compiled.function_offsets
         self.Eboot_PAC_function_offsets.sort()
 
     def initialize_PAC_functions(self):  # so far in testing
         pass
 
+    def create_PAC_parser(self) -> PAC_parser:
+        parser = PAC_parser()
+        parser.setTemplates(self.PAC_instruction_templates)
+        parser.PAC_signature_to_name = self.PAC_signature_to_name
+        parser.jump_table_next_to_switch = self.jump_table_next_to_switch
+        parser.cmd_inxJmp_signature = self.inxJmp_signature
+        return parser
+
+    def parse_PAC_file(self, file: PAC_file):
+        parser = self.create_PAC_parser()
+        parser.reset(file)
+        parser.parse()
+
+    def stream_PAC_file(self, file: PAC_file) -> Iterator[Tuple[int, PAC_entity]]:
+        # see PAC_parser.stream
+        parser = self.create_PAC_parser()
+        parser.reset(file)
+        return parser.stream()
+
     def prepare_PACs_info(self, directory: Path):
         sizes: Dict[int, List[str]] = {}
         for file in directory.glob("*.pac"):
@@ -1517,6 +2259,9 @@ class PataponDebugger:
         return self.debugger.memory.read_bytes(base_address + address, size)
         pass
 
+    def memory_view(self, address: int, size: int) -> Cached_memory_view:
+        return Cached_memory_view(self.dump_memory, address, size)
+
     def dump_memory_to_file(self, address: int, size: int, save_as: str):
         base_address = self.debugger.PPSSPP_base_address
         raw_data: bytes = self.debugger.memory.read_bytes(base_address + address, size)
@@ -1562,16 +2307,39 @@ class PataponDebugger:
         self.MSG_files[magic] = file
         pass
 
+    def track_MSG_in_memory(self, address: int, size: int, magic: int, name: str) -> Tracked_MSG_file:
+        """
+        Like grab_MSG_from_memory, but the file can be brought up to date with Tracked_MSG_file.poll
+        """
+        file = Tracked_MSG_file(self.dump_memory, address, size)
+        file.name = name
+        self.MSG_files[magic] = file
+        return file
+
     def add_MSG(self, file: MSG_file):
         self.MSG_files[file.magic] = file
 
-    def grab_PAC_from_memory(self, address: int, size: int, name: str):
+    def grab_PAC_from_memory(self, address: int, size: int, name: str,
+                             memory: Optional[Cached_memory_view] = None) -> PAC_file:
+        # The file is parsed right from the emulator memory: only the pages the parser touches are read
         file = PAC_file()
-        file.initialize_by_raw_data(self.dump_memory(address, size))
+        file.initialize_by_raw_data(self.memory_view(address, size) if memory is None else memory)
         file.memory_location = address
         file.name = name
+        self.parse_PAC_file(file)
         # self.PAC_files.append(...) or self.PAC_files[name] = ...
-        pass
+        return file
+
+    def inspect_PAC_in_memory(self, address: int) -> PAC_file:
+        """
+        Identifies and parses the PAC file loaded at the address. \n
+        The identification and the parsing share the same cached memory pages, so the memory is read only once
+        :param address: PSP address of the PAC file
+        :return: parsed PAC file
+        """
+        memory = self.memory_view(address, self.get_PAC_size(address))
+        name = self.identify_PAC(address, memory)
+        return self.grab_PAC_from_memory(address, memory.size, name, memory)
 
     def add_PAC(self, address, size):
         pass
@@ -1792,22 +2560,53 @@ class PataponDebugger:
         else:
             self.current_overlay = ""
 
-    def identify_PAC(self, address: int) -> str:
+    def get_PAC_size(self, address: int) -> int:
+        # The allocator header before the file points to the file end
         alloc_info_address = self.debugger.memory_read_int(address - 4)
         file_end = self.debugger.memory_read_int(alloc_info_address)
-        size = file_end - address
+        return file_end - address
+
+    def find_PAC_name(self, address: int, memory: Optional[Cached_memory_view] = None) -> Optional[str]:
+        """
+        Like identify_PAC, but an unrecognized file is not fatal
+        :return: the file name or None if the file is unknown
+        """
+        # memory (if passed) must be the view of the file, its cached pages are reused when computing the hash
+        size = self.get_PAC_size(address) if memory is None else memory.size
+        if self.resident_PACs is not None:
+            resident = self.resident_PACs.files.get(address)
+            if resident is not None and resident.size == size:
+                return resident.name
+        return self.match_PAC_contents(address, size, memory)
+
+    def match_PAC_contents(self, address: int, size: int, memory: Optional[Cached_memory_view] = None) \
+            -> Optional[str]:
+        """
+        Identifies the file by its size and contents, the resident files tracker is not used
+        :return: the file name or None if the file is unknown
+        """
+        if self.PAC_identification_index is not None:
+            # only a few windows of the file are read
+            if memory is None:
+                read = lambda offset, length: self.dump_memory(address + offset, length)
+            else:
+                read = lambda offset, length: memory[offset:offset + length]
+            return self.PAC_identification_index.identify(size, read)
         if size not in self.size_to_PAC:
-            print(f"Fatal error: unrecognized PAC file at address 0x{address:X}!")
-            exit()
+            return None
         unique, name = self.size_to_PAC[size]
         if not unique:
             # compute the hash
-            data = self.dump_memory(address, size)
-            hashed = hashlib.md5(data).hexdigest()
-            if hashed not in self.hash_to_PAC:
-                print(f"Fatal error: unrecognized PAC file at address 0x{address:X}!")
-                exit()
-            name = self.hash_to_PAC[hashed]
+            if memory is None:
+                memory = self.memory_view(address, size)
+            name = self.hash_to_PAC.get(memory.hexdigest("md5"))
+        return name
+
+    def identify_PAC(self, address: int, memory: Optional[Cached_memory_view] = None) -> str:
+        name = self.find_PAC_name(address, memory)
+        if name is None:
+            print(f"Fatal error: unrecognized PAC file at address 0x{address:X}!")
+            exit()
         # now the name is correct!
         return name
 
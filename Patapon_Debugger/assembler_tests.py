@@ -0,0 +1,64 @@
+import json
+import random
+import struct
+
+from pac_assembler import assemble_file, assemble_records, encode_value, value_type
+from pac_benchmark import make_synthetic_templates, PAC_generator, parse_bytes
+from pac_renderer import entity_to_dict
+
+templates = make_synthetic_templates()
+const_editable_types = {"0x1 value", "0x4 variable", "0x8 variable", "0x20 variable", "0x40 variable", "uint32_t",
+                        "float"}
+
+
+def to_records(data: bytes) -> list:
+    # the records go through JSON, as the ones read from a .jsonl file
+    file = parse_bytes(templates, data)
+    return [json.loads(json.dumps(entity_to_dict(offset, file.entities[offset]), ensure_ascii=False))
+            for offset in file.entities_offsets]
+
+
+def without_raw(records: list) -> list:
+    return [{key: value for key, value in record.items() if key != "raw"} for record in records]
+
+
+def test_round_trip():
+    for seed in range(20):
+        data = PAC_generator(templates, seed).generate(500)
+        assert assemble_file(parse_bytes(templates, data)) == data
+        assert assemble_records(to_records(data), templates) == data
+
+
+def test_typed_arg_edits():
+    rnd = random.Random(1)
+    edited_count_floats = 0
+    for seed in range(20):
+        data = PAC_generator(templates, seed).generate(500)
+        records = to_records(data)
+        for record in records:
+            if record["kind"] == "instruction":
+                for arg in record["args"]:
+                    arg_type = value_type(arg["type"])
+                    if arg_type not in const_editable_types or rnd.random() < 0.5:
+                        continue
+                    if arg_type == "float":
+                        # a value a float32 keeps as it is
+                        arg["value"] = rnd.randrange(-1000, 1000) / 4
+                        edited_count_floats += arg["type"].startswith("count_")
+                    else:
+                        arg["value"] = rnd.randrange(1 << 16)
+            elif record["kind"] == "switch-case table" and record["branches"]:
+                record["branches"][0] = 0x1234
+        assembled = assemble_records(records, templates)
+        assert len(assembled) == len(data)
+        assert without_raw(to_records(assembled)) == without_raw(records), seed
+    assert edited_count_floats > 0
+
+
+def test_encode_value():
+    assert encode_value(1.5, "float", 4) == struct.pack("<f", 1.5)
+    assert encode_value(1.5, "count_byte float 3", 4) == struct.pack("<f", 1.5)
+    assert encode_value(-1, "count_uint32t 0x8 variable 0", 4) == b"\xff\xff\xff\xff"
+    assert encode_value(0x10002, "uint32_t", 2) == b"\x02\x00"
+    assert value_type("count_byte 0x8 variable 12") == "0x8 variable"
+    assert value_type("count_uint32tP_0") == "count_uint32tP_0"
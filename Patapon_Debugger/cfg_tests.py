@@ -0,0 +1,102 @@
+import random
+import struct
+
+from pac_analysis import bitset_members, entry_blocks, find_dead_code, reachable_blocks
+from pac_benchmark import make_synthetic_templates, PAC_generator, parse_bytes
+from pac_cfg import build_CFG, const_edge_call, const_edge_fallthrough
+from pac_cfg_export import assign_functions
+
+# Control-flow graphs and dead code of small hand-written files and of synthetic ones
+
+templates = make_synthetic_templates()
+signatures = {template.name: template.signature for template in templates.values()}
+
+
+def instruction(name: str, *args: bytes) -> bytes:
+    return signatures[name].to_bytes(4, "big") + b"".join(args)
+
+
+def pointer(file_offset: int) -> bytes:
+    return struct.pack("<I", file_offset)
+
+
+def typed(arg_type: int, value: int) -> bytes:
+    return bytes([arg_type, 0, 0, 0]) + struct.pack("<I", value)
+
+
+def blocks_at(cfg, blocks) -> list:
+    return [cfg.block_start(block) for block in blocks]
+
+
+def test_jump_over_dead_code():
+    data = instruction("cmd_jmp", pointer(0xC)) + instruction("cmd_end") + instruction("cmd_end") + \
+        instruction("cmd_end")
+    file = parse_bytes(templates, data)
+    cfg = build_CFG(file)
+    assert blocks_at(cfg, range(cfg.blocks_count)) == [0x0, 0x8, 0xC, 0x10]
+    assert cfg.entry_blocks() == [0]
+    assert blocks_at(cfg, cfg.unreferenced_blocks()) == [0x8, 0x10]
+    report = find_dead_code(file, cfg)
+    assert report.unreachable_blocks == [(0x8, 0xC), (0x10, 0x14)]
+    assert report.unreferenced_blocks == [(0x8, 0xC), (0x10, 0x14)]
+    assert report.dead_bytes == 8
+    # the game may start the script somewhere else
+    report = find_dead_code(file, cfg, [0x10])
+    assert report.unreachable_blocks == [(0x8, 0xC)]
+    # every block is in a function, the unreferenced ones start their own
+    assert list(assign_functions(cfg)) == [0, 1, 0, 3]
+
+
+def test_calls_and_fallthroughs():
+    data = instruction("cmd_call", pointer(0x24)) + instruction("cmd_mov", typed(0x8, 1), typed(0x8, 2)) + \
+        b"\x07\x00\x00\x00" + instruction("cmd_end") + instruction("cmd_end")
+    file = parse_bytes(templates, data)
+    cfg = build_CFG(file)
+    assert blocks_at(cfg, range(cfg.blocks_count)) == [0x0, 0x8, 0x20, 0x24]
+    edges = {(cfg.edge_sources[edge], cfg.edge_targets[edge], cfg.edge_kinds[edge]) for edge in range(cfg.edges_count)}
+    # no fallthrough from cmd_mov over the raw data
+    assert edges == {(0, 1, const_edge_fallthrough), (0, 3, const_edge_call)}
+    assert cfg.entry_blocks() == [0, 3]
+    report = find_dead_code(file, cfg)
+    assert report.unreachable_blocks == report.unreferenced_blocks == [(0x20, 0x24)]
+    assert report.orphan_raw_entities == [0x1C]
+
+
+def test_only_pointers_reference_data():
+    table = b"".join(struct.pack("<I", i) for i in range(4))
+    # cmd_setValue32 has a plain uint32_t equal to the table offset, it's not a reference
+    data = instruction("cmd_setValue32", typed(0x2, 0x10)) + instruction("cmd_end") + table + instruction("cmd_end")
+    report = find_dead_code(parse_bytes(templates, data))
+    assert report.orphan_msg_tables == [0x10]
+    data = instruction("cmd_ifEQ", typed(0x8, 1), typed(0x8, 2), pointer(0x1C)) + instruction("cmd_end") + table + \
+        instruction("cmd_end")
+    report = find_dead_code(parse_bytes(templates, data))
+    assert report.orphan_msg_tables == []
+
+
+def test_reachability_matches_search():
+    rnd = random.Random(1)
+    data = bytearray(PAC_generator(templates, 3).generate(5000))
+    file = parse_bytes(templates, bytes(data))
+    instructions = [file_offset for file_offset in file.entities_offsets
+                    if getattr(file.entities[file_offset], "name", None) in ("cmd_jmp", "cmd_call")]
+    # retarget the jumps and calls at random entities, so that the graph has long paths, cycles and unresolved targets
+    for file_offset in instructions:
+        data[file_offset + 4:file_offset + 8] = pointer(rnd.choice(file.entities_offsets))
+    file = parse_bytes(templates, bytes(data))
+    cfg = build_CFG(file)
+    entries = cfg.entry_blocks()
+    calls = {cfg.edge_targets[edge] for edge in range(cfg.edges_count) if cfg.edge_kinds[edge] == const_edge_call}
+    assert set(entries) == {0} | calls
+    reached = set(entries)
+    stack = list(entries)
+    while stack:
+        for target, _ in cfg.successors(stack.pop()):
+            if target not in reached:
+                reached.add(target)
+                stack.append(target)
+    assert set(bitset_members(reachable_blocks(cfg, entry_blocks(cfg)))) == reached
+    report = find_dead_code(file, cfg)
+    assert {cfg.block_of(start) for start, _ in report.unreachable_blocks} == set(range(cfg.blocks_count)) - reached
+    assert {cfg.block_of(start) for start, _ in report.unreferenced_blocks} == set(cfg.unreferenced_blocks())
+    assert report.unreferenced_blocks
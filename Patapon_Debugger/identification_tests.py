@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from PataponDebugger import PataponDebugger, map_file_by_path
+from pac_identification import fingerprint_path, prepare_PAC_identification
+
+# Identification of the files of a directory by their size and the bytes that tell the files of a size apart
+
+
+def write_files(directory: Path, contents: dict):
+    for name, data in contents.items():
+        (directory / name).write_bytes(data)
+
+
+def identify_all(index, contents: dict) -> dict:
+    return {name: index.identify(len(data), lambda offset, size, data=data: data[offset:offset + size])
+            for name, data in contents.items()}
+
+
+def test_empty_files(tmp_path):
+    (tmp_path / "empty.pac").write_bytes(b"")
+    with map_file_by_path(str(tmp_path / "empty.pac")) as data:
+        assert len(data) == 0 and data[0:4] == b""
+    assert fingerprint_path(tmp_path / "empty.pac")[1].size == 0
+
+
+def test_identify_files(tmp_path):
+    base = bytes(range(256)) * 16
+    contents = {"a.pac": base, "b.pac": base[:-1] + b"\x00", "c.pac": base[:100], "empty.pac": b"",
+                "same_as_a.pac": base}
+    write_files(tmp_path, contents)
+    index = prepare_PAC_identification(PataponDebugger(), tmp_path, workers=1)
+    assert identify_all(index, contents) == {"a.pac": "a.pac", "b.pac": "b.pac", "c.pac": "c.pac",
+                                             "empty.pac": "empty.pac", "same_as_a.pac": "a.pac"}
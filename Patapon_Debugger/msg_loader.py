@@ -0,0 +1,156 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from PataponDebugger import PataponDebugger, MSG_file, load_file_by_path
+from pickle_cache import load_cache, save_cache
+
+# Loads a directory of MSG files into PataponDebugger.MSG_files. The decoded strings are saved to a cache keyed by
+# the md5 digest of the file contents, so only new or changed files are decoded (in a pool of processes) and the
+# rest are read from the cache. Several directories may share a cache file, it remembers the files of each of them
+
+const_msg_cache_magic = "MSG cache"
+const_msg_cache_version = 2
+
+
+class MSG_cache:
+    def __init__(self):
+        self.tables: Dict[bytes, List[str]] = {}  # md5 digest of the file -> decoded strings
+        self.directories: Dict[str, Set[bytes]] = {}  # resolved directory path -> digests of its files
+
+    def save(self, path: Path):
+        save_cache(path, (const_msg_cache_magic, const_msg_cache_version), (self.tables, self.directories))
+
+    def update_directory(self, directory: str, digests: Set[bytes]) -> bool:
+        """
+        :return: True if the files of the directory are not the ones the cache remembers
+        """
+        if self.directories.get(directory) == digests:
+            return False
+        self.directories[directory] = digests
+        return True
+
+    def prune(self) -> int:
+        """
+        Forgets the files that none of the directories has
+        :return: how many were forgotten
+        """
+        used = set().union(*self.directories.values())
+        stale = [digest for digest in self.tables if digest not in used]
+        for digest in stale:
+            del self.tables[digest]
+        return len(stale)
+
+    @classmethod
+    def load(cls, path: Path) -> "MSG_cache":
+        """
+        :return: the saved cache or an empty one if the file is missing, broken or outdated
+        """
+        res = cls()
+        data = load_cache(path, (const_msg_cache_magic, const_msg_cache_version))
+        if isinstance(data, tuple) and len(data) == 2 and all(isinstance(part, dict) for part in data):
+            res.tables, res.directories = data
+        return res
+
+
+class Decoded_MSG(NamedTuple):
+    name: str
+    digest: bytes
+    strings: Optional[List[str]]  # None if the file could not be decoded
+    error: Optional[str]
+
+
+def decode_MSG_data(raw: bytes) -> List[str]:
+    file = MSG_file()
+    file.initialize_by_raw_data(raw)
+    file.compute_items()
+    return file.strings
+
+
+def decode_MSG_path(path: Path) -> Decoded_MSG:
+    # module level so the pool processes can run it
+    raw = load_file_by_path(str(path))
+    digest = hashlib.md5(raw).digest()
+    try:
+        return Decoded_MSG(path.name, digest, decode_MSG_data(raw), None)
+    except Exception as e:
+        return Decoded_MSG(path.name, digest, None, f"{type(e).__name__}: {e}")
+
+
+def decode_MSG_paths(paths: List[Path], workers: Optional[int] = None) -> List[Decoded_MSG]:
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        return [decode_MSG_path(path) for path in paths]
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(decode_MSG_path, paths))
+
+
+def make_MSG_file(name: str, raw: bytes, strings: List[str]) -> MSG_file:
+    file = MSG_file()
+    file.initialize_by_raw_data(raw)
+    file.name = name
+    file.strings = strings
+    file.computed = True
+    return file
+
+
+def load_MSG_directory(directory: Path, cache_path: Optional[Path] = None, workers: Optional[int] = None) \
+        -> Tuple[Dict[str, MSG_file], Dict[str, str]]:
+    """
+    :param cache_path: directory / "msg.cache" by default, the cache is updated if the files of the directory have
+     changed and keeps only the files of the directories that use it
+    :param workers: processes decoding the files that are not cached (os.cpu_count() by default)
+    :return: (file name -> MSG file, file name -> error), both sorted by file name
+    """
+    if cache_path is None:
+        cache_path = directory / "msg.cache"
+    cache = MSG_cache.load(cache_path)
+
+    raw_files: Dict[str, Tuple[bytes, bytes]] = {}  # name -> (raw, digest)
+    for path in sorted(directory.glob("*.msg")):
+        raw = load_file_by_path(str(path))
+        raw_files[path.name] = (raw, hashlib.md5(raw).digest())
+    missing = [directory / name for name, (_, digest) in raw_files.items() if digest not in cache.tables]
+
+    errors = {}
+    for decoded in decode_MSG_paths(missing, workers):
+        if decoded.error is not None:
+            errors[decoded.name] = decoded.error
+        else:
+            cache.tables[decoded.digest] = decoded.strings
+    # the old versions of the files that changed are not needed anymore, unless another directory has them
+    changed = cache.update_directory(str(directory.resolve()), {digest for _, digest in raw_files.values()})
+    pruned = cache.prune()
+    if changed or pruned or len(errors) < len(missing):
+        try:
+            cache.save(cache_path)
+        except OSError as e:
+            # Not fatal, the files will be decoded again next time
+            print(f"Cannot save the MSG cache to {cache_path}:", e)
+
+    files = {}
+    for name, (raw, digest) in raw_files.items():
+        if digest in cache.tables:
+            files[name] = make_MSG_file(name, raw, cache.tables[digest])
+    return files, errors
+
+
+def load_MSG_files(debugger: PataponDebugger, directory: Path, cache_path: Optional[Path] = None,
+                   workers: Optional[int] = None) -> List[str]:
+    """
+    Adds the MSG files of the directory to debugger.MSG_files, every file goes to the slot of its magic
+    (see PataponDebugger.magic_to_MSG_type). If several files have the same magic, the last one by name stays
+    :return: names of the files that were not added (broken ones and the ones with unknown or unused magics)
+    """
+    files, errors = load_MSG_directory(directory, cache_path, workers)
+    skipped = sorted(errors)
+    for name, file in files.items():
+        if debugger.magic_to_MSG_type.get(file.magic, "unused") == "unused":
+            skipped.append(name)
+        else:
+            debugger.add_MSG(file)
+    return skipped
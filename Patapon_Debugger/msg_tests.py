@@ -0,0 +1,83 @@
+import random
+import struct
+
+import pytest
+
+from PataponDebugger import MSG_file
+from msg_loader import MSG_cache, load_MSG_directory
+
+# MSG files are built from random strings: count, magic, offsets, then the utf-16 strings with their terminators
+
+
+def make_MSG_data(rnd: random.Random, count: int, magic: int = 1):
+    strings = ["".join(chr(rnd.choice([rnd.randint(0x20, 0x7E), rnd.randint(0x3040, 0x30FF)]))
+                       for _ in range(rnd.randint(0, 30))) for _ in range(count)]
+    body = b""
+    offsets = []
+    for string in strings:
+        offsets.append(8 + 4 * count + len(body))
+        body += string.encode("utf-16-le") + b"\x00\x00"
+    return struct.pack(f"<II{count}I", count, magic, *offsets) + body, strings
+
+
+def test_MSG_file_items():
+    rnd = random.Random(3)
+    raw, strings = make_MSG_data(rnd, 100)
+    file = MSG_file()
+    file.initialize_by_raw_data(raw)
+    file.set_cache_size(5)
+    for index in [rnd.randrange(100) for _ in range(300)]:
+        assert file[index] == strings[index]
+    assert len(file.decoded) <= 5
+    for index in (-1, 100):
+        with pytest.raises(IndexError):
+            file[index]
+
+    file.compute_items()
+    assert file.strings == strings
+    # the computed strings are not kept twice
+    assert not file.decoded
+    assert [file[index] for index in range(len(file))] == strings
+
+
+def write_MSG_directory(directory, rnd: random.Random, count: int) -> dict:
+    directory.mkdir()
+    expected = {}
+    for index in range(count):
+        raw, strings = make_MSG_data(rnd, rnd.randint(1, 50))
+        (directory / f"m{index}.msg").write_bytes(raw)
+        expected[f"m{index}.msg"] = strings
+    return expected
+
+
+def test_MSG_cache_shared_by_directories(tmp_path):
+    rnd = random.Random(1)
+    cache_path = tmp_path / "msg.cache"
+    first = write_MSG_directory(tmp_path / "first", rnd, 3)
+    second = write_MSG_directory(tmp_path / "second", rnd, 2)
+    for directory, expected in ((tmp_path / "first", first), (tmp_path / "second", second)):
+        files, errors = load_MSG_directory(directory, cache_path, workers=1)
+        assert not errors and {name: file.strings for name, file in files.items()} == expected
+    assert len(MSG_cache.load(cache_path).tables) == 5
+
+    # a changed file replaces its old version, the other directory keeps its files
+    raw, first["m0.msg"] = make_MSG_data(rnd, 10)
+    (tmp_path / "first" / "m0.msg").write_bytes(raw)
+    files, _ = load_MSG_directory(tmp_path / "first", cache_path, workers=1)
+    assert files["m0.msg"].strings == first["m0.msg"]
+    cache = MSG_cache.load(cache_path)
+    assert len(cache.tables) == 5
+    assert sorted(map(tuple, cache.tables.values())) == sorted(map(tuple, list(first.values()) + list(second.values())))
+
+
+def test_MSG_cache_save_is_atomic(tmp_path):
+    cache_path = tmp_path / "msg.cache"
+    cache = MSG_cache()
+    cache.tables[b"digest"] = ["text"]
+    cache.save(cache_path)
+    # a cache that can't be written leaves the old file as it was and no temporary file
+    cache.tables[b"other"] = [lambda: None]
+    with pytest.raises(Exception):
+        cache.save(cache_path)
+    assert MSG_cache.load(cache_path).tables == {b"digest": ["text"]}
+    assert [path.name for path in tmp_path.iterdir()] == ["msg.cache"]
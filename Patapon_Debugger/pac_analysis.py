@@ -0,0 +1,427 @@
+import sys
+import heapq
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from PataponDebugger import PataponDebugger, PAC_file, PAC_instruction, Memory_entity, PAC_message_table, \
+    Switch_case_table, map_file_by_path
+from pac_cfg import PAC_CFG, build_CFG
+from pac_corpus import list_PAC_files, map_PAC_files
+from pac_diff import parse_PAC_data
+from pac_index import PAC_variable, const_variable_banks
+
+# Static analyses over PAC_CFG graphs. Sets of blocks, definitions and variables are bitsets (Python ints,
+# bit i = item i), so the unions and the differences of whole files are single operations
+
+# Args whose values may be file offsets of the data the instruction uses
+const_reference_types = {"uint32_t_P", "uint32_t_P_ret"}
+
+# Instructions that write their first variable arg, the ones in const_variable_overwriters don't read it
+const_variable_writers = {"cmd_mov", "cmd_add", "cmd_sub", "cmd_mul", "cmd_div", "cmd_inc", "cmd_dec", "cmd_rand",
+                          "cmd_iand", "cmd_ior", "cmd_ixor", "cmd_irol", "cmd_iror", "cmd_sinf", "cmd_cosf",
+                          "cmd_atan2f", "cmd_abs", "cmd_sqrt", "cmd_mod", "cmd_getArray", "cmd_F32toF16",
+                          "cmd_F16toF32", "cmd_getElapsedTime"}
+const_variable_overwriters = {"cmd_mov", "cmd_rand", "cmd_sinf", "cmd_cosf", "cmd_atan2f", "cmd_abs", "cmd_sqrt",
+                              "cmd_getArray", "cmd_F32toF16", "cmd_F16toF32", "cmd_getElapsedTime"}
+
+
+def bitset_members(bits: int) -> Iterator[int]:
+    """
+    :return: the indexes of the set bits in increasing order
+    """
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def entry_blocks(cfg: PAC_CFG, entry_offsets: Iterable[int] = ()) -> int:
+    """
+    :param entry_offsets: file offsets the game starts the script at, in addition to the first block and the call
+     targets (see PAC_CFG.entry_blocks)
+    :return: bitset of the entry blocks
+    """
+    res = 0
+    for block in cfg.entry_blocks(entry_offsets):
+        res |= 1 << block
+    return res
+
+
+def reachable_blocks(cfg: PAC_CFG, entries: int) -> int:
+    """
+    Every kind of edge is followed, the potential ones too
+    :param entries: bitset of the blocks the execution starts at
+    :return: bitset of the blocks reachable from the entries
+    """
+    reached = entries
+    worklist = list(bitset_members(entries))
+    successors_start = cfg.successors_start
+    successors_edges = cfg.successors_edges
+    edge_targets = cfg.edge_targets
+    while worklist:
+        block = worklist.pop()
+        for position in range(successors_start[block], successors_start[block + 1]):
+            target = edge_targets[successors_edges[position]]
+            if not reached >> target & 1:
+                reached |= 1 << target
+                worklist.append(target)
+    return reached
+
+
+def referenced_offsets(file: PAC_file, cfg: PAC_CFG, blocks: int) -> set:
+    """
+    :return: the values of the args that may be offsets (see const_reference_types) and the switch-case table
+     branches of the instructions in the blocks
+    """
+    res = set()
+    for block in bitset_members(blocks):
+        for file_offset in cfg.block_instructions(block):
+            instruction = file.entities[file_offset]
+            if type(instruction) is not PAC_instruction:
+                continue
+            for param, value in instruction.ordered_PAC_params:
+                if param.type in const_reference_types:
+                    res.add(value)
+            if instruction.name == "cmd_inxJmp":
+                # the table follows the instruction
+                table = file.entities.get(file_offset + instruction.size)
+                if type(table) is Switch_case_table:
+                    res.update(table.branches)
+    return res
+
+
+class Dead_code_report(NamedTuple):
+    name: str
+    blocks_count: int
+    unreachable_blocks: List[Tuple[int, int]]  # [start; end) file offsets
+    unreferenced_blocks: List[Tuple[int, int]]  # the unreachable ones no edge goes to
+    orphan_msg_tables: List[int]  # offsets
+    orphan_raw_entities: List[int]
+    dead_bytes: int  # the size of everything above
+
+    @property
+    def reachable_blocks_count(self) -> int:
+        return self.blocks_count - len(self.unreachable_blocks)
+
+
+def find_dead_code(file: PAC_file, cfg: Optional[PAC_CFG] = None, entry_offsets: Iterable[int] = ()) \
+        -> Dead_code_report:
+    """
+    Message tables and raw entities are orphans if no reachable instruction has an arg with their offset
+    """
+    if cfg is None:
+        cfg = build_CFG(file)
+    all_blocks = (1 << cfg.blocks_count) - 1
+    reached = reachable_blocks(cfg, entry_blocks(cfg, entry_offsets))
+    unreachable = [(cfg.block_start(block), cfg.block_ends[block]) for block in bitset_members(all_blocks & ~reached)]
+    unreferenced = [(cfg.block_start(block), cfg.block_ends[block]) for block in cfg.unreferenced_blocks()
+                    if not reached >> block & 1]
+    dead_bytes = sum(end - start for start, end in unreachable)
+
+    references = referenced_offsets(file, cfg, reached)
+    orphan_msg_tables = []
+    orphan_raw_entities = []
+    for file_offset in file.entities_offsets:
+        entity = file.entities[file_offset]
+        if type(entity) is PAC_message_table:
+            orphans = orphan_msg_tables
+        elif type(entity) is Memory_entity:
+            orphans = orphan_raw_entities
+        else:
+            continue
+        if file_offset not in references:
+            orphans.append(file_offset)
+            dead_bytes += entity.size
+    return Dead_code_report(file.name, cfg.blocks_count, unreachable, unreferenced, orphan_msg_tables,
+                            orphan_raw_entities, dead_bytes)
+
+
+def find_dead_code_in_path(debugger: PataponDebugger, path: Path) -> Dead_code_report:
+    # pac_corpus job
+    with map_file_by_path(str(path)) as data:
+        file = parse_PAC_data(debugger, data)
+    file.name = path.name
+    return find_dead_code(file)
+
+
+def find_dead_code_in_directory(directory: Path, instruction_set: Path, workers: Optional[int] = None) \
+        -> List[Dead_code_report]:
+    """
+    :return: reports sorted by file name, the files that can't be parsed are printed
+    """
+    reports = []
+    for outcome in map_PAC_files(list_PAC_files(directory), instruction_set, find_dead_code_in_path, workers):
+        if outcome.error is not None:
+            print(f"{outcome.path.name}: {outcome.error}")
+        else:
+            reports.append(outcome.result)
+    reports.sort(key=lambda report: report.name)
+    return reports
+
+
+def print_dead_code_report(report: Dead_code_report):
+    print(f"{report.name}: {report.reachable_blocks_count}/{report.blocks_count} blocks reachable, "
+          f"{report.dead_bytes} dead bytes")
+    unreferenced = set(report.unreferenced_blocks)
+    for start, end in report.unreachable_blocks:
+        print(f"  {'unreferenced' if (start, end) in unreferenced else 'unreachable'} code {start:08X}-{end:08X}")
+    for file_offset in report.orphan_msg_tables:
+        print(f"  orphan message table {file_offset:08X}")
+    for file_offset in report.orphan_raw_entities:
+        print(f"  orphan raw entity {file_offset:08X}")
+
+
+def instruction_variables(instruction: PAC_instruction) -> Tuple[Optional[PAC_variable], List[PAC_variable]]:
+    """
+    :return: (the variable the instruction writes or None, the variables it reads)
+    """
+    variables = [(const_variable_banks[param.type], value) for param, value in instruction.ordered_PAC_params
+                 if param.type in const_variable_banks]
+    if not variables or instruction.name not in const_variable_writers:
+        return None, variables
+    if instruction.name in const_variable_overwriters:
+        return variables[0], variables[1:]
+    return variables[0], variables
+
+
+def reverse_postorder(cfg: PAC_CFG) -> List[int]:
+    """
+    :return: every block, the depth-first searches start at the first block and then at the blocks not visited yet
+    """
+    postorder = []
+    visited = bytearray(cfg.blocks_count)
+    for root in range(cfg.blocks_count):
+        if visited[root]:
+            continue
+        visited[root] = 1
+        stack = [(root, cfg.successors(root))]
+        while stack:
+            block, successors = stack[-1]
+            for target, _ in successors:
+                if not visited[target]:
+                    visited[target] = 1
+                    stack.append((target, cfg.successors(target)))
+                    break
+            else:
+                stack.pop()
+                postorder.append(block)
+    postorder.reverse()
+    return postorder
+
+
+def run_worklist(order: List[int], dependents: List[List[int]], update: Callable[[int], bool]):
+    """
+    Calls update(block) for every block and then again for the dependents of the blocks it returned True for,
+    until nothing changes. The queued blocks are taken in the order
+    """
+    priorities = [0] * len(order)
+    for priority, block in enumerate(order):
+        priorities[block] = priority
+    heap = list(range(len(order)))
+    queued = bytearray(b"\x01" * len(order))
+    while heap:
+        block = order[heapq.heappop(heap)]
+        queued[block] = 0
+        if update(block):
+            for dependent in dependents[block]:
+                if not queued[dependent]:
+                    queued[dependent] = 1
+                    heapq.heappush(heap, priorities[dependent])
+
+
+class Variable_definition(NamedTuple):
+    offset: int  # of the instruction
+    variable: PAC_variable
+
+
+class PAC_dataflow:
+    """
+    Reaching definitions and liveness of the variables of a file, solved with worklists over the CFG blocks.\n
+    Every edge is followed (calls too), the writes of a called script are not seen after the call returns
+    """
+    def __init__(self, file: PAC_file, cfg: Optional[PAC_CFG] = None):
+        self.file = file
+        self.cfg = cfg if cfg is not None else build_CFG(file)
+        self.definitions: List[Variable_definition] = []
+        self.variables: List[PAC_variable] = []
+        self.variable_ids: Dict[PAC_variable, int] = {}
+        self.variable_definitions: List[int] = []  # variable id -> bitset of its definitions
+
+        # instruction index (see PAC_CFG.instruction_offsets) -> (definition id or -1, bitset of the read variables)
+        self.instruction_effects: List[Tuple[int, int]] = []
+        for file_offset in self.cfg.instruction_offsets:
+            instruction = file.entities[file_offset]
+            if type(instruction) is not PAC_instruction:
+                self.instruction_effects.append((-1, 0))
+                continue
+            written, read = instruction_variables(instruction)
+            used = 0
+            for variable in read:
+                used |= 1 << self.variable_id(variable)
+            definition = -1
+            if written is not None:
+                definition = len(self.definitions)
+                self.definitions.append(Variable_definition(file_offset, written))
+                self.variable_definitions[self.variable_id(written)] |= 1 << definition
+            self.instruction_effects.append((definition, used))
+
+        self.reaching_in: List[int] = []  # block -> bitset of the definitions reaching its start
+        self.live_out: List[int] = []  # block -> bitset of the variables live at its end
+        self.solve_reaching_definitions()
+        self.solve_liveness()
+
+    def variable_id(self, variable: PAC_variable) -> int:
+        res = self.variable_ids.get(variable)
+        if res is None:
+            res = self.variable_ids[variable] = len(self.variables)
+            self.variables.append(variable)
+            self.variable_definitions.append(0)
+        return res
+
+    def block_effects(self, block: int) -> Iterator[Tuple[int, int, int]]:
+        """
+        :return: (instruction index, definition id or -1, bitset of the read variables) in the order of execution
+        """
+        for index in range(self.cfg.block_first[block], self.cfg.block_first[block + 1]):
+            definition, used = self.instruction_effects[index]
+            yield index, definition, used
+
+    def kill_mask(self, definition: int) -> int:
+        return self.variable_definitions[self.variable_ids[self.definitions[definition].variable]]
+
+    def solve_reaching_definitions(self):
+        cfg = self.cfg
+        gen = []
+        kill = []
+        for block in range(cfg.blocks_count):
+            block_gen = 0
+            block_kill = 0
+            for _, definition, _ in self.block_effects(block):
+                if definition != -1:
+                    mask = self.kill_mask(definition)
+                    block_kill |= mask
+                    block_gen = (block_gen & ~mask) | 1 << definition
+            gen.append(block_gen)
+            kill.append(block_kill)
+
+        reaching_out = list(gen)
+        self.reaching_in = [0] * cfg.blocks_count
+        predecessors = [[source for source, _ in cfg.predecessors(block)] for block in range(cfg.blocks_count)]
+        successors = [[target for target, _ in cfg.successors(block)] for block in range(cfg.blocks_count)]
+
+        def update(block: int) -> bool:
+            reaching = 0
+            for source in predecessors[block]:
+                reaching |= reaching_out[source]
+            self.reaching_in[block] = reaching
+            out = gen[block] | (reaching & ~kill[block])
+            if out == reaching_out[block]:
+                return False
+            reaching_out[block] = out
+            return True
+
+        run_worklist(reverse_postorder(cfg), successors, update)
+
+    def solve_liveness(self):
+        cfg = self.cfg
+        use = []
+        define = []
+        for block in range(cfg.blocks_count):
+            block_use = 0
+            block_define = 0
+            for _, definition, used in self.block_effects(block):
+                block_use |= used & ~block_define
+                if definition != -1:
+                    block_define |= 1 << self.variable_ids[self.definitions[definition].variable]
+            use.append(block_use)
+            define.append(block_define)
+
+        live_in = list(use)
+        self.live_out = [0] * cfg.blocks_count
+        predecessors = [[source for source, _ in cfg.predecessors(block)] for block in range(cfg.blocks_count)]
+        successors = [[target for target, _ in cfg.successors(block)] for block in range(cfg.blocks_count)]
+
+        def update(block: int) -> bool:
+            live = 0
+            for target in successors[block]:
+                live |= live_in[target]
+            self.live_out[block] = live
+            block_in = use[block] | (live & ~define[block])
+            if block_in == live_in[block]:
+                return False
+            live_in[block] = block_in
+            return True
+
+        run_worklist(reverse_postorder(cfg)[::-1], predecessors, update)
+
+    def instruction_block(self, file_offset: int) -> Tuple[int, int]:
+        """
+        :return: (block, instruction index) of the instruction at the offset
+        """
+        block = self.cfg.block_of(file_offset)
+        if block == -1 or self.cfg.instruction_offsets[self.cfg.block_first[block]] > file_offset:
+            raise ValueError(f"There is no instruction at {file_offset:X}")
+        for index in range(self.cfg.block_first[block], self.cfg.block_first[block + 1]):
+            if self.cfg.instruction_offsets[index] == file_offset:
+                return block, index
+        raise ValueError(f"There is no instruction at {file_offset:X}")
+
+    def reaching_definitions(self, file_offset: int) -> int:
+        """
+        :return: bitset of the definitions that reach the instruction at the offset (before it is executed)
+        """
+        block, stop = self.instruction_block(file_offset)
+        reaching = self.reaching_in[block]
+        for index, definition, _ in self.block_effects(block):
+            if index == stop:
+                break
+            if definition != -1:
+                reaching = (reaching & ~self.kill_mask(definition)) | 1 << definition
+        return reaching
+
+    def last_writers(self, file_offset: int, variable: PAC_variable) -> List[int]:
+        """
+        :return: offsets of the instructions that may have written the variable last before the offset
+        """
+        variable_id = self.variable_ids.get(variable)
+        if variable_id is None:
+            return []
+        definitions = self.reaching_definitions(file_offset) & self.variable_definitions[variable_id]
+        return [self.definitions[definition].offset for definition in bitset_members(definitions)]
+
+    def live_variables(self, file_offset: int) -> Set[PAC_variable]:
+        """
+        :return: the variables that may be read before they are written again, starting at the instruction
+        """
+        block, stop = self.instruction_block(file_offset)
+        live = self.live_out[block]
+        for index in reversed(range(stop, self.cfg.block_first[block + 1])):
+            definition, used = self.instruction_effects[index]
+            if definition != -1:
+                live &= ~(1 << self.variable_ids[self.definitions[definition].variable])
+            live |= used
+        return {self.variables[variable_id] for variable_id in bitset_members(live)}
+
+    def dead_definitions(self) -> List[Variable_definition]:
+        """
+        :return: the writes that are never read (the variables may still be read by the game or other scripts)
+        """
+        res = []
+        for block in range(self.cfg.blocks_count):
+            live = self.live_out[block]
+            for index in reversed(range(self.cfg.block_first[block], self.cfg.block_first[block + 1])):
+                definition, used = self.instruction_effects[index]
+                if definition != -1:
+                    bit = 1 << self.variable_ids[self.definitions[definition].variable]
+                    if not live & bit:
+                        res.append(self.definitions[definition])
+                    live &= ~bit
+                live |= used
+        res.sort()
+        return res
+
+
+if __name__ == "__main__":
+    # pac_analysis.py <directory> <instruction set>
+    for dead_code_report in find_dead_code_in_directory(Path(sys.argv[1]), Path(sys.argv[2])):
+        print_dead_code_report(dead_code_report)
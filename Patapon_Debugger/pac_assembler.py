@@ -0,0 +1,205 @@
+import json
+import struct
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from PataponDebugger import PataponDebugger, PAC_file, PAC_entity, PAC_instruction, PAC_instruction_param, \
+    PAC_instruction_template, find_first_difference, map_file_by_path, pack_uint32_array, unpack_uint32_array
+from pac_corpus import list_PAC_files, map_PAC_files, stream_PAC_path
+from pac_renderer import format_entity_json
+
+# Turns entities back into bytes. Every entity keeps its raw data, so a parsed file is rebuilt by joining it;
+# JSON Lines records (see pac_renderer) may also be edited before assembling:
+#  - switch-case tables are encoded from "branches"
+#  - instructions get their typed args ("0x8 variable", "uint32_t", "float"...) from "args", the values are written
+#    where the parser has read them (so the instruction size can't change). Other kinds of args can't be edited yet
+
+
+class Argument_slot(NamedTuple):
+    param: PAC_instruction_param
+    offset: int  # relative to the instruction start
+    sizeof: int
+
+
+class Located_PAC_instruction(PAC_instruction):
+    """
+    PAC_instruction that remembers where the values of its typed args are
+    """
+    def __init__(self, raw: bytes, offset: int, template: PAC_instruction_template):
+        self.typed_slots: List[Argument_slot] = []
+        self.start_offset = offset
+        PAC_instruction.__init__(self, raw, offset, template)
+
+    def argument_switch_case(self, raw: bytes, offset: int, arg_type: int, sizeof: int, param: PAC_instruction_param):
+        values = PAC_instruction.argument_switch_case(self, raw, offset, arg_type, sizeof, param)
+        if values is not None:
+            self.typed_slots.append(Argument_slot(values[0], offset - self.start_offset, sizeof))
+        return values
+
+    def argument_slots(self) -> List[Optional[Argument_slot]]:
+        """
+        :return: a slot for every ordered_PAC_params entry, None for the args that are not typed
+        """
+        slots = []
+        typed = iter(self.typed_slots)
+        next_typed = next(typed, None)
+        for param, value in self.ordered_PAC_params:
+            # typed COUNT args get new params: "count_{info} {type} {index}"
+            if next_typed is not None and (param is next_typed.param or
+                                           (param.type.startswith("count_") and " " in param.type)):
+                slots.append(next_typed)
+                next_typed = next(typed, None)
+            else:
+                slots.append(None)
+        return slots
+
+
+def same_value(a: Any, b: Any) -> bool:
+    # NaN floats are equal here
+    return a == b or (a != a and b != b)
+
+
+def value_type(param_type: str) -> str:
+    # typed COUNT args have "count_{info} {type} {index}" params, their values are encoded as {type}
+    if param_type.startswith("count_") and " " in param_type:
+        return param_type.split(" ", 1)[1].rsplit(" ", 1)[0]
+    return param_type
+
+
+def encode_value(value: Any, param_type: str, sizeof: int) -> bytes:
+    if value_type(param_type) == "float":
+        return struct.pack("<f", value)
+    if not isinstance(value, int):
+        raise ValueError(f"Cannot encode {value!r} as {param_type}")
+    return (value % (1 << (8 * sizeof))).to_bytes(sizeof, "little")
+
+
+def assemble_entities(entities: Iterable[Tuple[int, PAC_entity]]) -> bytes:
+    """
+    :param entities: (offset, entity) pairs in the order of offsets, see PAC_parser.stream
+    """
+    res = bytearray()
+    for file_offset, entity in entities:
+        if file_offset != len(res):
+            raise ValueError(f"Entities are not contiguous: expected an entity at {len(res):X}, got {file_offset:X}")
+        res += entity.raw_data
+    return bytes(res)
+
+
+def assemble_file(file: PAC_file) -> bytes:
+    return assemble_entities((file_offset, file.entities[file_offset]) for file_offset in file.entities_offsets)
+
+
+def record_raw_data(record: dict) -> bytes:
+    raw = bytes.fromhex(record["raw"])
+    if record["kind"] == "switch-case table" and "branches" in record:
+        branches = unpack_uint32_array(raw)
+        if branches.tolist() != record["branches"]:
+            branches = type(branches)(branches.typecode, record["branches"])
+            if len(branches) * 4 > len(raw):
+                raise ValueError(f"Switch-case table at {record['offset']:X} can't get more branches")
+            tail = raw[len(branches) * 4:]
+            raw = pack_uint32_array(branches) + tail
+    return raw
+
+
+def patch_instruction_args(image: bytearray, unpatched: bytes, record: dict,
+                           templates: Dict[int, PAC_instruction_template]):
+    if record["signature"] not in templates:
+        return
+    file_offset = record["offset"]
+    instruction = Located_PAC_instruction(unpatched, file_offset, templates[record["signature"]])
+    if len(instruction.ordered_PAC_params) != len(record["args"]):
+        raise ValueError(f"Instruction at {file_offset:X} has {len(instruction.ordered_PAC_params)} args, "
+                         f"the record has {len(record['args'])}")
+    for (param, value), slot, arg in zip(instruction.ordered_PAC_params, instruction.argument_slots(), record["args"]):
+        if same_value(value, arg["value"]):
+            continue
+        if slot is None or arg["type"] != param.type:
+            raise ValueError(f"Cannot encode {{{arg['type']}; {arg['name']}}} of the instruction at {file_offset:X}")
+        value_offset = file_offset + slot.offset
+        image[value_offset:value_offset + slot.sizeof] = encode_value(arg["value"], param.type, slot.sizeof)
+
+
+def assemble_records(records: Iterable[dict], templates: Optional[Dict[int, PAC_instruction_template]] = None) -> bytes:
+    """
+    :param records: pac_renderer.entity_to_dict results, maybe edited
+    :param templates: instruction set to encode the edited instruction args with (the args are ignored if None)
+    """
+    image = bytearray()
+    instructions = []
+    for record in records:
+        if record["offset"] != len(image):
+            raise ValueError(f"Records are not contiguous: expected a record at {len(image):X}, "
+                             f"got {record['offset']:X}")
+        image += record_raw_data(record)
+        if templates is not None and record["kind"] == "instruction":
+            instructions.append(record)
+    # the args are located by parsing the instructions again, they may need the bytes that follow them
+    unpatched = bytes(image)
+    for record in instructions:
+        patch_instruction_args(image, unpatched, record, templates)
+    return bytes(image)
+
+
+def read_records(path: Path) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as source:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+def assemble_jsonl(path: Path, templates: Optional[Dict[int, PAC_instruction_template]] = None) -> bytes:
+    return assemble_records(read_records(path), templates)
+
+
+class Round_trip_result(NamedTuple):
+    size: int
+    entities_difference: int  # -1 if the entities give the original bytes
+    records_difference: int  # the same for the JSON Lines records
+
+
+def verify_round_trip(debugger: PataponDebugger, path: Path) -> Round_trip_result:
+    """
+    pac_corpus job: parses the file, assembles it back from the entities and from their JSON Lines records and
+    compares the results with the original
+    """
+    lines = []
+
+    def assemble_and_render(entities: Iterator[Tuple[int, PAC_entity]]) -> bytes:
+        def rendered():
+            for file_offset, entity in entities:
+                lines.append(format_entity_json(file_offset, entity))
+                yield file_offset, entity
+        return assemble_entities(rendered())
+
+    assembled = stream_PAC_path(debugger, path, assemble_and_render)
+    records = assemble_records((json.loads(line) for line in lines), debugger.PAC_instruction_templates)
+    with map_file_by_path(str(path)) as original:
+        return Round_trip_result(len(original), find_first_difference(assembled, original),
+                                 find_first_difference(records, original))
+
+
+def verify_corpus(directory: Path, instruction_set: Path, workers: Optional[int] = None) -> bool:
+    """
+    Prints the files that don't survive the round trip
+    :return: True if every file does
+    """
+    res = True
+    for outcome in map_PAC_files(list_PAC_files(directory), instruction_set, verify_round_trip, workers):
+        if outcome.error is not None:
+            print(f"{outcome.path.name}: {outcome.error}")
+            res = False
+        elif outcome.result.entities_difference != -1 or outcome.result.records_difference != -1:
+            print(f"{outcome.path.name}: entities differ at {outcome.result.entities_difference:X}, "
+                  f"records differ at {outcome.result.records_difference:X}")
+            res = False
+    return res
+
+
+if __name__ == "__main__":
+    # pac_assembler.py <directory> <instruction set>: round trip verification of every PAC file in the directory
+    if not verify_corpus(Path(sys.argv[1]), Path(sys.argv[2])):
+        exit(1)
+    print("Done!")
@@ -0,0 +1,397 @@
+import json
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from PataponDebugger import PataponDebugger, PAC_parser, PAC_parser_profile, PAC_file, PAC_instruction_template, \
+    defaultMayBeInstruction
+from pac_disassembler import disassemble_to_file
+
+# Synthetic PAC files for measuring the parser speed: we can't ship the game files, so we generate byte streams
+# that contain every kind of entity the parser knows about
+
+const_percent = 0x25
+const_arg_types = [0x40, 0x20, 0x10, 0x8, 0x4, 0x2, 0x1]
+const_left_out_arg_types = [0x1, 0x2, 0x4, 0x8, 0x20, 0x40]
+const_sample_strings = ["cmd_string", "test", "パタポン", "ABC あいうえお", "a", ""]
+
+
+def make_signature(instr_class: int, instr_index: int) -> int:
+    # 25 CC II II, the layout PAC_instruction reads: instr_class is the second byte, instr_index the last two.
+    # defaultMayBeInstruction accepts it if the high byte of the index is not 0 and its low byte is <= 0x24
+    return (const_percent << 24) | (instr_class << 16) | instr_index
+
+
+def make_template(signature: int, name: str, params: List[str]) -> PAC_instruction_template:
+    hex_signature = f"{signature:08X}"
+    instr_info = [hex_signature[0:2], hex_signature[2:4], hex_signature[4:6], hex_signature[6:8], "0",
+                  name, name, "Synthetic instruction", str(len(params)), f"{0x8800000 + (signature & 0xFFFF) * 4:X}"]
+    args_info = []
+    for index, param_type in enumerate(params):
+        args_info += [param_type, f"arg_{index}"]
+    return PAC_instruction_template(instr_info, args_info)
+
+
+def make_synthetic_templates() -> Dict[int, PAC_instruction_template]:
+    """
+    :return: a small instruction set that covers every param kind the generator supports
+    """
+    params_list = [
+        ("cmd_end", []),
+        ("cmd_jmp", ["uint32_t_P"]),
+        ("cmd_call", ["uint32_t_P"]),
+        ("cmd_mov", ["uintX_t_T", "uintX_t_T"]),
+        ("cmd_add", ["uintX_t_T", "uintX_t_T"]),
+        ("cmd_ifEQ", ["uintX_t_T", "uintX_t_T", "uint32_t_P"]),
+        ("cmd_inxJmp", ["uintX_t_T"]),
+        ("cmd_string", ["string"]),
+        ("cmd_setValues16", ["uint16_t_T", "uint16_t_T"]),
+        ("cmd_setValue32", ["uint32_t_T"]),
+        ("cmd_packed", ["uintX_t", "uintXC_t_T"]),
+        ("cmd_countArgs", ["COUNT_byte_uint32t"]),
+        ("cmd_countPointers", ["COUNT_uint32tP_uint32tP"]),
+        ("cmd_countTyped", ["COUNT_uint32t_uint32tP"]),
+        ("cmd_entity", ["ENTITY_ID", "EQUIP_ID", "KEYBIND_ID"]),
+        ("cmd_textOut", ["uintX_t_T", "string"]),
+    ]
+    templates: Dict[int, PAC_instruction_template] = {}
+    for index, (name, params) in enumerate(params_list):
+        template = make_template(make_signature(0, (index + 1) << 8), name, params)
+        templates[template.signature] = template
+    return templates
+
+
+def pack_int(value: int) -> bytes:
+    return struct.pack("<I", value)
+
+
+class PAC_generator:
+    """
+    Generates synthetic PAC byte streams from an instruction set. \n
+    Every instruction is followed by random entities: unknown instructions, message tables, memory entities,
+    left out arguments, switch-case tables (after cmd_inxJmp) and alignment padding (after strings)
+    """
+    def __init__(self, templates: Dict[int, PAC_instruction_template], seed: int = 0):
+        self.templates = templates
+        self.random = random.Random(seed)
+        self.signatures = sorted(templates)
+        self.inxJmp_signature = 0x0
+        for template in templates.values():
+            if template.name == "cmd_inxJmp":
+                self.inxJmp_signature = template.signature
+        self.unknown_signatures = [
+            make_signature(0, high << 8 | low) for low in range(0x20, 0x25) for high in (1, 2, 3)
+            if make_signature(0, high << 8 | low) not in templates
+        ]
+        self.data = bytearray()
+
+    def random_word(self) -> bytes:
+        # a word without the '%' byte so that the parser never stops inside generated data
+        while True:
+            word = pack_int(self.random.getrandbits(32) & 0x7FFFFFFF)
+            if const_percent not in word:
+                return word
+
+    def align(self):
+        while len(self.data) % 4 != 0:
+            self.data.append(0)
+
+    def add_typed_argument(self, type_size: int):
+        arg_type = self.random.choice(const_arg_types)
+        if type_size == 2:
+            # 2-byte float values can't be decoded
+            arg_type = self.random.choice([0x40, 0x20, 0x8, 0x4, 0x2, 0x1])
+            self.data += bytes([arg_type, 0]) + self.random_word()[0:2]
+            return
+        self.data += bytes([arg_type]) + bytes(type_size - 1)
+        if arg_type == 0x10:
+            self.data += struct.pack("<f", self.random.choice([0.5, 1.0, 2.0, 100.0]))
+        else:
+            self.data += self.random_word()
+
+    def add_string(self):
+        self.data += self.random.choice(const_sample_strings).encode("shift-jis") + b"\x00"
+
+    def add_instruction(self, signature: int):
+        template = self.templates[signature]
+        self.data += signature.to_bytes(4, "big")
+        for param in template.PAC_params:
+            param_type = param.type
+            if param_type == "uintX_t":
+                self.align()
+                self.data += self.random_word()
+            elif param_type.startswith("uintX_t_T"):
+                self.align()
+                self.add_typed_argument(4)
+            elif param_type.startswith("uintXC_t_T"):
+                self.add_typed_argument(4 - len(self.data) % 4)
+            elif param_type.startswith("uint32_t_T"):
+                self.add_typed_argument(4)
+            elif param_type.startswith("uint16_t_T"):
+                self.add_typed_argument(2)
+            elif param_type == "string":
+                self.add_string()
+            elif param_type.startswith("COUNT_"):
+                count_info, args_info = param_type.split("_")[1:]
+                count = self.random.randrange(0, 5)
+                if count_info == "byte":
+                    self.data += bytes([count, 0, 0, 0])
+                elif count_info == "uint32t":
+                    self.data += bytes([0x2, 0, 0, 0]) + pack_int(count)
+                else:
+                    self.data += pack_int(count)
+                for i in range(count):
+                    if args_info == "uint32t":
+                        self.add_typed_argument(4)
+                    else:
+                        self.data += self.random_word()
+            elif param_type in ("ENTITY_ID", "EQUIP_ID"):
+                self.data += self.random_word() + self.random_word()
+            else:
+                # uint32_t, uint32_t_P, uint32_t_P_ret, KEYBIND_ID, float
+                self.data += self.random_word()
+
+        if signature == self.inxJmp_signature:
+            # the switch-case table goes right after the instruction
+            for i in range(self.random.randrange(1, 8)):
+                self.data += pack_int(self.random.randrange(0, 0x10000) * 4 & 0x7FFFFFFF).replace(b"%", b"$")
+        elif template.PAC_params and template.PAC_params[-1].type == "string":
+            self.align()
+
+    def add_raw_entity(self, after_plain_instruction: bool):
+        kind = self.random.randrange(4)
+        if kind == 0:
+            # message table
+            self.data += b"".join(pack_int(i) for i in range(self.random.randrange(1, 30)))
+        elif kind == 1 and after_plain_instruction:
+            # left out PAC arguments
+            for i in range(self.random.randrange(1, 4)):
+                self.data += pack_int(self.random.choice(const_left_out_arg_types)) + self.random_word()
+        elif kind == 2:
+            # memory entity with a shift-jis string inside
+            self.add_string()
+            self.align()
+        else:
+            # memory entity
+            self.data += b"".join(self.random_word() for i in range(self.random.randrange(1, 5)))[:-1]
+            self.data.append(1)
+
+    def add_unknown_instruction(self):
+        self.data += self.random.choice(self.unknown_signatures).to_bytes(4, "big")
+        for i in range(self.random.randrange(0, 4)):
+            self.data += self.random_word()
+
+    def generate(self, entities_count: int) -> bytes:
+        self.data = bytearray()
+        for i in range(entities_count):
+            signature = self.random.choice(self.signatures)
+            self.add_instruction(signature)
+            template = self.templates[signature]
+            plain = signature != self.inxJmp_signature and not (
+                template.PAC_params and template.PAC_params[-1].type == "string"
+            )
+            roll = self.random.random()
+            if roll < 0.1 and self.unknown_signatures:
+                self.add_unknown_instruction()
+            elif roll < 0.25:
+                self.add_raw_entity(plain)
+        # the parser needs a signature after the last raw entity to know where it ends
+        self.add_instruction(self.signatures[0])
+        return bytes(self.data)
+
+
+def generate_PAC_corpus(templates: Dict[int, PAC_instruction_template], files_count: int, entities_count: int,
+                        seed: int = 0) -> List[bytes]:
+    generator = PAC_generator(templates, seed)
+    return [generator.generate(entities_count) for i in range(files_count)]
+
+
+def create_parser(templates: Dict[int, PAC_instruction_template]) -> PAC_parser:
+    parser = PAC_parser()
+    parser.setTemplates(templates)
+    parser.instruction_heuristic = defaultMayBeInstruction
+    for template in templates.values():
+        if template.name == "cmd_inxJmp":
+            parser.cmd_inxJmp_signature = template.signature
+    return parser
+
+
+def parse_bytes(templates: Dict[int, PAC_instruction_template], data: bytes) -> PAC_file:
+    file = PAC_file()
+    file.initialize_by_raw_data(data)
+    parser = create_parser(templates)
+    parser.reset(file)
+    parser.parse()
+    return file
+
+
+def profile_parse(templates: Dict[int, PAC_instruction_template], corpus: List[bytes]) -> List[PAC_parser_profile]:
+    """
+    Parses every file with the profiling enabled, use it to find out where the time of benchmark_parse goes
+    """
+    profiles = []
+    for data in corpus:
+        file = PAC_file()
+        file.initialize_by_raw_data(data)
+        parser = create_parser(templates)
+        parser.reset(file)
+        profile = parser.enable_profiling()
+        parser.parse()
+        parser.disable_profiling()
+        profiles.append(profile)
+    return profiles
+
+
+class Benchmark_result(NamedTuple):
+    name: str
+    bytes_count: int
+    entities_count: int
+    seconds: float
+    retained_blocks: int
+    peak_bytes: int
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes_count / self.seconds / 2 ** 20 if self.seconds else 0.0
+
+    @property
+    def entities_per_second(self) -> float:
+        return self.entities_count / self.seconds if self.seconds else 0.0
+
+    @property
+    def retained_blocks_per_entity(self) -> float:
+        return self.retained_blocks / self.entities_count if self.entities_count else 0.0
+
+    @property
+    def peak_bytes_per_entity(self) -> float:
+        return self.peak_bytes / self.entities_count if self.entities_count else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "bytes": self.bytes_count,
+            "entities": self.entities_count,
+            "seconds": self.seconds,
+            "MB/s": self.megabytes_per_second,
+            "entities/s": self.entities_per_second,
+            "retained blocks per entity": self.retained_blocks_per_entity,
+            "peak bytes per entity": self.peak_bytes_per_entity,
+        }
+
+
+def measure_peak_bytes(function: Callable[[], Any]) -> int:
+    # A separate run, tracemalloc slows everything down too much to be used while measuring time
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_parse(templates: Dict[int, PAC_instruction_template], corpus: List[bytes],
+                    repeat: int = 3) -> Benchmark_result:
+    """
+    Measures PAC_parser.parse on every file of the corpus (the best of "repeat" runs is taken). \n
+    Retained blocks are the memory blocks that are still alive after parsing, i.e. the parsed entities;
+    the peak is measured while parsing one file after another
+    """
+    best = float("inf")
+    entities_count = 0
+    retained_blocks = 0
+    for i in range(repeat):
+        blocks_before = sys.getallocatedblocks()
+        start = time.perf_counter()
+        files = [parse_bytes(templates, data) for data in corpus]
+        elapsed = time.perf_counter() - start
+        retained_blocks = sys.getallocatedblocks() - blocks_before
+        entities_count = sum(len(file.entities_offsets) for file in files)
+        best = min(best, elapsed)
+        del files
+    peak_bytes = measure_peak_bytes(lambda: [parse_bytes(templates, data) for data in corpus])
+    return Benchmark_result("PAC_parser.parse", sum(map(len, corpus)), entities_count, best, retained_blocks,
+                            peak_bytes)
+
+
+def benchmark_disassemble(templates: Dict[int, PAC_instruction_template], corpus: List[bytes],
+                          repeat: int = 3) -> Benchmark_result:
+    # Only disassemble_to_file is measured, the files are parsed beforehand
+    files = [parse_bytes(templates, data) for data in corpus]
+    entities_count = sum(len(file.entities_offsets) for file in files)
+    best = float("inf")
+    retained_blocks = 0
+    with tempfile.TemporaryDirectory() as directory:
+        def disassemble_all():
+            for index, file in enumerate(files):
+                disassemble_to_file(file, Path(directory) / f"{index}.txt")
+
+        for i in range(repeat):
+            blocks_before = sys.getallocatedblocks()
+            start = time.perf_counter()
+            disassemble_all()
+            elapsed = time.perf_counter() - start
+            retained_blocks = sys.getallocatedblocks() - blocks_before
+            best = min(best, elapsed)
+        peak_bytes = measure_peak_bytes(disassemble_all)
+    return Benchmark_result("disassemble_to_file", sum(map(len, corpus)), entities_count, best, retained_blocks,
+                            peak_bytes)
+
+
+def run_benchmarks(templates: Optional[Dict[int, PAC_instruction_template]] = None, files_count: int = 10,
+                   entities_count: int = 5000, seed: int = 0, repeat: int = 3) -> List[Benchmark_result]:
+    if templates is None:
+        templates = make_synthetic_templates()
+    corpus = generate_PAC_corpus(templates, files_count, entities_count, seed)
+    return [benchmark_parse(templates, corpus, repeat), benchmark_disassemble(templates, corpus, repeat)]
+
+
+def print_benchmark_report(results: List[Benchmark_result]):
+    for result in results:
+        print(f"{result.name}: {result.bytes_count} bytes, {result.entities_count} entities, {result.seconds:.3f} s, "
+              f"{result.megabytes_per_second:.2f} MB/s, {result.entities_per_second:.0f} entities/s, "
+              f"{result.retained_blocks_per_entity:.1f} retained blocks per entity, "
+              f"{result.peak_bytes_per_entity:.0f} peak bytes per entity")
+
+
+def save_benchmark_report(results: List[Benchmark_result], path: Path):
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump([result.to_dict() for result in results], output, indent=4)
+
+
+def compare_with_baseline(results: List[Benchmark_result], baseline_path: Path, tolerance: float = 0.2) -> bool:
+    """
+    :param results: fresh benchmark results
+    :param baseline_path: report saved by save_benchmark_report
+    :param tolerance: allowed relative slowdown
+    :return: True if no benchmark is slower than the baseline by more than the tolerance
+    """
+    with open(baseline_path, encoding="utf-8") as source:
+        baseline = {entry["name"]: entry for entry in json.load(source)}
+    ok = True
+    for result in results:
+        if result.name not in baseline:
+            continue
+        expected = baseline[result.name]["MB/s"]
+        if result.megabytes_per_second < expected * (1 - tolerance):
+            print(f"Regression in {result.name}: {result.megabytes_per_second:.2f} MB/s, "
+                  f"baseline is {expected:.2f} MB/s")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    # pac_benchmark.py [instruction set path] [baseline report path]
+    loaded_templates = None
+    if len(sys.argv) > 1:
+        debugger = PataponDebugger()
+        debugger.read_instruction_set(sys.argv[1])
+        loaded_templates = debugger.PAC_instruction_templates
+    benchmark_results = run_benchmarks(loaded_templates)
+    print_benchmark_report(benchmark_results)
+    if len(sys.argv) > 2 and not compare_with_baseline(benchmark_results, Path(sys.argv[2])):
+        exit(1)
@@ -0,0 +1,311 @@
+import bisect
+from array import array
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from PataponDebugger import PAC_file, PAC_instruction, Unknown_PAC_instruction, Switch_case_table, Padding_bytes, \
+    Left_out_PAC_arguments, ContiguousCodeBlock, EntryPoint, ExitPoint, PAC_Edge, PAC_transition, const_uint32_typecode
+
+# Control-flow graph of a parsed PAC file. Jump targets are the file offsets in uint32_t_P args and in the switch-case
+# tables that follow cmd_inxJmp. Blocks and edges are kept in arrays:
+#  - block i covers the instructions [block_first[i]; block_first[i + 1]) of instruction_offsets
+#  - edge j goes from edge_sources[j] to edge_targets[j] and has kind edge_kinds[j]
+
+const_edge_fallthrough = 0
+const_edge_jump = 1
+const_edge_branch = 2  # conditional jump
+const_edge_call = 3
+const_edge_switch = 4
+const_edge_potential = 5  # a pointer arg of an instruction we don't know the meaning of
+
+const_edge_kind_names = ["fallthrough", "jump", "branch", "call", "switch", "potential"]
+
+const_edge_transitions = [
+    PAC_transition(False, True, False),
+    PAC_transition(False, False, False),
+    PAC_transition(False, False, False),
+    PAC_transition(True, False, False),
+    PAC_transition(False, False, False),
+    PAC_transition(False, False, True)
+]
+
+# Instructions after which the execution doesn't go to the next one
+const_cfg_terminators = {"cmd_end", "cmd_jmp"}
+const_cfg_calls = {"cmd_call", "cmd_resCall"}
+const_cfg_branches = {"cmd_resJmp"}
+const_cfg_switch = "cmd_inxJmp"
+const_cfg_pointer_types = {"uint32_t_P"}
+
+# Entities that may sit between two instructions of the same block
+cfg_transparent_entity_types = (Padding_bytes, Left_out_PAC_arguments)
+
+
+def instruction_edge_kind(name: str) -> int:
+    """
+    :return: the kind of the edges going to the pointer args of the instruction
+    """
+    if name == "cmd_jmp":
+        return const_edge_jump
+    if name in const_cfg_calls or name.startswith("cmd_ifCall"):
+        return const_edge_call
+    if name in const_cfg_branches or name.startswith("cmd_if"):
+        return const_edge_branch
+    return const_edge_potential
+
+
+class Unresolved_target(NamedTuple):
+    instruction_offset: int
+    target: int
+    kind: int
+
+
+class PAC_CFG:
+    def __init__(self):
+        self.instruction_offsets = array(const_uint32_typecode)
+        # block -> index of its first instruction, + the instructions count at the end
+        self.block_first = array(const_uint32_typecode)
+        self.block_ends = array(const_uint32_typecode)  # block -> file offset after its last instruction
+        self.edge_sources = array(const_uint32_typecode)
+        self.edge_targets = array(const_uint32_typecode)
+        self.edge_kinds = array("B")
+        # block -> start in successors_edges (CSR), + the edges count at the end
+        self.successors_start = array(const_uint32_typecode)
+        self.successors_edges = array(const_uint32_typecode)
+        self.predecessors_start = array(const_uint32_typecode)
+        self.predecessors_edges = array(const_uint32_typecode)
+        self.unresolved: List[Unresolved_target] = []
+
+    @property
+    def blocks_count(self) -> int:
+        return len(self.block_ends)
+
+    @property
+    def edges_count(self) -> int:
+        return len(self.edge_kinds)
+
+    def block_start(self, block: int) -> int:
+        return self.instruction_offsets[self.block_first[block]]
+
+    def block_instructions(self, block: int) -> array:
+        return self.instruction_offsets[self.block_first[block]:self.block_first[block + 1]]
+
+    def block_of(self, file_offset: int) -> int:
+        """
+        :return: the block containing the offset or -1
+        """
+        index = bisect.bisect_right(self.instruction_offsets, file_offset) - 1
+        if index < 0:
+            return -1
+        block = bisect.bisect_right(self.block_first, index) - 1
+        if file_offset >= self.block_ends[block]:
+            return -1
+        return block
+
+    def entry_blocks(self, entry_offsets: Iterable[int] = ()) -> List[int]:
+        """
+        The blocks the game starts the execution at: the first block, the call targets and the blocks of the entry
+        offsets. The blocks no edge goes to are not entries (see unreferenced_blocks)
+        :param entry_offsets: file offsets known to be entries, the ones that are not in a block are ignored
+        :return: sorted block indexes
+        """
+        if not self.blocks_count:
+            return []
+        res = {0}
+        for edge in range(self.edges_count):
+            if self.edge_kinds[edge] == const_edge_call:
+                res.add(self.edge_targets[edge])
+        for file_offset in entry_offsets:
+            block = self.block_of(file_offset)
+            if block != -1:
+                res.add(block)
+        return sorted(res)
+
+    def unreferenced_blocks(self) -> List[int]:
+        """
+        :return: the blocks except for the first one that no edge goes to (dead code or entered from outside the file)
+        """
+        predecessors_start = self.predecessors_start
+        return [block for block in range(1, self.blocks_count)
+                if predecessors_start[block] == predecessors_start[block + 1]]
+
+    def successors(self, block: int) -> Iterator[Tuple[int, int]]:
+        """
+        :return: (target block, edge kind) pairs
+        """
+        for position in range(self.successors_start[block], self.successors_start[block + 1]):
+            edge = self.successors_edges[position]
+            yield self.edge_targets[edge], self.edge_kinds[edge]
+
+    def predecessors(self, block: int) -> Iterator[Tuple[int, int]]:
+        """
+        :return: (source block, edge kind) pairs
+        """
+        for position in range(self.predecessors_start[block], self.predecessors_start[block + 1]):
+            edge = self.predecessors_edges[position]
+            yield self.edge_sources[edge], self.edge_kinds[edge]
+
+    def build_adjacency(self):
+        # counting sort of the edges by source and by target
+        self.successors_start, self.successors_edges = group_edges(self.edge_sources, self.blocks_count)
+        self.predecessors_start, self.predecessors_edges = group_edges(self.edge_targets, self.blocks_count)
+
+    def to_code_blocks(self, file: PAC_file) -> List[ContiguousCodeBlock]:
+        """
+        Converts the graph to ContiguousCodeBlock objects connected with PAC_Edge objects
+        """
+        blocks = []
+        for block in range(self.blocks_count):
+            code_block = ContiguousCodeBlock()
+            code_block.start = self.block_start(block)
+            code_block.size = self.block_ends[block] - code_block.start
+            for file_offset in self.block_instructions(block):
+                instruction = file.entities[file_offset]
+                code_block.instructions[file_offset] = instruction
+                code_block.instructions_offsets.append(file_offset)
+                code_block.ordered_instructions.append(instruction)
+
+            entry_point = EntryPoint()
+            entry_point.position = code_block.start
+            entry_point.code_block = code_block
+            entry_point.instruction = code_block.ordered_instructions[0]
+            code_block.entry_points[code_block.start] = entry_point
+
+            code_block.exit_point = ExitPoint()
+            code_block.exit_point.position = code_block.instructions_offsets[-1]
+            code_block.exit_point.code_block = code_block
+            code_block.exit_point.instruction = code_block.ordered_instructions[-1]
+            blocks.append(code_block)
+
+        for edge in range(self.edges_count):
+            target = blocks[self.edge_targets[edge]]
+            pac_edge = PAC_Edge()
+            pac_edge.exit = blocks[self.edge_sources[edge]].exit_point
+            pac_edge.entry = target.entry_points[target.start]
+            pac_edge.properties = const_edge_transitions[self.edge_kinds[edge]]
+            pac_edge.exit.where_to.append(pac_edge)
+            pac_edge.entry.where_from.append(pac_edge)
+            target.is_source = False
+        return blocks
+
+
+def group_edges(keys: array, groups_count: int) -> Tuple[array, array]:
+    starts = array(const_uint32_typecode, bytes(4 * (groups_count + 1)))
+    for key in keys:
+        starts[key + 1] += 1
+    for group in range(groups_count):
+        starts[group + 1] += starts[group]
+    positions = array(const_uint32_typecode, starts)
+    grouped = array(const_uint32_typecode, bytes(4 * len(keys)))
+    for edge, key in enumerate(keys):
+        grouped[positions[key]] = edge
+        positions[key] += 1
+    return starts, grouped
+
+
+def build_CFG(file: PAC_file) -> PAC_CFG:
+    """
+    Builds the graph of the parsed file in linear time (the instructions are indexed by their offsets)
+    """
+    cfg = PAC_CFG()
+    offsets = cfg.instruction_offsets
+    index_of: Dict[int, int] = {}
+    leaders = bytearray()
+    # (instruction index, target offset, kind)
+    jumps: List[Tuple[int, int, int]] = []
+    falls_through = bytearray()
+    # instruction index -> file offset after it and the padding or left out args that follow it right away,
+    # the execution falls through only to an instruction starting there
+    instruction_ends = array(const_uint32_typecode)
+
+    # name -> (edge kind, is terminator, is switch)
+    names_info: Dict[str, Tuple[int, bool, bool]] = {}
+    next_is_leader = True
+    pending_switch = -1  # index of the cmd_inxJmp instruction waiting for its table
+    for file_offset in file.entities_offsets:
+        entity = file.entities[file_offset]
+        entity_type = type(entity)
+        if entity_type is PAC_instruction or entity_type is Unknown_PAC_instruction:
+            index = len(offsets)
+            index_of[file_offset] = index
+            offsets.append(file_offset)
+            leaders.append(1 if next_is_leader else 0)
+            falls_through.append(1)
+            instruction_ends.append(file_offset + entity.size)
+            next_is_leader = False
+            pending_switch = -1
+            if entity_type is PAC_instruction:
+                name = entity.name
+                info = names_info.get(name)
+                if info is None:
+                    info = names_info[name] = (instruction_edge_kind(name), name in const_cfg_terminators,
+                                               name == const_cfg_switch)
+                kind, is_terminator, is_switch = info
+                for param, value in entity.ordered_PAC_params:
+                    if param.type in const_cfg_pointer_types:
+                        jumps.append((index, value, kind))
+                        next_is_leader = True
+                if is_terminator:
+                    falls_through[index] = 0
+                    next_is_leader = True
+                if is_switch:
+                    pending_switch = index
+                    next_is_leader = True
+        elif entity_type is Switch_case_table:
+            if pending_switch != -1:
+                for branch in entity.branches:
+                    jumps.append((pending_switch, branch, const_edge_switch))
+            pending_switch = -1
+            next_is_leader = True
+        elif isinstance(entity, cfg_transparent_entity_types):
+            if instruction_ends and instruction_ends[-1] == file_offset:
+                instruction_ends[-1] = file_offset + entity.size
+        else:
+            # raw data ends the block
+            next_is_leader = True
+
+    if not offsets:
+        cfg.block_first.append(0)
+        cfg.build_adjacency()
+        return cfg
+
+    for index, target, kind in jumps:
+        target_index = index_of.get(target)
+        if target_index is None:
+            cfg.unresolved.append(Unresolved_target(offsets[index], target, kind))
+        else:
+            leaders[target_index] = 1
+
+    # block_of_instruction[i] = the block of the instruction i
+    block_of_instruction = array(const_uint32_typecode, bytes(4 * len(offsets)))
+    block = -1
+    for index in range(len(offsets)):
+        if leaders[index]:
+            block += 1
+            cfg.block_first.append(index)
+            if block > 0:
+                cfg.block_ends.append(block_end(file, offsets[index - 1]))
+        block_of_instruction[index] = block
+    cfg.block_ends.append(block_end(file, offsets[-1]))
+    cfg.block_first.append(len(offsets))
+
+    # fallthrough edges go from the last instruction of a block to the next instruction if nothing but padding or
+    # left out args lies between them
+    for block in range(cfg.blocks_count - 1):
+        last = cfg.block_first[block + 1] - 1
+        if falls_through[last] and offsets[last + 1] == instruction_ends[last]:
+            add_edge(cfg, block, block + 1, const_edge_fallthrough)
+    for index, target, kind in jumps:
+        target_index = index_of.get(target)
+        if target_index is not None:
+            add_edge(cfg, block_of_instruction[index], block_of_instruction[target_index], kind)
+    cfg.build_adjacency()
+    return cfg
+
+
+def block_end(file: PAC_file, last_instruction_offset: int) -> int:
+    return last_instruction_offset + file.entities[last_instruction_offset].size
+
+
+def add_edge(cfg: PAC_CFG, source: int, target: int, kind: int):
+    cfg.edge_sources.append(source)
+    cfg.edge_targets.append(target)
+    cfg.edge_kinds.append(kind)
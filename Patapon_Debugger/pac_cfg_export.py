@@ -0,0 +1,212 @@
+from array import array
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Set, TextIO
+from xml.sax.saxutils import escape, quoteattr
+
+from PataponDebugger import PAC_file, PAC_instruction, const_uint32_typecode
+from pac_cfg import PAC_CFG, const_edge_call, const_edge_fallthrough, const_edge_kind_names
+
+# Writes PAC_CFG graphs to DOT and GraphML files node by node, so the big graphs never become one huge string.
+# Nodes are the blocks (or chains of blocks if collapsed), the labels are cut to a few instructions
+
+const_dot_edge_styles = [
+    "",  # fallthrough
+    " [style=bold]",  # jump
+    " [style=dashed]",  # branch
+    " [style=dotted, color=blue]",  # call
+    " [color=darkgreen]",  # switch
+    " [style=dashed, color=gray]"  # potential
+]
+
+
+class CFG_export_options(NamedTuple):
+    collapse: bool = False  # merge the blocks that can only be executed one after another
+    cluster: bool = False  # put the blocks of every function (see assign_functions) into a cluster
+    max_label_lines: int = 8
+    max_label_length: int = 60
+    center: Optional[int] = None  # only export the blocks around this file offset...
+    hops: int = 2  # ...that are at most this far from it (the edge directions don't matter)
+
+
+def collapse_chains(cfg: PAC_CFG) -> array:
+    """
+    :return: block -> the first block of its chain (a chain is a sequence of blocks connected with the only
+     fallthrough edge of one block that is the only incoming edge of the next one)
+    """
+    heads = array(const_uint32_typecode, range(cfg.blocks_count))
+    for block in range(1, cfg.blocks_count):
+        previous = block - 1
+        if cfg.predecessors_start[block + 1] - cfg.predecessors_start[block] != 1 or \
+                cfg.successors_start[previous + 1] - cfg.successors_start[previous] != 1:
+            continue
+        source, kind = next(cfg.predecessors(block))
+        if source == previous and kind == const_edge_fallthrough:
+            heads[block] = heads[previous]
+    return heads
+
+
+def assign_functions(cfg: PAC_CFG) -> array:
+    """
+    Functions start at the entry blocks and at the unreferenced blocks (see PAC_CFG.entry_blocks)
+    :return: block -> the first block of the function it belongs to (the function that reaches it first)
+    """
+    unassigned = 0xFFFFFFFF
+    functions = array(const_uint32_typecode, [unassigned]) * cfg.blocks_count
+    queue = deque()
+    for entry in cfg.entry_blocks() + cfg.unreferenced_blocks():
+        if functions[entry] == unassigned:
+            functions[entry] = entry
+            queue.append(entry)
+    rest = 0
+    while True:
+        while queue:
+            block = queue.popleft()
+            for target, kind in cfg.successors(block):
+                if kind != const_edge_call and functions[target] == unassigned:
+                    functions[target] = functions[block]
+                    queue.append(target)
+        # blocks in cycles no entry reaches
+        while rest < cfg.blocks_count and functions[rest] != unassigned:
+            rest += 1
+        if rest == cfg.blocks_count:
+            return functions
+        functions[rest] = rest
+        queue.append(rest)
+
+
+def neighborhood(cfg: PAC_CFG, block: int, hops: int) -> Set[int]:
+    res = {block}
+    frontier = [block]
+    for _ in range(hops):
+        next_frontier = []
+        for current in frontier:
+            for neighbour, _ in list(cfg.successors(current)) + list(cfg.predecessors(current)):
+                if neighbour not in res:
+                    res.add(neighbour)
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return res
+
+
+class Export_graph:
+    """
+    The nodes and edges that are going to be written, see CFG_export_options
+    """
+    def __init__(self, cfg: PAC_CFG, options: CFG_export_options):
+        self.cfg = cfg
+        self.options = options
+        self.heads = collapse_chains(cfg) if options.collapse else array(const_uint32_typecode, range(cfg.blocks_count))
+        self.selected: Optional[Set[int]] = None
+        if options.center is not None:
+            center = cfg.block_of(options.center)
+            if center == -1:
+                raise ValueError(f"There is no code at {options.center:X}")
+            self.selected = neighborhood(cfg, center, options.hops)
+        self.functions = assign_functions(cfg) if options.cluster else None
+
+        # node (its first block) -> blocks
+        self.nodes: Dict[int, List[int]] = {}
+        for block in range(cfg.blocks_count):
+            if self.selected is None or block in self.selected:
+                self.nodes.setdefault(self.heads[block], []).append(block)
+
+    def node_label(self, file: PAC_file, node: int) -> List[str]:
+        lines = []
+        count = 0
+        for block in self.nodes[node]:
+            for file_offset in self.cfg.block_instructions(block):
+                count += 1
+                if len(lines) < self.options.max_label_lines:
+                    entity = file.entities[file_offset]
+                    name = entity.name if type(entity) is PAC_instruction else f"{entity.signature:X}(Unknown)"
+                    line = f"{file_offset:X}: {name}"
+                    if len(line) > self.options.max_label_length:
+                        line = line[:self.options.max_label_length - 3] + "..."
+                    lines.append(line)
+        if count > len(lines) and lines:
+            lines[-1] = f"... ({count - len(lines) + 1} more)"
+        return lines
+
+    def edges(self):
+        """
+        :return: (source node, target node, kind) of the edges between the exported nodes
+        """
+        cfg = self.cfg
+        for edge in range(cfg.edges_count):
+            source = cfg.edge_sources[edge]
+            target = cfg.edge_targets[edge]
+            if self.selected is not None and (source not in self.selected or target not in self.selected):
+                continue
+            source_node = self.heads[source]
+            target_node = self.heads[target]
+            kind = cfg.edge_kinds[edge]
+            if source_node == target_node and kind == const_edge_fallthrough:
+                # a fallthrough inside a collapsed chain
+                continue
+            yield source_node, target_node, kind
+
+    def clusters(self) -> Dict[int, List[int]]:
+        """
+        :return: function -> nodes (every node goes to the function of its first block)
+        """
+        res: Dict[int, List[int]] = {}
+        for node in self.nodes:
+            function = self.functions[node] if self.functions is not None else 0
+            res.setdefault(function, []).append(node)
+        return res
+
+
+def dot_string(text: str) -> str:
+    return "\"" + text.replace("\\", "\\\\").replace("\"", "\\\"") + "\""
+
+
+def write_dot_node(output: TextIO, graph: Export_graph, file: PAC_file, node: int, indent: str):
+    label = "".join(line.replace("\\", "\\\\").replace("\"", "\\\"") + "\\l" for line in graph.node_label(file, node))
+    output.write(f"{indent}n{node} [label=\"{label}\"];\n")
+
+
+def export_CFG_to_dot(cfg: PAC_CFG, file: PAC_file, where_to: Path,
+                      options: CFG_export_options = CFG_export_options()):
+    graph = Export_graph(cfg, options)
+    with open(where_to, "w", encoding="utf-8") as output:
+        output.write(f"digraph {dot_string(file.name or 'PAC')} {{\n")
+        output.write("    node [shape=box, fontname=\"monospace\"];\n")
+        if options.cluster:
+            for function, nodes in graph.clusters().items():
+                output.write(f"    subgraph cluster_{function} {{\n")
+                output.write(f"        label=\"{cfg.block_start(function):X}\";\n")
+                for node in nodes:
+                    write_dot_node(output, graph, file, node, "        ")
+                output.write("    }\n")
+        else:
+            for node in graph.nodes:
+                write_dot_node(output, graph, file, node, "    ")
+        for source, target, kind in graph.edges():
+            output.write(f"    n{source} -> n{target}{const_dot_edge_styles[kind]};\n")
+        output.write("}\n")
+
+
+def export_CFG_to_graphml(cfg: PAC_CFG, file: PAC_file, where_to: Path,
+                          options: CFG_export_options = CFG_export_options()):
+    graph = Export_graph(cfg, options)
+    with open(where_to, "w", encoding="utf-8") as output:
+        output.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+                     "<graphml xmlns=\"http://graphml.graphdrawing.org/xmlns\">\n"
+                     "  <key id=\"label\" for=\"node\" attr.name=\"label\" attr.type=\"string\"/>\n"
+                     "  <key id=\"offset\" for=\"node\" attr.name=\"offset\" attr.type=\"long\"/>\n"
+                     "  <key id=\"function\" for=\"node\" attr.name=\"function\" attr.type=\"long\"/>\n"
+                     "  <key id=\"kind\" for=\"edge\" attr.name=\"kind\" attr.type=\"string\"/>\n"
+                     f"  <graph id={quoteattr(file.name or 'PAC')} edgedefault=\"directed\">\n")
+        for function, nodes in graph.clusters().items():
+            for node in nodes:
+                label = escape("\n".join(graph.node_label(file, node)))
+                output.write(f"    <node id=\"n{node}\"><data key=\"label\">{label}</data>"
+                             f"<data key=\"offset\">{cfg.block_start(node)}</data>")
+                if options.cluster:
+                    output.write(f"<data key=\"function\">{cfg.block_start(function)}</data>")
+                output.write("</node>\n")
+        for source, target, kind in graph.edges():
+            output.write(f"    <edge source=\"n{source}\" target=\"n{target}\">"
+                         f"<data key=\"kind\">{const_edge_kind_names[kind]}</data></edge>\n")
+        output.write("  </graph>\n</graphml>\n")
@@ -0,0 +1,78 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+from PataponDebugger import PataponDebugger, PAC_file, map_file_by_path
+
+# Runs a job over many PAC files in a pool of processes. Each process reads the instruction set once (see
+# init_worker), the jobs must be module level functions taking (debugger, path) so they can be pickled
+
+worker_debugger: Optional[PataponDebugger] = None
+
+
+class Corpus_result(NamedTuple):
+    path: Path
+    result: Any
+    error: Optional[str]
+
+
+def init_worker(instruction_set: str):
+    global worker_debugger
+    worker_debugger = PataponDebugger()
+    worker_debugger.read_instruction_set(instruction_set)
+
+
+def run_job(job: Callable[[PataponDebugger, Path], Any], path: Path) -> Corpus_result:
+    try:
+        return Corpus_result(path, job(worker_debugger, path), None)
+    except Exception as e:
+        return Corpus_result(path, None, f"{type(e).__name__}: {e}")
+
+
+def list_files(directory: Path, patterns: Iterable[str]) -> List[Path]:
+    return sorted({path for pattern in patterns for path in directory.glob(pattern) if path.is_file()})
+
+
+def list_PAC_files(directory: Path) -> List[Path]:
+    return list_files(directory, ["*.pac"])
+
+
+def instruction_set_digest(instruction_set: Path) -> bytes:
+    with open(instruction_set, "rb") as source:
+        return hashlib.md5(source.read()).digest()
+
+
+def map_PAC_files(paths: Iterable[Path], instruction_set: Path, job: Callable[[PataponDebugger, Path], Any],
+                  workers: Optional[int] = None) -> Iterator[Corpus_result]:
+    """
+    Runs the job for every path, results come in the order of completion
+    :param paths: PAC files
+    :param instruction_set: instruction set text file
+    :param job: module level function (debugger, path) -> result
+    :param workers: processes count (os.cpu_count() by default), 1 runs everything in this process
+    """
+    paths = list(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        init_worker(str(instruction_set))
+        for path in paths:
+            yield run_job(job, path)
+        return
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(str(instruction_set),)) as executor:
+        futures = [executor.submit(run_job, job, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def stream_PAC_path(debugger: PataponDebugger, path: Path, consume: Callable[[Iterator], Any]) -> Any:
+    """
+    Maps the file and passes the entities stream (see PAC_parser.stream) to consume
+    """
+    file = PAC_file()
+    with map_file_by_path(str(path)) as raw_data:
+        file.initialize_by_raw_data(raw_data)
+        return consume(debugger.stream_PAC_file(file))
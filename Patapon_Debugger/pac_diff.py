@@ -0,0 +1,248 @@
+import bisect
+import difflib
+import re
+import sys
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from PataponDebugger import PataponDebugger, PAC_file, PAC_entity, PAC_instruction, Unknown_PAC_instruction, \
+    map_file_by_path
+from pac_corpus import list_PAC_files, map_PAC_files
+from pac_renderer import const_entity_kinds, const_other_kind
+
+# Differences between two versions of a PAC file (regional releases, mod versions...):
+#  - the byte ranges that differ (chunks are compared with memcmp, differing chunks are XORed as big ints)
+#  - the entities that were added, removed or changed, with argument-level changes for instructions
+
+const_diff_chunk_size = 1 << 14
+
+non_zero_bytes = re.compile(rb"[^\x00]+")
+
+
+def find_differing_ranges(data_1: bytes, data_2: bytes, chunk_size: int = const_diff_chunk_size) \
+        -> List[Tuple[int, int]]:
+    """
+    :return: sorted [start; end) ranges where the data differs, the tail of the longer data is one more range
+    """
+    ranges: List[Tuple[int, int]] = []
+    size = min(len(data_1), len(data_2))
+
+    def add_range(start: int, end: int):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+
+    for chunk_start in range(0, size, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, size)
+        chunk_1 = data_1[chunk_start:chunk_end]
+        chunk_2 = data_2[chunk_start:chunk_end]
+        if chunk_1 == chunk_2:
+            continue
+        xor = int.from_bytes(chunk_1, "little") ^ int.from_bytes(chunk_2, "little")
+        for match in non_zero_bytes.finditer(xor.to_bytes(chunk_end - chunk_start, "little")):
+            add_range(chunk_start + match.start(), chunk_start + match.end())
+    if len(data_1) != len(data_2):
+        add_range(size, max(len(data_1), len(data_2)))
+    return ranges
+
+
+def entities_in_range(file: PAC_file, start: int, end: int) -> List[int]:
+    """
+    :return: offsets of the entities intersecting [start; end)
+    """
+    offsets = file.entities_offsets
+    first = max(bisect.bisect_right(offsets, start) - 1, 0)
+    last = bisect.bisect_left(offsets, end)
+    return offsets[first:last]
+
+
+class Argument_change(NamedTuple):
+    index: int
+    name: str
+    old: Any
+    new: Any
+
+
+class Entity_change(NamedTuple):
+    change: str  # "added", "removed" or "changed"
+    offset_1: int  # -1 for the added entities
+    offset_2: int  # -1 for the removed entities
+    description: str
+    arguments: List[Argument_change]
+
+
+class PAC_file_diff(NamedTuple):
+    name: str
+    size_1: int
+    size_2: int
+    byte_ranges: List[Tuple[int, int]]
+    changes: List[Entity_change]
+
+    @property
+    def identical(self) -> bool:
+        return not self.byte_ranges
+
+
+def describe_entity(entity: PAC_entity) -> str:
+    if type(entity) is PAC_instruction:
+        return f"{entity.signature:X}:{entity.name}"
+    if type(entity) is Unknown_PAC_instruction:
+        return f"{entity.signature:X}(Unknown)"
+    return f"{const_entity_kinds.get(type(entity), const_other_kind)[0]} ({entity.size} bytes)"
+
+
+def entity_key(entity: PAC_entity) -> Hashable:
+    # equal keys <=> equal entities (the offsets don't matter)
+    if type(entity) is PAC_instruction:
+        return entity.signature, tuple((param.type, param.name, value) for param, value in entity.ordered_PAC_params)
+    return type(entity), bytes(entity.raw_data)
+
+
+def compare_entities(offset_1: int, entity_1: PAC_entity, offset_2: int, entity_2: PAC_entity) -> List[Entity_change]:
+    """
+    Entities that take the same place in both files
+    """
+    if entity_key(entity_1) == entity_key(entity_2):
+        return []
+    if type(entity_1) is PAC_instruction and type(entity_2) is PAC_instruction and \
+            entity_1.signature == entity_2.signature:
+        arguments = []
+        params_1 = entity_1.ordered_PAC_params
+        params_2 = entity_2.ordered_PAC_params
+        for index in range(max(len(params_1), len(params_2))):
+            param, old = params_1[index] if index < len(params_1) else (None, None)
+            new_param, new = params_2[index] if index < len(params_2) else (None, None)
+            if param != new_param or old != new:
+                name = (param or new_param).name
+                arguments.append(Argument_change(index, name, old, new))
+        return [Entity_change("changed", offset_1, offset_2, describe_entity(entity_2), arguments)]
+    if type(entity_1) is type(entity_2) and entity_1.size == entity_2.size:
+        return [Entity_change("changed", offset_1, offset_2, describe_entity(entity_2), [])]
+    return [Entity_change("removed", offset_1, -1, describe_entity(entity_1), []),
+            Entity_change("added", -1, offset_2, describe_entity(entity_2), [])]
+
+
+def diff_entities(file_1: PAC_file, file_2: PAC_file, byte_ranges: List[Tuple[int, int]]) -> List[Entity_change]:
+    if not byte_ranges:
+        return []
+    if len(file_1.raw_data) == len(file_2.raw_data) and file_1.entities_offsets == file_2.entities_offsets:
+        # The layout is the same, only the entities that intersect the differing ranges are compared
+        changes = []
+        compared = set()
+        for start, end in byte_ranges:
+            for file_offset in entities_in_range(file_1, start, end):
+                if file_offset in compared:
+                    continue
+                compared.add(file_offset)
+                changes += compare_entities(file_offset, file_1.entities[file_offset],
+                                            file_offset, file_2.entities[file_offset])
+        return changes
+
+    # Something was inserted or removed: align the entities, the common prefix and suffix are skipped first
+    keys_1 = [entity_key(file_1.entities[file_offset]) for file_offset in file_1.entities_offsets]
+    keys_2 = [entity_key(file_2.entities[file_offset]) for file_offset in file_2.entities_offsets]
+    prefix = 0
+    while prefix < min(len(keys_1), len(keys_2)) and keys_1[prefix] == keys_2[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < min(len(keys_1), len(keys_2)) - prefix and keys_1[-1 - suffix] == keys_2[-1 - suffix]:
+        suffix += 1
+
+    offsets_1 = file_1.entities_offsets[prefix:len(keys_1) - suffix]
+    offsets_2 = file_2.entities_offsets[prefix:len(keys_2) - suffix]
+    matcher = difflib.SequenceMatcher(None, keys_1[prefix:len(keys_1) - suffix],
+                                      keys_2[prefix:len(keys_2) - suffix], autojunk=False)
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        for k in range(paired):
+            changes += compare_entities(offsets_1[i1 + k], file_1.entities[offsets_1[i1 + k]],
+                                        offsets_2[j1 + k], file_2.entities[offsets_2[j1 + k]])
+        for file_offset in offsets_1[i1 + paired:i2]:
+            changes.append(Entity_change("removed", file_offset, -1, describe_entity(file_1.entities[file_offset]), []))
+        for file_offset in offsets_2[j1 + paired:j2]:
+            changes.append(Entity_change("added", -1, file_offset, describe_entity(file_2.entities[file_offset]), []))
+    return changes
+
+
+def parse_PAC_data(debugger: PataponDebugger, data: bytes) -> PAC_file:
+    file = PAC_file()
+    file.initialize_by_raw_data(data)
+    debugger.parse_PAC_file(file)
+    return file
+
+
+def diff_PAC_data(debugger: PataponDebugger, name: str, data_1: bytes, data_2: bytes) -> PAC_file_diff:
+    byte_ranges = find_differing_ranges(data_1, data_2)
+    changes = []
+    if byte_ranges:
+        changes = diff_entities(parse_PAC_data(debugger, data_1), parse_PAC_data(debugger, data_2), byte_ranges)
+    return PAC_file_diff(name, len(data_1), len(data_2), byte_ranges, changes)
+
+
+def diff_PAC_paths(debugger: PataponDebugger, path_1: Path, path_2: Path) -> PAC_file_diff:
+    with map_file_by_path(str(path_1)) as data_1, map_file_by_path(str(path_2)) as data_2:
+        return diff_PAC_data(debugger, path_1.name, data_1, data_2)
+
+
+def diff_PAC_path_with_directory(debugger: PataponDebugger, path: Path, other_directory: Path) -> PAC_file_diff:
+    # pac_corpus job
+    return diff_PAC_paths(debugger, path, other_directory / path.name)
+
+
+class Corpus_diff(NamedTuple):
+    only_1: List[str]
+    only_2: List[str]
+    files: Dict[str, PAC_file_diff]  # the files that differ
+    errors: Dict[str, str]
+
+
+def diff_directories(directory_1: Path, directory_2: Path, instruction_set: Path,
+                     workers: Optional[int] = None) -> Corpus_diff:
+    names_1 = {path.name for path in list_PAC_files(directory_1)}
+    names_2 = {path.name for path in list_PAC_files(directory_2)}
+    common = sorted(names_1 & names_2)
+    job = partial(diff_PAC_path_with_directory, other_directory=directory_2)
+    files = {}
+    errors = {}
+    for outcome in map_PAC_files([directory_1 / name for name in common], instruction_set, job, workers):
+        if outcome.error is not None:
+            errors[outcome.path.name] = outcome.error
+        elif not outcome.result.identical:
+            files[outcome.path.name] = outcome.result
+    return Corpus_diff(sorted(names_1 - names_2), sorted(names_2 - names_1), dict(sorted(files.items())), errors)
+
+
+def format_argument_value(value: Any) -> str:
+    return f"{value:X}" if isinstance(value, int) else repr(value)
+
+
+def print_file_diff(diff: PAC_file_diff):
+    print(f"{diff.name}: {diff.size_1} -> {diff.size_2} bytes, {len(diff.byte_ranges)} differing ranges")
+    for change in diff.changes:
+        offsets = "/".join("-" if file_offset == -1 else f"{file_offset:08X}"
+                           for file_offset in (change.offset_1, change.offset_2))
+        print(f"  {change.change} {offsets} {change.description}")
+        for argument in change.arguments:
+            print(f"    arg {argument.index} ({argument.name}): "
+                  f"{format_argument_value(argument.old)} -> {format_argument_value(argument.new)}")
+
+
+def print_corpus_diff(diff: Corpus_diff):
+    for name in diff.only_1:
+        print(f"{name}: only in the first directory")
+    for name in diff.only_2:
+        print(f"{name}: only in the second directory")
+    for name, error in diff.errors.items():
+        print(f"{name}: {error}")
+    for file_diff in diff.files.values():
+        print_file_diff(file_diff)
+
+
+if __name__ == "__main__":
+    # pac_diff.py <directory 1> <directory 2> <instruction set>
+    print_corpus_diff(diff_directories(Path(sys.argv[1]), Path(sys.argv[2]), Path(sys.argv[3])))
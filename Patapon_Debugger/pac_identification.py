@@ -0,0 +1,180 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from PataponDebugger import PataponDebugger, find_first_difference, map_file_by_path
+from pickle_cache import load_cache, save_cache
+
+# Identifies a PAC file loaded in the emulator memory by its size and, if other files of the game dump have the same
+# size, by a few small windows of its bytes: the windows are chosen when the index is built so that their bytes
+# tell the files of the same size apart. The identification reads const_identification_window bytes per window
+# (usually one or two windows) instead of hashing the whole file
+
+const_identification_index_magic = "PAC identification index"
+const_identification_index_version = 2
+const_identification_window = 32
+
+
+class File_fingerprint(NamedTuple):
+    size: int
+    mtime_ns: int
+    crc32: int  # of the whole file
+
+
+class Identification_group(NamedTuple):
+    windows: List[Tuple[int, int]]  # (offset, size)
+    names: Dict[Tuple[bytes, ...], str]  # bytes of the windows -> file name
+
+
+def fingerprint_path(path: Path) -> Tuple[str, File_fingerprint]:
+    # module level so the pool processes can run it
+    stat = path.stat()
+    with map_file_by_path(str(path)) as data:
+        return path.name, File_fingerprint(stat.st_size, stat.st_mtime_ns, zlib.crc32(data))
+
+
+def window_key(read: Callable[[int, int], bytes], windows: List[Tuple[int, int]]) -> Tuple[bytes, ...]:
+    # the bytes themselves, not their hashes: the window of a difference always tells the two files apart
+    return tuple(bytes(read(offset, size)) for offset, size in windows)
+
+
+def make_identification_group(paths: List[Path], fingerprints: List[File_fingerprint]) -> Identification_group:
+    """
+    :param paths: files of the same size sorted by name, identical files are identified as the first of them
+    """
+    datas = [map_file_by_path(str(path)) for path in paths]
+    try:
+        # identical files are left out
+        distinct: List[int] = []
+        for i in range(len(paths)):
+            if not any(fingerprints[j].crc32 == fingerprints[i].crc32 and
+                       find_first_difference(datas[j], datas[i]) == -1 for j in distinct):
+                distinct.append(i)
+
+        size = fingerprints[0].size
+        windows: List[Tuple[int, int]] = []
+        parts = [distinct]
+        while True:
+            part = next((part for part in parts if len(part) > 1), None)
+            if part is None:
+                break
+            # the first difference of two files of the part is in the window, so the window splits the part at least
+            # in two and the loop ends
+            difference = find_first_difference(datas[part[0]], datas[part[1]])
+            start = max(min(difference - difference % const_identification_window, size - const_identification_window),
+                        0)
+            window = (start, min(const_identification_window, size))
+            windows.append(window)
+            next_parts = []
+            for part_to_split in parts:
+                split: Dict[int, List[int]] = {}
+                for i in part_to_split:
+                    split.setdefault(bytes(datas[i][window[0]:window[0] + window[1]]), []).append(i)
+                next_parts += split.values()
+            parts = next_parts
+
+        names = {}
+        for i in distinct:
+            names[window_key(lambda offset, length: datas[i][offset:offset + length], windows)] = paths[i].name
+        return Identification_group(windows, names)
+    finally:
+        for data in datas:
+            data.close()
+
+
+class PAC_identification_index:
+    def __init__(self):
+        self.files: Dict[str, File_fingerprint] = {}
+        self.unique_sizes: Dict[int, str] = {}  # size -> the only file with this size
+        self.groups: Dict[int, Identification_group] = {}  # size -> files with this size
+
+    def update(self, directory: Path, workers: Optional[int] = None) -> List[str]:
+        """
+        Brings the index up to date with the directory, only the new and changed files are read
+        (and the other files of their sizes if several files have the same size)
+        :param workers: processes count (os.cpu_count() by default), 1 reads everything in this process
+        :return: names of the files that were fingerprinted
+        """
+        stamps = {}
+        for path in directory.glob("*.pac"):
+            if path.is_file():
+                stat = path.stat()
+                stamps[path.name] = (stat.st_size, stat.st_mtime_ns)
+        affected_sizes = set()
+        for name in list(self.files):
+            fingerprint = self.files[name]
+            if stamps.get(name) != (fingerprint.size, fingerprint.mtime_ns):
+                affected_sizes.add(fingerprint.size)
+                del self.files[name]
+
+        changed = sorted(name for name in stamps if name not in self.files)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(changed))
+        paths = [directory / name for name in changed]
+        if workers <= 1:
+            fingerprints = [fingerprint_path(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                fingerprints = list(executor.map(fingerprint_path, paths, chunksize=16))
+        for name, fingerprint in fingerprints:
+            self.files[name] = fingerprint
+            affected_sizes.add(fingerprint.size)
+
+        sizes: Dict[int, List[str]] = {}
+        for name, fingerprint in self.files.items():
+            if fingerprint.size in affected_sizes:
+                sizes.setdefault(fingerprint.size, []).append(name)
+        for size in affected_sizes:
+            self.unique_sizes.pop(size, None)
+            self.groups.pop(size, None)
+            names = sorted(sizes.get(size, []))
+            if len(names) == 1:
+                self.unique_sizes[size] = names[0]
+            elif names:
+                self.groups[size] = make_identification_group([directory / name for name in names],
+                                                              [self.files[name] for name in names])
+        return changed
+
+    def identify(self, size: int, read: Callable[[int, int], bytes]) -> Optional[str]:
+        """
+        :param read: (file offset, size) -> bytes of the file in question
+        :return: the file name or None if the file is not in the index
+        """
+        name = self.unique_sizes.get(size)
+        if name is not None:
+            return name
+        group = self.groups.get(size)
+        if group is None:
+            return None
+        return group.names.get(window_key(read, group.windows))
+
+    def save(self, path: Path):
+        save_cache(path, (const_identification_index_magic, const_identification_index_version), self)
+
+    @classmethod
+    def load(cls, path: Path) -> "PAC_identification_index":
+        """
+        :return: the saved index or an empty one if the file is missing, broken or outdated
+        """
+        index = load_cache(path, (const_identification_index_magic, const_identification_index_version))
+        return index if type(index) is cls else cls()
+
+
+def prepare_PAC_identification(debugger: PataponDebugger, directory: Path, index_path: Optional[Path] = None,
+                               workers: Optional[int] = None) -> PAC_identification_index:
+    """
+    Loads the index of the game dump directory (directory / "identification.index" by default), updates and saves
+    it, then PataponDebugger.identify_PAC uses it instead of prepare_PACs_info data
+    """
+    if index_path is None:
+        index_path = directory / "identification.index"
+    index = PAC_identification_index.load(index_path)
+    files = dict(index.files)
+    index.update(directory, workers)
+    if index.files != files:
+        index.save(index_path)
+    debugger.PAC_identification_index = index
+    return index
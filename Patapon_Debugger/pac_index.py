@@ -0,0 +1,404 @@
+import bisect
+from abc import ABC, abstractmethod
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from PataponDebugger import PataponDebugger, PAC_entity, PAC_instruction, Unknown_PAC_instruction, MSG_file, \
+    const_uint32_typecode
+from pac_corpus import instruction_set_digest, list_files, map_PAC_files, stream_PAC_path
+from pickle_cache import load_cache, save_cache
+
+# Persistent indexes over a directory of PAC files. A file is parsed again only if its size or modification time
+# has changed since the last update (or if the instruction set has changed, then everything is parsed again)
+
+const_index_version = 2
+
+
+class PAC_corpus_index(ABC):
+    """
+    Base class of the indexes: keeps track of the indexed files and saves itself with pickle. \n
+    Subclasses define collect (a pac_corpus job, must be a static module level function), add_file and remove_file
+    """
+    magic = "PAC corpus index"
+    file_patterns = ["*.pac"]
+
+    def __init__(self):
+        self.instruction_set_digest = b""
+        self.files: Dict[str, Tuple[int, int]] = {}  # file name -> (size, st_mtime_ns)
+        self.errors: Dict[str, str] = {}
+
+    @staticmethod
+    @abstractmethod
+    def collect(debugger: PataponDebugger, path: Path) -> Any:
+        pass
+
+    @abstractmethod
+    def add_file(self, name: str, data: Any):
+        pass
+
+    @abstractmethod
+    def remove_file(self, name: str):
+        pass
+
+    def clear(self):
+        for name in list(self.files):
+            self.remove_file(name)
+        self.files.clear()
+        self.errors.clear()
+
+    def update(self, directory: Path, instruction_set: Path, workers: Optional[int] = None) -> List[str]:
+        """
+        Brings the index up to date with the directory
+        :param workers: see pac_corpus.map_PAC_files
+        :return: names of the files that were parsed
+        """
+        digest = instruction_set_digest(instruction_set)
+        if digest != self.instruction_set_digest:
+            self.clear()
+            self.instruction_set_digest = digest
+
+        stamps = {}
+        for path in list_files(directory, self.file_patterns):
+            stat = path.stat()
+            stamps[path.name] = (stat.st_size, stat.st_mtime_ns)
+        for name in list(self.files):
+            if stamps.get(name) != self.files[name]:
+                self.remove_file(name)
+                del self.files[name]
+                self.errors.pop(name, None)
+
+        changed = [name for name in stamps if name not in self.files]
+        for outcome in map_PAC_files([directory / name for name in changed], instruction_set, type(self).collect,
+                                     workers):
+            name = outcome.path.name
+            self.files[name] = stamps[name]
+            if outcome.error is None:
+                self.add_file(name, outcome.result)
+            else:
+                # the file stays in the index so it is not parsed again until it changes
+                self.errors[name] = outcome.error
+        return changed
+
+    def save(self, path: Path):
+        save_cache(path, (self.magic, const_index_version), self)
+
+    @classmethod
+    def load(cls, path: Path):
+        """
+        :return: the saved index or an empty one if the file is missing, broken or outdated
+        """
+        index = load_cache(path, (cls.magic, const_index_version))
+        return index if type(index) is cls else cls()
+
+
+class PAC_signature_index(PAC_corpus_index):
+    """
+    signature -> file name -> offsets of its instructions (both known and unknown ones)
+    """
+    magic = "PAC signature index"
+
+    def __init__(self):
+        PAC_corpus_index.__init__(self)
+        self.postings: Dict[int, Dict[str, array]] = {}
+        # instruction names repeat across the classes of the instruction set
+        self.signature_names: Dict[str, Set[int]] = {}
+
+    @staticmethod
+    def collect(debugger: PataponDebugger, path: Path) -> Dict[int, array]:
+        return stream_PAC_path(debugger, path, collect_signature_postings)
+
+    def add_file(self, name: str, data: Dict[int, array]):
+        for signature, offsets in data.items():
+            if signature not in self.postings:
+                self.postings[signature] = {}
+            self.postings[signature][name] = offsets
+
+    def remove_file(self, name: str):
+        for signature in list(self.postings):
+            files = self.postings[signature]
+            if files.pop(name, None) is not None and not files:
+                del self.postings[signature]
+
+    def update(self, directory: Path, instruction_set: Path, workers: Optional[int] = None) -> List[str]:
+        changed = PAC_corpus_index.update(self, directory, instruction_set, workers)
+        if changed:
+            debugger = PataponDebugger()
+            debugger.read_instruction_set(str(instruction_set))
+            self.signature_names = {}
+            for signature, name in debugger.PAC_signature_to_name.items():
+                self.signature_names.setdefault(name, set()).add(signature)
+        return changed
+
+    def find(self, signature: int) -> Iterator[Tuple[str, int]]:
+        """
+        :return: (file name, offset) of every instruction with this signature
+        """
+        for name, offsets in self.postings.get(signature, {}).items():
+            for offset in offsets:
+                yield name, offset
+
+    def find_by_name(self, instruction_name: str) -> Iterator[Tuple[str, int]]:
+        """
+        :return: (file name, offset) of every instruction with this name, whatever its signature
+        """
+        for signature in sorted(self.signature_names.get(instruction_name, ())):
+            yield from self.find(signature)
+
+    def count(self, signature: int) -> int:
+        return sum(len(offsets) for offsets in self.postings.get(signature, {}).values())
+
+    def files_using(self, signature: int) -> List[str]:
+        return sorted(self.postings.get(signature, {}))
+
+
+def collect_signature_postings(entities: Iterator[Tuple[int, PAC_entity]]) -> Dict[int, array]:
+    postings: Dict[int, array] = {}
+    for offset, entity in entities:
+        if type(entity) is PAC_instruction or type(entity) is Unknown_PAC_instruction:
+            if entity.signature not in postings:
+                postings[entity.signature] = array(const_uint32_typecode)
+            postings[entity.signature].append(offset)
+    return postings
+
+
+# PAC_instruction.argument_switch_case gives variables these types
+const_variable_banks = {"0x4 variable": 0x4, "0x8 variable": 0x8, "0x20 variable": 0x20, "0x40 variable": 0x40}
+
+PAC_variable = Tuple[int, int]  # (bank, id)
+
+
+class Variable_use(NamedTuple):
+    file_name: str
+    offset: int
+    signature: int
+    argument_index: int  # position in PAC_instruction.ordered_PAC_params
+
+
+class Variable_postings(NamedTuple):
+    offsets: array  # ascending, an instruction may be repeated if it uses the variable twice
+    argument_indexes: array
+
+
+class File_variables(NamedTuple):
+    postings: Dict[PAC_variable, Variable_postings]
+    instruction_offsets: array  # ascending offsets of the instructions that use variables
+    instruction_signatures: array
+
+
+class PAC_variable_index(PAC_corpus_index):
+    """
+    (bank, variable id) -> file name -> offsets of the instructions using the variable. \n
+    The instruction set doesn't say which arguments are written, so every use is recorded together with its argument
+    index (setters like cmd_mov write their first argument, the caller knows which signatures are setters)
+    """
+    magic = "PAC variable index"
+
+    def __init__(self):
+        PAC_corpus_index.__init__(self)
+        self.postings: Dict[PAC_variable, Dict[str, Variable_postings]] = {}
+        self.instructions: Dict[str, Tuple[array, array]] = {}  # file name -> (offsets, signatures)
+
+    @staticmethod
+    def collect(debugger: PataponDebugger, path: Path) -> File_variables:
+        return stream_PAC_path(debugger, path, collect_variable_postings)
+
+    def add_file(self, name: str, data: File_variables):
+        for variable, postings in data.postings.items():
+            if variable not in self.postings:
+                self.postings[variable] = {}
+            self.postings[variable][name] = postings
+        self.instructions[name] = (data.instruction_offsets, data.instruction_signatures)
+
+    def remove_file(self, name: str):
+        for variable in list(self.postings):
+            files = self.postings[variable]
+            if files.pop(name, None) is not None and not files:
+                del self.postings[variable]
+        self.instructions.pop(name, None)
+
+    def signature_at(self, name: str, offset: int) -> int:
+        offsets, signatures = self.instructions[name]
+        return signatures[bisect.bisect_left(offsets, offset)]
+
+    def find(self, bank: int, variable_id: int) -> Iterator[Variable_use]:
+        for name, postings in self.postings.get((bank, variable_id), {}).items():
+            for offset, argument_index in zip(postings.offsets, postings.argument_indexes):
+                yield Variable_use(name, offset, self.signature_at(name, offset), argument_index)
+
+    def files_using(self, bank: int, variable_id: int) -> List[str]:
+        return sorted(self.postings.get((bank, variable_id), {}))
+
+    def find_all(self, variables: Iterable[PAC_variable]) -> Iterator[Tuple[str, int, int]]:
+        """
+        :return: (file name, offset, signature) of the instructions that use every given variable
+        """
+        variables_files = sorted((self.postings.get(variable, {}) for variable in variables), key=len)
+        if not variables_files:
+            return
+        for name in sorted(variables_files[0]):
+            if any(name not in files for files in variables_files):
+                continue
+            # starting from the shortest postings keeps the sets small
+            offsets_lists = sorted((files[name].offsets for files in variables_files), key=len)
+            common = set(offsets_lists[0])
+            for offsets in offsets_lists[1:]:
+                common.intersection_update(offsets)
+                if not common:
+                    break
+            for offset in sorted(common):
+                yield name, offset, self.signature_at(name, offset)
+
+    def find_any(self, variables: Iterable[PAC_variable]) -> Iterator[Tuple[str, int, int]]:
+        """
+        :return: (file name, offset, signature) of the instructions that use at least one of the given variables
+        """
+        by_file: Dict[str, set] = {}
+        for variable in variables:
+            for name, postings in self.postings.get(variable, {}).items():
+                by_file.setdefault(name, set()).update(postings.offsets)
+        for name in sorted(by_file):
+            for offset in sorted(by_file[name]):
+                yield name, offset, self.signature_at(name, offset)
+
+
+def collect_variable_postings(entities: Iterator[Tuple[int, PAC_entity]]) -> File_variables:
+    postings: Dict[PAC_variable, Variable_postings] = {}
+    instruction_offsets = array(const_uint32_typecode)
+    instruction_signatures = array(const_uint32_typecode)
+    for offset, entity in entities:
+        if type(entity) is not PAC_instruction:
+            continue
+        uses_variables = False
+        for argument_index, (param, value) in enumerate(entity.ordered_PAC_params):
+            bank = const_variable_banks.get(param.type)
+            if bank is None:
+                continue
+            variable = (bank, value)
+            if variable not in postings:
+                postings[variable] = Variable_postings(array(const_uint32_typecode), array("H"))
+            postings[variable].offsets.append(offset)
+            postings[variable].argument_indexes.append(argument_index)
+            uses_variables = True
+        if uses_variables:
+            instruction_offsets.append(offset)
+            instruction_signatures.append(entity.signature)
+    return File_variables(postings, instruction_offsets, instruction_signatures)
+
+
+class Text_entry(NamedTuple):
+    offset: int
+    signature: int  # 0 for MSG entries
+    index: int  # argument index for PAC string arguments, message index for MSG entries
+    text: str
+
+
+class Text_match(NamedTuple):
+    file_name: str
+    entry: Text_entry
+
+
+class File_text(NamedTuple):
+    entries: List[Text_entry]
+    trigrams: Dict[str, array]  # trigram -> ascending indexes in entries
+
+
+class PAC_text_index(PAC_corpus_index):
+    """
+    Trigram index over the decoded string arguments of PAC files and the UTF-16 strings of MSG files (*.msg). \n
+    A substring query intersects the postings of its trigrams and checks the candidates, queries shorter than 3
+    characters check every entry
+    """
+    magic = "PAC text index"
+    file_patterns = ["*.pac", "*.msg"]
+
+    def __init__(self):
+        PAC_corpus_index.__init__(self)
+        self.entries: Dict[str, List[Text_entry]] = {}
+        self.postings: Dict[str, Dict[str, array]] = {}  # trigram -> file name -> entry indexes
+
+    @staticmethod
+    def collect(debugger: PataponDebugger, path: Path) -> File_text:
+        if path.suffix.lower() == ".msg":
+            entries = collect_MSG_text(path.read_bytes())
+        else:
+            entries = stream_PAC_path(debugger, path, collect_PAC_text)
+        return File_text(entries, make_trigram_postings(entries))
+
+    def add_file(self, name: str, data: File_text):
+        self.entries[name] = data.entries
+        for trigram, indexes in data.trigrams.items():
+            if trigram not in self.postings:
+                self.postings[trigram] = {}
+            self.postings[trigram][name] = indexes
+
+    def remove_file(self, name: str):
+        entries = self.entries.pop(name, None)
+        if entries is None:
+            return
+        for trigram in make_trigram_postings(entries):
+            files = self.postings[trigram]
+            del files[name]
+            if not files:
+                del self.postings[trigram]
+
+    def search(self, text: str) -> Iterator[Text_match]:
+        """
+        :return: entries containing text, ordered by file name and offset
+        """
+        if len(text) < 3:
+            for name in sorted(self.entries):
+                for entry in self.entries[name]:
+                    if text in entry.text:
+                        yield Text_match(name, entry)
+            return
+        trigrams_files = sorted((self.postings.get(trigram, {}) for trigram in split_trigrams(text)), key=len)
+        for name in sorted(trigrams_files[0]):
+            if any(name not in files for files in trigrams_files):
+                continue
+            indexes_lists = sorted((files[name] for files in trigrams_files), key=len)
+            candidates = set(indexes_lists[0])
+            for indexes in indexes_lists[1:]:
+                candidates.intersection_update(indexes)
+                if not candidates:
+                    break
+            entries = self.entries[name]
+            for entry_index in sorted(candidates):
+                if text in entries[entry_index].text:
+                    yield Text_match(name, entries[entry_index])
+
+
+def split_trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def make_trigram_postings(entries: List[Text_entry]) -> Dict[str, array]:
+    postings: Dict[str, array] = {}
+    for entry_index, entry in enumerate(entries):
+        for trigram in split_trigrams(entry.text):
+            if trigram not in postings:
+                postings[trigram] = array(const_uint32_typecode)
+            postings[trigram].append(entry_index)
+    return postings
+
+
+def collect_PAC_text(entities: Iterator[Tuple[int, PAC_entity]]) -> List[Text_entry]:
+    entries = []
+    for offset, entity in entities:
+        if type(entity) is not PAC_instruction:
+            continue
+        for argument_index, (param, value) in enumerate(entity.ordered_PAC_params):
+            if param.type == "string" and value:
+                entries.append(Text_entry(offset, entity.signature, argument_index, value))
+    return entries
+
+
+def collect_MSG_text(raw: bytes) -> List[Text_entry]:
+    file = MSG_file()
+    file.initialize_by_raw_data(raw)
+    entries = []
+    for message_index in range(file.msg_count):
+        text = file[message_index]
+        if text:
+            entries.append(Text_entry(file.offsets[message_index], 0, message_index, text))
+    return entries
@@ -0,0 +1,308 @@
+import bisect
+import json
+import mmap
+import struct
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple
+
+from PataponDebugger import PAC_entity, Memory_entity, Padding_bytes, PAC_instruction, Unknown_PAC_instruction, \
+    Switch_case_table, PAC_message_table, Left_out_PAC_arguments, read_shift_jis_from_bytes, const_uint32_typecode
+
+# Renders parsed entities (see PAC_parser.stream) in one of the output formats:
+#  - "text": the disassembly listing, one line per entity
+#  - "jsonl": one JSON object per entity (see entity_to_dict), raw bytes included
+#  - "binary": the same objects in records that can be read back without parsing the whole file
+#    (see Binary_disassembly)
+# Every entity type has its own formatter, entities are formatted into chunks that are written at once
+
+const_render_chunk_entities = 4096
+
+const_output_extensions = {"text": ".txt", "jsonl": ".jsonl", "binary": ".pacb"}
+
+const_binary_magic = b"PACB"
+const_binary_version = 1
+const_binary_header = struct.Struct("<4sI")  # magic, version
+const_binary_record = struct.Struct("<BIIII")  # kind, offset, signature, raw size, fields size
+const_binary_trailer = struct.Struct("<QI4s")  # index position, records count, magic
+
+const_entity_kinds = {
+    Memory_entity: ("memory", 0),
+    Padding_bytes: ("padding", 1),
+    PAC_instruction: ("instruction", 2),
+    Unknown_PAC_instruction: ("unknown instruction", 3),
+    Switch_case_table: ("switch-case table", 4),
+    PAC_message_table: ("message table", 5),
+    Left_out_PAC_arguments: ("left out args", 6)
+}
+const_other_kind = ("other", 255)
+const_kind_names = {code: name for name, code in list(const_entity_kinds.values()) + [const_other_kind]}
+
+# json.dumps creates a new encoder every time it gets arguments
+json_encoder = json.JSONEncoder(ensure_ascii=False)
+compact_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def format_value_text(value: Any) -> str:
+    if isinstance(value, int):
+        return f"{value:X}"
+    elif isinstance(value, str):
+        return "\"" + value.replace("\x00", "") + "\""
+    return f"{value}"
+
+
+# The exact types of argument values are looked up first, format_value_text handles the rest
+value_text_formatters: Dict[type, Callable[[Any], str]] = {
+    int: lambda value: format(value, "X"),
+    str: lambda value: "\"" + value.replace("\x00", "") + "\"",
+    float: str
+}
+
+# PAC_instruction_param -> "{type; name}="
+param_text_prefixes: Dict[Any, str] = {}
+
+
+def format_memory_entity_text(file_offset: int, entity: Memory_entity) -> str:
+    res = f"Memory entity: size = {entity.size} bytes"
+    try:
+        shift_jis_data = read_shift_jis_from_bytes(entity.raw_data, 0, entity.size)
+        return res + f", shift-jis = ({shift_jis_data})"
+    except UnicodeDecodeError:
+        print(f"Failed to decode shift-jis at {file_offset:X} (that's not a fatal error, don't worry)")
+    except Exception as e:
+        print(f"Error at {file_offset:X}", e)
+    return res
+
+
+def format_padding_text(file_offset: int, padding: Padding_bytes) -> str:
+    return (f"Padding bytes: count = {padding.size}, all zeroes = {padding.zeroes_only}, "
+            f"machine word length = {padding.machine_word_length}")
+
+
+def format_instruction_text(file_offset: int, instruction: PAC_instruction) -> str:
+    args = []
+    for param, value in instruction.ordered_PAC_params:
+        prefix = param_text_prefixes.get(param)
+        if prefix is None:
+            prefix = param_text_prefixes[param] = f"{{{param.type}; {param.name}}}="
+        args.append(prefix + value_text_formatters.get(type(value), format_value_text)(value))
+    res = f"{instruction.signature:X}:{instruction.name}({', '.join(args)})"
+    if instruction.cut_off:
+        res += " [Warning, instruction unexpectedly ends!]"
+    return res
+
+
+def format_unknown_instruction_text(file_offset: int, unknown_instruction: Unknown_PAC_instruction) -> str:
+    return f"{unknown_instruction.signature:X}(Unknown): size = {unknown_instruction.size}"
+
+
+def format_switch_case_table_text(file_offset: int, switch_case_table: Switch_case_table) -> str:
+    addresses = ", ".join(f"{branch:X}" for branch in switch_case_table.branches)
+    return (f"Switch-case table: size = {switch_case_table.size} bytes, "
+            f"branches count = {len(switch_case_table.branches)}, addresses: ({addresses})")
+
+
+def format_message_table_text(file_offset: int, message_table: PAC_message_table) -> str:
+    return f"Message table: size = {message_table.size} bytes, message count = {message_table.msg_count}"
+
+
+def format_left_out_args_text(file_offset: int, left_args: Left_out_PAC_arguments) -> str:
+    return (f"Potential left out PAC args: size = {left_args.size} bytes, "
+            f"supposed full size of the instruction = {left_args.supposed_size}")
+
+
+text_formatters: Dict[type, Callable[[int, Any], str]] = {
+    Memory_entity: format_memory_entity_text,
+    Padding_bytes: format_padding_text,
+    PAC_instruction: format_instruction_text,
+    Unknown_PAC_instruction: format_unknown_instruction_text,
+    Switch_case_table: format_switch_case_table_text,
+    PAC_message_table: format_message_table_text,
+    Left_out_PAC_arguments: format_left_out_args_text
+}
+
+
+def format_entity_text(file_offset: int, entity: PAC_entity) -> str:
+    formatter = text_formatters.get(type(entity))
+    if formatter is None:
+        return f"{file_offset:08X}  \n"
+    return f"{file_offset:08X}  {formatter(file_offset, entity)}\n"
+
+
+def memory_entity_fields(entity: Memory_entity) -> dict:
+    try:
+        return {"shift-jis": read_shift_jis_from_bytes(entity.raw_data, 0, entity.size)}
+    except Exception:
+        return {"shift-jis": None}
+
+
+def instruction_fields(instruction: PAC_instruction) -> dict:
+    return {
+        "signature": instruction.signature,
+        "name": instruction.name,
+        "args": [{"type": param.type, "name": param.name, "value": value}
+                 for param, value in instruction.ordered_PAC_params],
+        "cut off": instruction.cut_off
+    }
+
+
+field_makers: Dict[type, Callable[[Any], dict]] = {
+    Memory_entity: memory_entity_fields,
+    Padding_bytes: lambda padding: {"all zeroes": padding.zeroes_only,
+                                    "machine word length": padding.machine_word_length},
+    PAC_instruction: instruction_fields,
+    Unknown_PAC_instruction: lambda unknown_instruction: {"signature": unknown_instruction.signature},
+    Switch_case_table: lambda switch_case_table: {"branches": switch_case_table.branches.tolist()},
+    PAC_message_table: lambda message_table: {"message count": message_table.msg_count},
+    Left_out_PAC_arguments: lambda left_args: {"supposed size": left_args.supposed_size}
+}
+
+
+def entity_fields(entity: PAC_entity) -> dict:
+    maker = field_makers.get(type(entity))
+    return {} if maker is None else maker(entity)
+
+
+def entity_to_dict(file_offset: int, entity: PAC_entity) -> dict:
+    """
+    :return: {"offset", "kind", "size", "raw" (hex), kind specific fields...}
+    """
+    res = {
+        "offset": file_offset,
+        "kind": const_entity_kinds.get(type(entity), const_other_kind)[0],
+        "size": entity.size,
+        "raw": bytes(entity.raw_data).hex()
+    }
+    res.update(entity_fields(entity))
+    return res
+
+
+def format_entity_json(file_offset: int, entity: PAC_entity) -> str:
+    return json_encoder.encode(entity_to_dict(file_offset, entity)) + "\n"
+
+
+def render_text(entities: Iterable[Tuple[int, PAC_entity]], where_to: Path, formatter: Callable[[int, Any], str]):
+    with open(where_to, "w", encoding="utf-8") as output:
+        chunk = []
+        for file_offset, entity in entities:
+            chunk.append(formatter(file_offset, entity))
+            if len(chunk) == const_render_chunk_entities:
+                output.write("".join(chunk))
+                chunk.clear()
+        output.write("".join(chunk))
+
+
+def binary_record(file_offset: int, entity: PAC_entity) -> bytes:
+    kind = const_entity_kinds.get(type(entity), const_other_kind)[1]
+    signature = getattr(entity, "signature", 0)
+    raw = bytes(entity.raw_data)
+    fields = entity_fields(entity)
+    fields_data = compact_json_encoder.encode(fields).encode("utf-8") if fields else b""
+    return const_binary_record.pack(kind, file_offset, signature, len(raw), len(fields_data)) + raw + fields_data
+
+
+def render_binary(entities: Iterable[Tuple[int, PAC_entity]], where_to: Path):
+    """
+    header, records, index (record positions as uint64, entity offsets as uint32), trailer
+    """
+    positions = array("Q")
+    offsets = array(const_uint32_typecode)
+    with open(where_to, "wb") as output:
+        chunk = bytearray(const_binary_header.pack(const_binary_magic, const_binary_version))
+        position = 0
+        for file_offset, entity in entities:
+            record = binary_record(file_offset, entity)
+            positions.append(position + len(chunk))
+            offsets.append(file_offset)
+            chunk += record
+            if len(positions) % const_render_chunk_entities == 0:
+                output.write(chunk)
+                position += len(chunk)
+                chunk.clear()
+        index_position = position + len(chunk)
+        chunk += positions.tobytes()
+        chunk += offsets.tobytes()
+        chunk += const_binary_trailer.pack(index_position, len(positions), const_binary_magic)
+        output.write(chunk)
+
+
+def render_entities(entities: Iterable[Tuple[int, PAC_entity]], where_to: Path, output_format: str = "text"):
+    # entities can be produced by PAC_parser.stream, so the file is written while it is being parsed
+    if output_format == "text":
+        render_text(entities, where_to, format_entity_text)
+    elif output_format == "jsonl":
+        render_text(entities, where_to, format_entity_json)
+    elif output_format == "binary":
+        render_binary(entities, where_to)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+
+class Binary_disassembly:
+    """
+    Reads the "binary" output format, records are decoded on demand. \n
+    The index is written in the byte order of the machine that rendered the file
+    """
+    def __init__(self, path: Path):
+        with open(path, "rb") as source:
+            self.data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = const_binary_header.unpack_from(self.data, 0)
+        if magic != const_binary_magic or version != const_binary_version:
+            self.data.close()
+            raise ValueError(f"{path} is not a binary disassembly of version {const_binary_version}")
+        index_position, count, _ = const_binary_trailer.unpack_from(self.data,
+                                                                    len(self.data) - const_binary_trailer.size)
+        self.positions = array("Q")
+        self.positions.frombytes(self.data[index_position:index_position + 8 * count])
+        self.offsets = array(const_uint32_typecode)
+        self.offsets.frombytes(self.data[index_position + 8 * count:index_position + 12 * count])
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, index: int) -> dict:
+        """
+        :return: the same dictionary as entity_to_dict gives
+        """
+        position = self.positions[index]
+        kind, file_offset, _, raw_size, fields_size = const_binary_record.unpack_from(self.data, position)
+        raw_start = position + const_binary_record.size
+        fields_start = raw_start + raw_size
+        res = {
+            "offset": file_offset,
+            "kind": const_kind_names[kind],
+            "size": raw_size,
+            "raw": self.data[raw_start:fields_start].hex()
+        }
+        if fields_size:
+            res.update(json.loads(self.data[fields_start:fields_start + fields_size].decode("utf-8")))
+        return res
+
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def signature(self, index: int) -> int:
+        # 0 for the entities that are not instructions, the record is not decoded
+        return const_binary_record.unpack_from(self.data, self.positions[index])[2]
+
+    def raw_data(self, index: int) -> bytes:
+        position = self.positions[index]
+        raw_size = const_binary_record.unpack_from(self.data, position)[3]
+        raw_start = position + const_binary_record.size
+        return self.data[raw_start:raw_start + raw_size]
+
+    def find(self, file_offset: int) -> int:
+        """
+        :return: index of the entity that contains file_offset (-1 if file_offset is before the first entity)
+        """
+        return bisect.bisect_right(self.offsets, file_offset) - 1
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,230 @@
+import re
+import sys
+from array import array
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Tuple
+
+from PataponDebugger import PataponDebugger, PAC_entity, PAC_instruction, Unknown_PAC_instruction, const_uint32_typecode
+from pac_corpus import list_PAC_files, map_PAC_files, stream_PAC_path
+from pac_index import PAC_signature_index
+
+# Searches instruction sequences in parsed files. A pattern is a list of steps separated with ";":
+#   cmd_mov[0:0x8 variable, 1=0x10] ; ~5 ; cmd_add | cmd_sub ; * ; 0x1A0002
+#  - an instruction name, a signature or alternatives separated with "|", "*" matches any instruction
+#  - [i:type] the arg i has this type ("0x8" is enough for "0x8 variable"), [i=value] the arg i has this value
+#    (an integer or a "string"), [i:type=value] both
+#  - ~N lets up to N instructions come before the next step (the steps follow each other immediately otherwise)
+# The pattern is compiled to an automaton (see PAC_pattern_automaton) that reads the signatures of the instructions
+# of a file once, the files that can't match are skipped with PAC_signature_index if there is one
+
+const_pattern_gap = re.compile(r"~(\d+)")
+const_pattern_step = re.compile(r"([^\[\]]+?)\s*(?:\[(.*)\])?")
+const_pattern_constraint = re.compile(r"(\d+)\s*(?::\s*([^=]+?))?\s*(?:=\s*(.+))?")
+
+
+class Argument_constraint(NamedTuple):
+    index: int
+    type: Optional[str]
+    value: Any  # None matches any value
+
+    def matches(self, instruction: PAC_entity) -> bool:
+        if type(instruction) is not PAC_instruction or self.index >= len(instruction.ordered_PAC_params):
+            return False
+        param, value = instruction.ordered_PAC_params[self.index]
+        if self.type is not None and param.type != self.type and not param.type.startswith(self.type + " "):
+            return False
+        if self.value is not None:
+            if isinstance(self.value, str):
+                return isinstance(value, str) and value.rstrip("\x00") == self.value
+            return value == self.value
+        return True
+
+
+class Pattern_step(NamedTuple):
+    names: FrozenSet[str]  # instruction names, empty for the wildcard
+    signatures: FrozenSet[int]  # the signatures given as numbers
+    constraints: Tuple[Argument_constraint, ...]
+    gap: int  # how many instructions may come before this step
+
+    @property
+    def is_wildcard(self) -> bool:
+        return not self.names and not self.signatures
+
+
+class Pattern_match(NamedTuple):
+    file_name: str
+    offsets: Tuple[int, ...]  # of the instructions that matched the steps
+
+
+def parse_constraint_value(text: str) -> Any:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == "\"":
+        return text[1:-1]
+    return int(text, 0)
+
+
+def compile_pattern(text: str) -> List[Pattern_step]:
+    steps: List[Pattern_step] = []
+    gap = 0
+    for token in text.split(";"):
+        token = token.strip()
+        gap_match = const_pattern_gap.fullmatch(token)
+        if gap_match is not None:
+            if not steps:
+                raise ValueError(f"The pattern can't start with a gap: {text}")
+            gap += int(gap_match.group(1))
+            continue
+        step_match = const_pattern_step.fullmatch(token)
+        if step_match is None:
+            raise ValueError(f"Bad pattern step: {token}")
+        names = set()
+        signatures = set()
+        for alternative in step_match.group(1).split("|"):
+            alternative = alternative.strip()
+            if alternative == "*":
+                continue
+            if alternative.lower().startswith("0x"):
+                signatures.add(int(alternative, 16))
+            else:
+                names.add(alternative)
+        constraints = []
+        if step_match.group(2):
+            for constraint_text in step_match.group(2).split(","):
+                constraint_match = const_pattern_constraint.fullmatch(constraint_text.strip())
+                if constraint_match is None:
+                    raise ValueError(f"Bad argument constraint: {constraint_text}")
+                index, arg_type, value = constraint_match.groups()
+                constraints.append(Argument_constraint(int(index), arg_type,
+                                                       None if value is None else parse_constraint_value(value)))
+        steps.append(Pattern_step(frozenset(names), frozenset(signatures), tuple(constraints), gap))
+        gap = 0
+    if not steps:
+        raise ValueError("Empty pattern")
+    if gap:
+        raise ValueError(f"The pattern can't end with a gap: {text}")
+    return steps
+
+
+class PAC_pattern_automaton:
+    """
+    The steps with their names resolved to signatures. The automaton states are (step, gaps left, matched offsets),
+    all of them are advanced by every instruction
+    """
+    def __init__(self, steps: List[Pattern_step], signature_to_name: Dict[int, str]):
+        self.steps = steps
+        name_to_signatures: Dict[str, set] = {}
+        for signature, name in signature_to_name.items():
+            name_to_signatures.setdefault(name, set()).add(signature)
+        # step -> accepted signatures or None for any
+        self.accepted: List[Optional[FrozenSet[int]]] = []
+        for step in steps:
+            if step.is_wildcard:
+                self.accepted.append(None)
+                continue
+            signatures = set(step.signatures)
+            for name in step.names:
+                signatures |= name_to_signatures.get(name, set())
+            self.accepted.append(frozenset(signatures))
+
+    def step_matches(self, step: int, signature: int, instruction: PAC_entity) -> bool:
+        accepted = self.accepted[step]
+        if accepted is not None and signature not in accepted:
+            return False
+        return all(constraint.matches(instruction) for constraint in self.steps[step].constraints)
+
+    def run(self, signatures: array, offsets: array, instructions: List[PAC_entity]) -> Iterator[Tuple[int, ...]]:
+        """
+        :return: offsets of the matched instructions, one match for every instruction the first step matched
+        """
+        last = len(self.steps) - 1
+        first_accepted = self.accepted[0]
+        states: Dict[Tuple[int, int, Tuple[int, ...]], None] = {}
+        for position, signature in enumerate(signatures):
+            instruction = instructions[position]
+            offset = offsets[position]
+            next_states: Dict[Tuple[int, int, Tuple[int, ...]], None] = {}
+            completed = set()
+            candidates = list(states)
+            if first_accepted is None or signature in first_accepted:
+                candidates.append((0, 0, ()))
+            for step, gaps_left, matched in candidates:
+                if matched and matched[0] in completed:
+                    continue
+                if self.step_matches(step, signature, instruction):
+                    if step == last:
+                        completed.add((matched + (offset,))[0])
+                        yield matched + (offset,)
+                        continue
+                    next_states[(step + 1, self.steps[step + 1].gap, matched + (offset,))] = None
+                if gaps_left:
+                    next_states[(step, gaps_left - 1, matched)] = None
+            states = {state: None for state in next_states if not state[2] or state[2][0] not in completed}
+
+
+def collect_instructions(entities: Iterator[Tuple[int, PAC_entity]]) -> Tuple[array, array, List[PAC_entity]]:
+    signatures = array(const_uint32_typecode)
+    offsets = array(const_uint32_typecode)
+    instructions = []
+    for offset, entity in entities:
+        if type(entity) is PAC_instruction or type(entity) is Unknown_PAC_instruction:
+            signatures.append(entity.signature)
+            offsets.append(offset)
+            instructions.append(entity)
+    return signatures, offsets, instructions
+
+
+def search_PAC_path(debugger: PataponDebugger, path: Path, pattern: str) -> List[Pattern_match]:
+    # pac_corpus job, the pattern is compiled in every process
+    automaton = PAC_pattern_automaton(compile_pattern(pattern), debugger.PAC_signature_to_name)
+    signatures, offsets, instructions = stream_PAC_path(debugger, path, collect_instructions)
+    return [Pattern_match(path.name, matched) for matched in automaton.run(signatures, offsets, instructions)]
+
+
+def candidate_files(steps: List[Pattern_step], index: PAC_signature_index) -> Optional[set]:
+    """
+    :return: names of the files that have an instruction for every step (None if every file may match)
+    """
+    res = None
+    for step in steps:
+        if step.is_wildcard:
+            continue
+        signatures = set(step.signatures)
+        for name in step.names:
+            # every signature of the name, names repeat across instruction classes
+            signatures |= index.signature_names.get(name, set())
+        files = set()
+        for signature in signatures:
+            files.update(index.postings.get(signature, {}))
+        res = files if res is None else res & files
+    return res
+
+
+def search_directory(directory: Path, instruction_set: Path, pattern: str,
+                     index: Optional[PAC_signature_index] = None, workers: Optional[int] = None) \
+        -> Dict[str, List[Pattern_match]]:
+    """
+    :param index: up to date signature index of the directory, the files it rules out are not parsed
+    :return: file name -> matches, only the files with matches are there
+    """
+    steps = compile_pattern(pattern)
+    paths = list_PAC_files(directory)
+    if index is not None:
+        candidates = candidate_files(steps, index)
+        if candidates is not None:
+            paths = [path for path in paths if path.name in candidates or path.name not in index.files]
+    res = {}
+    for outcome in map_PAC_files(paths, instruction_set, partial(search_PAC_path, pattern=pattern), workers):
+        if outcome.error is not None:
+            print(f"{outcome.path.name}: {outcome.error}")
+        elif outcome.result:
+            res[outcome.path.name] = outcome.result
+    return dict(sorted(res.items()))
+
+
+if __name__ == "__main__":
+    # pac_search.py <directory> <instruction set> <pattern> [signature index]
+    signature_index = PAC_signature_index.load(Path(sys.argv[4])) if len(sys.argv) > 4 else None
+    for file_matches in search_directory(Path(sys.argv[1]), Path(sys.argv[2]), sys.argv[3], signature_index).values():
+        for pattern_match in file_matches:
+            print(f"{pattern_match.file_name}: " + " ".join(f"{offset:08X}" for offset in pattern_match.offsets))
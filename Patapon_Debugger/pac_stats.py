@@ -0,0 +1,196 @@
+import csv
+import json
+import sys
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+from PataponDebugger import PataponDebugger, PAC_entity, PAC_instruction, Unknown_PAC_instruction, const_uint32_typecode
+from pac_corpus import list_PAC_files, map_PAC_files, stream_PAC_path
+
+# Instruction statistics of a parsed corpus. Every file is turned into columns (one array per field, one row per
+# instruction or per argument), the columns are grouped with Counter(zip(...)) in the worker processes and only the
+# counts are sent back and merged. Meant to be rerun after every instruction set revision: known_rate tells how much
+# of the corpus the instruction set covers
+
+
+class File_columns(NamedTuple):
+    instruction_signatures: array  # every instruction, unknown ones included
+    instruction_known: array  # 1 for PAC_instruction
+    instruction_cut_off: array
+    argument_signatures: array  # every argument of every known instruction
+    argument_indexes: array
+    argument_types: list
+    string_lengths: array  # characters in string args (without the terminator)
+
+
+class File_statistics(NamedTuple):
+    name: str
+    size: int
+    instructions_count: int
+    unknown_instructions_count: int
+    cut_instructions_count: int
+    signatures: Counter  # signature -> count
+    argument_types: Counter  # (signature, arg index, type) -> count
+    string_lengths: Counter  # length -> count
+
+    @property
+    def known_rate(self) -> float:
+        return self.instructions_count / (self.instructions_count + self.unknown_instructions_count) \
+            if self.instructions_count + self.unknown_instructions_count else 1.0
+
+    @property
+    def cut_off_rate(self) -> float:
+        return self.cut_instructions_count / self.instructions_count if self.instructions_count else 0.0
+
+
+def collect_columns(entities: Iterator[Tuple[int, PAC_entity]]) -> File_columns:
+    columns = File_columns(array(const_uint32_typecode), array("B"), array("B"), array(const_uint32_typecode),
+                           array("H"), [], array(const_uint32_typecode))
+    for _, entity in entities:
+        entity_type = type(entity)
+        if entity_type is PAC_instruction:
+            columns.instruction_signatures.append(entity.signature)
+            columns.instruction_known.append(1)
+            columns.instruction_cut_off.append(1 if entity.cut_off else 0)
+            for index, (param, value) in enumerate(entity.ordered_PAC_params):
+                columns.argument_signatures.append(entity.signature)
+                columns.argument_indexes.append(index)
+                columns.argument_types.append(param.type)
+                if param.type == "string" and isinstance(value, str):
+                    columns.string_lengths.append(len(value.rstrip("\x00")))
+        elif entity_type is Unknown_PAC_instruction:
+            columns.instruction_signatures.append(entity.signature)
+            columns.instruction_known.append(0)
+            columns.instruction_cut_off.append(0)
+    return columns
+
+
+def group_columns(name: str, size: int, columns: File_columns) -> File_statistics:
+    known = sum(columns.instruction_known)
+    return File_statistics(
+        name, size, known, len(columns.instruction_known) - known, sum(columns.instruction_cut_off),
+        Counter(columns.instruction_signatures),
+        Counter(zip(columns.argument_signatures, columns.argument_indexes, columns.argument_types)),
+        Counter(columns.string_lengths)
+    )
+
+
+def collect_file_statistics(debugger: PataponDebugger, path: Path) -> File_statistics:
+    # pac_corpus job
+    return group_columns(path.name, path.stat().st_size, stream_PAC_path(debugger, path, collect_columns))
+
+
+class Corpus_statistics:
+    def __init__(self, signature_to_name: Dict[int, str]):
+        self.signature_to_name = signature_to_name
+        self.files: Dict[str, File_statistics] = {}
+        self.errors: Dict[str, str] = {}
+        self.signatures = Counter()
+        self.signature_files = Counter()  # signature -> files using it
+        self.argument_types = Counter()
+        self.string_lengths = Counter()
+
+    def add_file(self, statistics: File_statistics):
+        self.files[statistics.name] = statistics
+        self.signatures.update(statistics.signatures)
+        self.signature_files.update(statistics.signatures.keys())
+        self.argument_types.update(statistics.argument_types)
+        self.string_lengths.update(statistics.string_lengths)
+
+    @property
+    def instructions_count(self) -> int:
+        return sum(statistics.instructions_count for statistics in self.files.values())
+
+    @property
+    def unknown_instructions_count(self) -> int:
+        return sum(statistics.unknown_instructions_count for statistics in self.files.values())
+
+    @property
+    def known_rate(self) -> float:
+        total = self.instructions_count + self.unknown_instructions_count
+        return self.instructions_count / total if total else 1.0
+
+    def signature_name(self, signature: int) -> str:
+        return self.signature_to_name.get(signature, "Unknown")
+
+    def string_length_histogram(self) -> Dict[int, int]:
+        """
+        :return: power of 2 bucket start (0, 1, 2, 4, 8...) -> count of the strings with lengths in the bucket
+        """
+        res = Counter()
+        for length, count in self.string_lengths.items():
+            res[1 << (length.bit_length() - 1) if length else 0] += count
+        return dict(sorted(res.items()))
+
+    def to_dict(self) -> dict:
+        return {
+            "instructions": self.instructions_count,
+            "unknown instructions": self.unknown_instructions_count,
+            "known rate": self.known_rate,
+            "files": {name: {"size": statistics.size, "instructions": statistics.instructions_count,
+                             "unknown instructions": statistics.unknown_instructions_count,
+                             "cut instructions": statistics.cut_instructions_count,
+                             "known rate": statistics.known_rate, "cut off rate": statistics.cut_off_rate}
+                      for name, statistics in sorted(self.files.items())},
+            "errors": self.errors,
+            "signatures": [{"signature": signature, "name": self.signature_name(signature), "count": count,
+                            "files": self.signature_files[signature]}
+                           for signature, count in self.signatures.most_common()],
+            "argument types": [{"signature": signature, "name": self.signature_name(signature), "index": index,
+                                "type": arg_type, "count": count}
+                               for (signature, index, arg_type), count in sorted(self.argument_types.items())],
+            "string lengths": self.string_length_histogram()
+        }
+
+    def save_json(self, path: Path):
+        with open(path, "w", encoding="utf-8") as dest:
+            json.dump(self.to_dict(), dest, indent=1)
+
+    def save_csv(self, directory: Path):
+        """
+        Writes files.csv, signatures.csv, argument_types.csv and string_lengths.csv
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        data = self.to_dict()
+        with open(directory / "files.csv", "w", encoding="utf-8", newline="") as dest:
+            writer = csv.writer(dest)
+            writer.writerow(["file", "size", "instructions", "unknown instructions", "cut instructions", "known rate",
+                             "cut off rate"])
+            for name, row in data["files"].items():
+                writer.writerow([name] + list(row.values()))
+        for table, file_name in (("signatures", "signatures.csv"), ("argument types", "argument_types.csv")):
+            with open(directory / file_name, "w", encoding="utf-8", newline="") as dest:
+                writer = csv.writer(dest)
+                rows = data[table]
+                if rows:
+                    writer.writerow(rows[0].keys())
+                for row in rows:
+                    writer.writerow(f"{value:08X}" if key == "signature" else value for key, value in row.items())
+        with open(directory / "string_lengths.csv", "w", encoding="utf-8", newline="") as dest:
+            writer = csv.writer(dest)
+            writer.writerow(["length", "count"])
+            writer.writerows(sorted(self.string_lengths.items()))
+
+
+def collect_corpus_statistics(directory: Path, instruction_set: Path, workers: Optional[int] = None) \
+        -> Corpus_statistics:
+    debugger = PataponDebugger()
+    debugger.read_instruction_set(str(instruction_set))
+    res = Corpus_statistics(debugger.PAC_signature_to_name)
+    for outcome in map_PAC_files(list_PAC_files(directory), instruction_set, collect_file_statistics, workers):
+        if outcome.error is not None:
+            res.errors[outcome.path.name] = outcome.error
+        else:
+            res.add_file(outcome.result)
+    return res
+
+
+if __name__ == "__main__":
+    # pac_stats.py <directory> <instruction set> <output directory>
+    corpus_statistics = collect_corpus_statistics(Path(sys.argv[1]), Path(sys.argv[2]))
+    corpus_statistics.save_csv(Path(sys.argv[3]))
+    corpus_statistics.save_json(Path(sys.argv[3]) / "statistics.json")
+    total_instructions = corpus_statistics.instructions_count + corpus_statistics.unknown_instructions_count
+    print(f"{corpus_statistics.known_rate:.2%} of {total_instructions} instructions are known")
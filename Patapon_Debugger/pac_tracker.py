@@ -0,0 +1,285 @@
+import asyncio
+import bisect
+import re
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+import PPSSPPDebugger
+from PataponDebugger import PataponDebugger, PAC_file, unpack_uint32_array
+
+# Keeps the map of the PAC files loaded in the emulator memory (address -> name), so the files are identified once
+# per load instead of once per lookup (PataponDebugger.identify_PAC uses the map, see track_resident_PACs).
+# The map is updated from load events:
+#  - scan_memory reads a memory range once and finds the files by their allocator headers (the word before a file
+#    points to an allocation info whose first word is the file end)
+#  - hook_loader places a logging breakpoint (it doesn't pause the game) in the game file loader, listen reads its
+#    log messages through one open connection and identifies the file at the logged address
+#  - scan identifies the files at addresses found some other way
+# validate rereads the allocator headers of the known files (two ints per file, see PataponDebugger.get_PAC_size) and
+# forgets or identifies again the files whose size changed, validate(deep=True) also identifies every file again
+# (cheap with PataponDebugger.PAC_identification_index) to notice files replaced by ones of the same size
+
+const_load_log_marker = "PAC loaded at "
+const_load_log_address = re.compile(re.escape(const_load_log_marker) + r"(?:0x)?([0-9A-Fa-f]+)")
+# PSP user memory, where the game allocates the files
+const_user_memory_start = 0x08800000
+const_user_memory_size = 0x01800000
+const_header_mark = re.compile(b"\x01")
+
+
+def header_marks(data: bytes, start: int, end: int) -> bytes:
+    """
+    :param data: words of the range [start; end)
+    :return: a byte per word, 1 if the word may be an allocator header: an aligned address in the range, so its
+     lowest byte is a multiple of 4 and its highest byte is one of the range (the words are not unpacked, every 4th
+     byte of data is taken at once)
+    """
+    aligned = bytes(1 if value & 3 == 0 else 0 for value in range(256))
+    in_range = bytes(1 if start >> 24 <= value <= (end - 1) >> 24 else 0 for value in range(256))
+    lowest = int.from_bytes(data[0::4].translate(aligned), "little")
+    highest = int.from_bytes(data[3::4].translate(in_range), "little")
+    return (lowest & highest).to_bytes(len(data) // 4, "little")
+
+
+class Resident_PAC(NamedTuple):
+    address: int
+    size: int
+    name: str
+
+    @property
+    def end(self) -> int:
+        return self.address + self.size
+
+
+class Resident_PAC_tracker:
+    def __init__(self, debugger: PataponDebugger):
+        self.debugger = debugger
+        self.files: Dict[int, Resident_PAC] = {}  # address -> file
+        self.addresses: List[int] = []  # sorted keys of files
+        self.subscribers: List[Callable[[Resident_PAC, bool], None]] = []  # (file, loaded or unloaded)
+        self.loader_hooks: List[int] = []  # addresses of the logging breakpoints
+
+    def subscribe(self, callback: Callable[[Resident_PAC, bool], None]):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Resident_PAC, bool], None]):
+        self.subscribers.remove(callback)
+
+    def notify(self, file: Resident_PAC, loaded: bool):
+        for callback in list(self.subscribers):
+            callback(file, loaded)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __iter__(self):
+        return (self.files[address] for address in self.addresses)
+
+    def file_at(self, address: int) -> Optional[Resident_PAC]:
+        """
+        :return: the file the address belongs to (not necessarily its start) or None
+        """
+        i = bisect.bisect_right(self.addresses, address) - 1
+        if i < 0:
+            return None
+        file = self.files[self.addresses[i]]
+        return file if address < file.end else None
+
+    def name_at(self, address: int) -> Optional[str]:
+        file = self.file_at(address)
+        return None if file is None else file.name
+
+    def find(self, name: str) -> List[Resident_PAC]:
+        return [file for file in self if file.name == name]
+
+    def inspect(self, address: int) -> PAC_file:
+        """
+        Parses the file loaded at the address without identifying it again
+        """
+        file = self.files[address]
+        return self.debugger.grab_PAC_from_memory(file.address, file.size, file.name)
+
+    def add(self, file: Resident_PAC):
+        # the files it overlaps were freed before it was loaded
+        i = bisect.bisect_left(self.addresses, file.address)
+        if i > 0 and self.files[self.addresses[i - 1]].end > file.address:
+            i -= 1
+        while i < len(self.addresses) and self.addresses[i] < file.end:
+            self.remove(self.addresses[i])
+        bisect.insort(self.addresses, file.address)
+        self.files[file.address] = file
+        self.notify(file, True)
+
+    def remove(self, address: int):
+        file = self.files.pop(address)
+        del self.addresses[bisect.bisect_left(self.addresses, address)]
+        self.notify(file, False)
+
+    def clear(self):
+        for address in list(self.addresses):
+            self.remove(address)
+
+    def read_size(self, address: int) -> Optional[int]:
+        """
+        :return: size from the allocator header or None if the header can't be read or makes no sense
+        """
+        try:
+            size = self.debugger.get_PAC_size(address)
+        except Exception:
+            return None
+        return size if size > 0 else None
+
+    def identify(self, address: int, size: int) -> Optional[Resident_PAC]:
+        try:
+            name = self.debugger.match_PAC_contents(address, size)
+        except Exception:
+            return None
+        return None if name is None else Resident_PAC(address, size, name)
+
+    def on_load(self, address: int) -> Optional[Resident_PAC]:
+        """
+        Identifies the file just loaded at the address
+        :return: the file or None if it is not a known PAC file (the file that was at the address is forgotten)
+        """
+        size = self.read_size(address)
+        file = None if size is None else self.identify(address, size)
+        known = self.files.get(address)
+        if file is None:
+            if known is not None:
+                self.remove(address)
+            return None
+        if known != file:
+            self.add(file)
+        return file
+
+    def scan(self, addresses: List[int]) -> List[Resident_PAC]:
+        """
+        :return: the known PAC files found at the addresses
+        """
+        found = []
+        for address in addresses:
+            file = self.on_load(address)
+            if file is not None:
+                found.append(file)
+        return found
+
+    def known_sizes(self) -> Set[int]:
+        index = self.debugger.PAC_identification_index
+        if index is not None:
+            return set(index.unique_sizes) | set(index.groups)
+        return set(self.debugger.size_to_PAC)
+
+    def scan_memory(self, start: int = const_user_memory_start, size: int = const_user_memory_size) \
+            -> List[Resident_PAC]:
+        """
+        Finds the files in the range by their allocator headers: a word of the range is a file start if the word
+        before it points to an allocation info in the range and the first word of the info is the end of a file of
+        a known size. The range is read once, the words that look like headers are found with a regular expression
+        (see header_marks) and only they are checked, then only the candidates are identified. The known files of
+        the range that are not found anymore are forgotten
+        :return: the known PAC files of the range
+        """
+        data = self.debugger.dump_memory(start, size)
+        data = data[:len(data) - len(data) % 4]
+        words = unpack_uint32_array(data)
+        end = start + len(data)
+        sizes = self.known_sizes()
+        candidates = []
+        for match in const_header_mark.finditer(header_marks(data, start, end)):
+            position = match.start()
+            header = words[position]
+            if start <= header < end:
+                file_address = start + 4 * (position + 1)
+                if words[(header - start) >> 2] - file_address in sizes:
+                    candidates.append(file_address)
+        self.scan(candidates)
+        found_addresses = set(candidates)
+        for address in list(self.addresses):
+            if start <= address < end and address not in found_addresses and address in self.files:
+                self.remove(address)
+        return [self.files[address] for address in self.addresses if start <= address < end]
+
+    def validate(self, deep: bool = False) -> int:
+        """
+        :param deep: identify every file again, not only the ones whose size changed
+        :return: how many files were forgotten or replaced
+        """
+        changes = 0
+        for address in list(self.addresses):
+            known = self.files.get(address)
+            if known is None:
+                # removed as an overlapped file
+                continue
+            if not deep and self.read_size(address) == known.size:
+                continue
+            if self.on_load(address) != known:
+                changes += 1
+        return changes
+
+    def hook_loader(self, address: int, register: str = "v0"):
+        """
+        Logs the loaded files from the game code
+        :param address: an instruction of the game file loader where the file is loaded and the register holds its
+        address (the return of the loader function for v0)
+        """
+        asyncio.run(self.debugger.debugger.cpu_breakpoint_add(address, enabled=False, log=True,
+                                                              logFormat=f"{const_load_log_marker}{{{register}}}"))
+        self.loader_hooks.append(address)
+
+    def unhook_loader(self):
+        for address in self.loader_hooks:
+            asyncio.run(self.debugger.debugger.cpu_breakpoint_remove(address))
+        self.loader_hooks.clear()
+
+    def handle_log(self, message: str) -> Optional[Resident_PAC]:
+        """
+        :return: the loaded file if the message is a load log of a known file
+        """
+        match = const_load_log_address.search(message)
+        if match is None:
+            return None
+        return self.on_load(int(match.group(1), 16))
+
+    def listen(self, validate_interval: Optional[float] = 5.0, stop: Optional[Callable[[], bool]] = None):
+        """
+        Updates the map from the logs of hook_loader until stop returns True or KeyboardInterrupt. The connection to
+        the emulator stays open, so the loads that come in bursts are not missed
+        :param validate_interval: seconds between validate calls, None disables them
+        """
+        try:
+            asyncio.run(self.listen_async(validate_interval, stop))
+        except KeyboardInterrupt:
+            pass
+
+    async def listen_async(self, validate_interval: Optional[float] = 5.0, stop: Optional[Callable[[], bool]] = None):
+        error = PPSSPPDebugger.const_error_event
+        last_validation = time.monotonic()
+        events = self.debugger.debugger.receive_events({"log"}, error, validate_interval)
+        try:
+            async for event in events:
+                # event is None if nothing has come during validate_interval
+                if event is not None:
+                    if event["event"] == "log":
+                        self.handle_log(event["message"])
+                    else:
+                        print("Error while tracking PAC files:", event.get("message"))
+                if validate_interval is not None and time.monotonic() - last_validation >= validate_interval:
+                    self.validate()
+                    last_validation = time.monotonic()
+                if stop is not None and stop():
+                    break
+        finally:
+            await events.aclose()
+
+
+def track_resident_PACs(debugger: PataponDebugger, scan: bool = True) -> Resident_PAC_tracker:
+    """
+    Creates the tracker of the debugger, then PataponDebugger.identify_PAC (and so inspect_PAC_in_memory) takes the
+    names of the tracked files from it instead of reading the files
+    :param scan: find the files already loaded in the user memory (see Resident_PAC_tracker.scan_memory)
+    """
+    tracker = Resident_PAC_tracker(debugger)
+    if scan:
+        tracker.scan_memory()
+    debugger.resident_PACs = tracker
+    return tracker
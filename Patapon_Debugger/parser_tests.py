@@ -0,0 +1,166 @@
+import hashlib
+import random
+import struct
+
+from PataponDebugger import Cached_memory_view, PAC_file, is_left_out_PAC_args, is_PAC_msg_table, map_file_by_path
+from pac_benchmark import make_synthetic_templates, PAC_generator, create_parser, parse_bytes
+
+# The synthetic files of pac_benchmark are parsed in different ways and compared with a full parse
+
+templates = make_synthetic_templates()
+# random patches of a COUNT argument may ask for billions of arguments
+patchable_templates = {signature: template for signature, template in templates.items()
+                       if not any(param.type.startswith("COUNT_") for param in template.PAC_params)}
+
+
+def describe_entity(offset: int, entity) -> tuple:
+    return (offset, type(entity).__name__, entity.size,
+            bytes(entity.raw_data) if not hasattr(entity, "ordered_PAC_params") else entity.ordered_PAC_params)
+
+
+def describe(file: PAC_file) -> list:
+    return [describe_entity(offset, file.entities[offset]) for offset in file.entities_offsets]
+
+
+def try_parse(data: bytes):
+    # random patches may turn the file into something the parser rejects
+    try:
+        return parse_bytes(patchable_templates, data)
+    except (KeyError, IndexError, UnicodeDecodeError, ValueError, RuntimeError):
+        return None
+
+
+def test_reparse_equals_full_parse():
+    rnd = random.Random(1)
+    checked = 0
+    for seed in range(150):
+        file = try_parse(PAC_generator(patchable_templates, seed).generate(rnd.randrange(5, 60)))
+        if file is None:
+            continue
+        ranges = []
+        for _ in range(rnd.randrange(1, 3)):
+            offset = rnd.randrange(file.size)
+            size = rnd.randrange(1, min(8, file.size - offset) + 1)
+            patch = bytes(rnd.choice([0x25, 0, 1, 2, 8, 0x41, rnd.randrange(256)]) for _ in range(size))
+            ranges.append(file.patch(offset, patch))
+        expected = try_parse(file.raw_data)
+        if expected is None:
+            continue
+        create_parser(patchable_templates).reparse(file, ranges)
+        assert describe(file) == describe(expected), (seed, ranges)
+        checked += 1
+    assert checked > 50
+
+
+def test_reparse_resyncs_after_raw_data():
+    file = parse_bytes(templates, PAC_generator(templates, 5).generate(3000))
+    offsets = file.entities_offsets
+    # a raw entity in the middle of the file that follows an instruction
+    index = next(i for i in range(len(offsets) // 2, len(offsets))
+                 if type(file.entities[offsets[i]]).__name__ == "Memory_entity" and file.entities[offsets[i]].size >= 8
+                 and type(file.entities[offsets[i - 1]]).__name__ == "PAC_instruction")
+    entity = file.entities[offsets[index]]
+    modified = file.patch(offsets[index] + entity.size - 4, b"\x07\x00\x00\x00")
+
+    parser = create_parser(templates)
+    steps = []
+    process_step = parser.processStep
+    parser.processStep = lambda res: steps.append(res) or process_step(res)
+    parser.reparse(file, [modified])
+    # the parser stops at the first old instruction after the raw data instead of going to the end of the file
+    assert len(steps) <= 2
+    assert describe(file) == describe(parse_bytes(templates, file.raw_data))
+
+
+def test_stream_equals_parse(tmp_path):
+    for seed in range(30):
+        data = PAC_generator(templates, seed).generate(200)
+        expected = parse_bytes(templates, data)
+        path = tmp_path / f"{seed}.pac"
+        path.write_bytes(data)
+        with map_file_by_path(str(path)) as mapped:
+            file = PAC_file()
+            file.initialize_by_raw_data(mapped)
+            parser = create_parser(templates)
+            parser.reset(file)
+            # the entities are described as they come, the stream forgets them afterwards
+            streamed = [describe_entity(offset, entity) for offset, entity in parser.stream()]
+            assert len(file.entities) <= 1
+        assert streamed == describe(expected), seed
+        assert file.unknown_instructions_count == expected.unknown_instructions_count
+
+
+def test_cached_memory_view_equals_direct_reads():
+    rnd = random.Random(7)
+    address = 0x09000000
+    for seed in range(30):
+        data = PAC_generator(templates, seed).generate(rnd.randrange(5, 200))
+        reads = []
+
+        def read(start: int, size: int) -> bytes:
+            reads.append((start, size))
+            return data[start - address:start - address + size]
+
+        view = Cached_memory_view(read, address, len(data), page_size=rnd.choice([16, 64, 4096]))
+        file = PAC_file()
+        file.initialize_by_raw_data(view)
+        parser = create_parser(templates)
+        parser.reset(file)
+        parser.parse()
+        assert describe(file) == describe(parse_bytes(templates, data)), seed
+        assert view.hexdigest() == hashlib.md5(data).hexdigest()
+        # every page is read once
+        assert view.fetched_bytes == len(data) and len(reads) == len(set(reads))
+        for _ in range(20):
+            start = rnd.randrange(len(data))
+            stop = rnd.randrange(len(data) + 3)
+            assert view[start:stop] == data[start:stop] and view[start] == data[start] and view[-1] == data[-1]
+            sub = data[start:start + rnd.randrange(1, 4)]
+            assert view.find(sub, stop) == data.find(sub, stop)
+
+
+def reference_is_PAC_msg_table(data: bytes) -> bool:
+    # the int by int check the classifier replaced
+    if len(data) % 4 != 0:
+        return False
+    return all(int.from_bytes(data[offset:offset + 4], "little") == offset // 4 for offset in range(0, len(data), 4))
+
+
+def reference_is_left_out_PAC_args(data: bytes) -> bool:
+    if len(data) % 8 != 0:
+        return False
+    for offset in range(0, len(data), 8):
+        value = int.from_bytes(data[offset:offset + 4], "little")
+        if value > 64 or value & (value - 1) != 0:
+            return False
+    return True
+
+
+def test_classifiers_match_reference():
+    rnd = random.Random(5)
+    cases = [b""]
+    for _ in range(5000):
+        kind = rnd.randrange(5)
+        count = rnd.randrange(40)
+        if kind == 0:
+            data = bytes(rnd.randrange(256) for _ in range(count))
+        elif kind == 1:
+            data = b"".join(struct.pack("<I", i) for i in range(count))
+        elif kind == 2:
+            # a msg table with one flipped bit
+            data = bytearray(b"".join(struct.pack("<I", i) for i in range(count)))
+            if data:
+                data[rnd.randrange(len(data))] ^= 1 << rnd.randrange(8)
+        elif kind == 3:
+            data = b"".join(struct.pack("<II", rnd.choice([0, 1, 2, 4, 8, 16, 32, 64, 65, 128, 0x10000]),
+                                        rnd.randrange(1 << 32)) for _ in range(count)) + bytes(rnd.randrange(2) * 4)
+        else:
+            data = bytes(count)
+        cases.append(bytes(data))
+    # the biggest table first, so the smaller ones don't depend on what was checked before
+    cases.append(b"".join(struct.pack("<I", i) for i in range(5000)))
+    cases.reverse()
+    for data in cases:
+        assert is_PAC_msg_table(data) == reference_is_PAC_msg_table(data), data
+        assert is_left_out_PAC_args(data) == reference_is_left_out_PAC_args(data), data
+    assert any(map(is_PAC_msg_table, cases[1:])) and any(map(is_left_out_PAC_args, cases))
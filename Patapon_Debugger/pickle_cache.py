@@ -0,0 +1,77 @@
+import json
+import os
+import pickle
+import tempfile
+from typing import Any, BinaryIO, Callable, Optional
+
+# Cache files of the debugger tools: a header (magic, version and whatever else tells the cache is up to date)
+# followed by the data, either as two pickles or as one JSON object (for the caches that may be read from shared
+# places, loading JSON can't run code). The file is written to a temporary file in the same directory and renamed
+# over the old one, so the readers (other processes or the next run after a crash) see the old file or the new one,
+# never a half-written one
+
+
+def replace_file(path, write: Callable[[BinaryIO], None]):
+    """
+    :param write: writes the new contents to the given binary file
+    :raises OSError: if the file can't be written, the old file is left as it was
+    """
+    path = os.fspath(path)
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as dest:
+            write(dest)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_cache(path, header: tuple, data: Any):
+    """
+    :raises OSError: if the file can't be written, the old file is left as it was
+    """
+    def write(dest: BinaryIO):
+        pickle.dump(header, dest, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, dest, pickle.HIGHEST_PROTOCOL)
+
+    replace_file(path, write)
+
+
+def load_cache(path, header: tuple) -> Optional[Any]:
+    """
+    :return: the saved data or None if the file is missing, broken or its header is not this one
+    """
+    try:
+        with open(path, "rb") as source:
+            if pickle.load(source) != header:
+                return None
+            return pickle.load(source)
+    except Exception:
+        return None
+
+
+def save_json_cache(path, header: list, data: Any):
+    """
+    :param header: JSON types only (a list, since JSON has no tuples)
+    :raises OSError: if the file can't be written, the old file is left as it was
+    """
+    replace_file(path, lambda dest: dest.write(json.dumps({"header": header, "data": data}).encode("utf-8")))
+
+
+def load_json_cache(path, header: list) -> Optional[Any]:
+    """
+    :return: the saved data or None if the file is missing, broken or its header is not this one
+    """
+    try:
+        with open(path, "rb") as source:
+            cache = json.loads(source.read().decode("utf-8"))
+        if cache["header"] != header:
+            return None
+        return cache["data"]
+    except Exception:
+        return None
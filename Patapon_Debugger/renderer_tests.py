@@ -0,0 +1,85 @@
+import io
+import json
+
+from PataponDebugger import Memory_entity, Padding_bytes, PAC_instruction, Unknown_PAC_instruction, \
+    Switch_case_table, PAC_message_table, Left_out_PAC_arguments, read_shift_jis_from_bytes
+from pac_benchmark import make_synthetic_templates, PAC_generator, parse_bytes
+from pac_renderer import render_entities, entity_to_dict, Binary_disassembly
+
+# The renderer is checked against the text the disassembler wrote before it (reference_disassemble) and against its
+# own JSON Lines and binary outputs
+
+templates = make_synthetic_templates()
+
+
+def reference_value(value) -> str:
+    if isinstance(value, int):
+        return f"{value:X}"
+    elif isinstance(value, str):
+        return "\"" + value.replace("\x00", "") + "\""
+    return f"{value}"
+
+
+def reference_disassemble(entities) -> str:
+    # pac_disassembler.disassemble_entities_to_file as it was before pac_renderer
+    output = io.StringIO()
+    for file_offset, entity in entities:
+        output.write(f"{file_offset:08X}  ")
+        entity_type = type(entity)
+        if entity_type is Memory_entity:
+            output.write(f"Memory entity: size = {entity.size} bytes")
+            try:
+                output.write(f", shift-jis = ({read_shift_jis_from_bytes(entity.raw_data, 0, entity.size)})")
+            except UnicodeDecodeError:
+                pass
+        elif entity_type is Padding_bytes:
+            output.write(f"Padding bytes: count = {entity.size}, all zeroes = {entity.zeroes_only}, "
+                         f"machine word length = {entity.machine_word_length}")
+        elif entity_type is PAC_instruction:
+            args = ", ".join(f"{{{param.type}; {param.name}}}=" + reference_value(value)
+                             for param, value in entity.ordered_PAC_params)
+            output.write(f"{entity.signature:X}:{entity.name}({args})")
+            if entity.cut_off:
+                output.write(" [Warning, instruction unexpectedly ends!]")
+        elif entity_type is Unknown_PAC_instruction:
+            output.write(f"{entity.signature:X}(Unknown): size = {entity.size}")
+        elif entity_type is Switch_case_table:
+            output.write(f"Switch-case table: size = {entity.size} bytes, "
+                         f"branches count = {len(entity.branches)}, addresses: (")
+            output.write(", ".join(f"{branch:X}" for branch in entity.branches) + ")")
+        elif entity_type is PAC_message_table:
+            output.write(f"Message table: size = {entity.size} bytes, message count = {entity.msg_count}")
+        elif entity_type is Left_out_PAC_arguments:
+            output.write(f"Potential left out PAC args: size = {entity.size} bytes, "
+                         f"supposed full size of the instruction = {entity.supposed_size}")
+        output.write("\n")
+    return output.getvalue()
+
+
+def generate_entities(seed: int, count: int) -> list:
+    file = parse_bytes(templates, PAC_generator(templates, seed).generate(count))
+    return [(offset, file.entities[offset]) for offset in file.entities_offsets]
+
+
+def test_text_matches_reference(tmp_path):
+    for seed in range(20):
+        entities = generate_entities(seed, 300)
+        render_entities(entities, tmp_path / "out.txt")
+        assert (tmp_path / "out.txt").read_bytes() == reference_disassemble(entities).encode("utf-8"), seed
+
+
+def test_jsonl_and_binary_outputs(tmp_path):
+    for seed in range(5):
+        entities = generate_entities(seed, 300)
+        render_entities(entities, tmp_path / "out.jsonl", "jsonl")
+        render_entities(entities, tmp_path / "out.pacb", "binary")
+        expected = [json.loads(json.dumps(entity_to_dict(offset, entity), ensure_ascii=False))
+                    for offset, entity in entities]
+        with open(tmp_path / "out.jsonl", encoding="utf-8") as source:
+            assert [json.loads(line) for line in source] == expected
+        with Binary_disassembly(tmp_path / "out.pacb") as disassembly:
+            assert list(disassembly) == expected
+            for index, (offset, entity) in enumerate(entities):
+                assert disassembly.find(offset) == index
+                assert disassembly.raw_data(index) == bytes(entity.raw_data)
+                assert disassembly.signature(index) == getattr(entity, "signature", 0)
@@ -0,0 +1,62 @@
+from typing import Dict, Optional, Tuple
+
+# Null-terminated strings of the game files: the terminator is found with one find call and the whole run is
+# decoded at once. data may be anything with find and slicing (bytes, mmap, Cached_memory_view...)
+#  - utf-8 and shift-jis strings end with a single zero byte (no multibyte shift-jis character contains one)
+#  - utf-16 strings end with a zero character, it is searched at even distances from the string start, so the
+#    strings at odd offsets and the characters with a zero byte are read correctly
+# Decoded strings may be interned (see enable_interning) so the copies of the same text share one object
+
+# text -> the object every copy of the text is replaced with, None if interning is disabled
+interned_strings: Optional[Dict[str, str]] = None
+
+
+def enable_interning():
+    global interned_strings
+    if interned_strings is None:
+        interned_strings = {}
+
+
+def disable_interning():
+    global interned_strings
+    interned_strings = None
+
+
+def intern_string(text: str) -> str:
+    if interned_strings is None:
+        return text
+    return interned_strings.setdefault(text, text)
+
+
+def find_terminator(data, offset: int, width: int = 1) -> int:
+    """
+    :param width: size of the zero character in bytes (1 or 2)
+    :return: offset of the terminator, -1 if there is none
+    """
+    if width == 1:
+        return data.find(b"\x00", offset)
+    end = data.find(b"\x00\x00", offset)
+    while end != -1 and (end - offset) % 2:
+        # the zero bytes belong to two different characters
+        end = data.find(b"\x00\x00", end + 1)
+    return end
+
+
+def decode_string(data, offset: int, encoding: str, width: int = 1) -> str:
+    """
+    Decodes the string at offset up to its terminator (the terminator is not included) or up to the end of data
+    """
+    end = find_terminator(data, offset, width)
+    if end == -1:
+        end = len(data)
+    return intern_string(data[offset:end].decode(encoding))
+
+
+def decode_terminated_string(data, offset: int, encoding: str) -> Tuple[str, int]:
+    """
+    :return: (the string with its zero byte, its size in bytes)
+    """
+    end = find_terminator(data, offset)
+    if end == -1:
+        raise IndexError(f"String at {offset:X} is not terminated")
+    return intern_string(data[offset:end + 1].decode(encoding)), end + 1 - offset